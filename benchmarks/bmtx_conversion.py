@@ -0,0 +1,91 @@
+"""
+Throughput benchmark (MB/s of .mtx input) for MTX -> BMTX conversion.
+
+Runs the native converter (`mtxman.io.bmtx.mtx_to_bmtx`) and, when it has been built
+(`mtxman update-deps --deps distributed_mmio`), distributed_mmio's `mtx_to_bmtx` tool.
+When both are available, their outputs are also compared byte-for-byte.
+The native converter is run with each of the `--workers` process counts, to measure the speedup
+of parallel parsing (only used for files larger than `mtxman.io.mtx.PARALLEL_MIN_SIZE`).
+
+Usage:
+  python benchmarks/bmtx_conversion.py --nnz 5000000
+  python benchmarks/bmtx_conversion.py --nnz 20000000 --workers 1 2 4 8
+  python benchmarks/bmtx_conversion.py --pattern --double-values
+"""
+import argparse
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+from mtxman.core.dependencies import MTX_TO_BMTX_CONVERTER
+from mtxman.io.bmtx import mtx_to_bmtx
+from mtxman.io.mtx import default_workers
+
+
+def write_mtx(path: Path, n: int, nnz: int, pattern: bool, seed: int = 0):
+  rng = np.random.default_rng(seed)
+  rows = rng.integers(1, n + 1, nnz)
+  cols = rng.integers(1, n + 1, nnz)
+  with open(path, 'w') as f:
+    f.write(f"%%MatrixMarket matrix coordinate {'pattern' if pattern else 'real'} general\n")
+    f.write(f'{n} {n} {nnz}\n')
+    if pattern:
+      np.savetxt(f, np.column_stack((rows, cols)), fmt='%d %d')
+    else:
+      vals = rng.standard_normal(nnz)
+      for start in range(0, nnz, 1_000_000):
+        stop = start + 1_000_000
+        f.writelines(f'{r} {c} {v:.17g}\n' for r, c, v in zip(rows[start:stop], cols[start:stop], vals[start:stop]))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--rows', type=int, default=1 << 20)
+  parser.add_argument('--nnz', type=int, default=2_000_000)
+  parser.add_argument('--pattern', action='store_true')
+  parser.add_argument('--double-values', action='store_true')
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, default_workers()}))
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    tmp = Path(tmp)
+    mtx_path = tmp / 'matrix.mtx'
+    write_mtx(mtx_path, args.rows, args.nnz, args.pattern)
+    size_mb = mtx_path.stat().st_size / 1e6
+    print(f'Input: {args.nnz} entries, {size_mb:.1f} MB')
+
+    def run_native(workers):
+      return lambda: mtx_to_bmtx(mtx_path, tmp / 'native.bmtx', args.double_values, workers)
+
+    def run_dmmio():
+      subprocess.run([MTX_TO_BMTX_CONVERTER, mtx_path] + (['-d'] if args.double_values else []), check=True, stdout=subprocess.DEVNULL)
+      shutil.move(mtx_path.with_suffix('.bmtx'), tmp / 'dmmio.bmtx')
+
+    engines = {f'native-{w}': run_native(w) for w in args.workers}
+    if MTX_TO_BMTX_CONVERTER.exists():
+      engines['dmmio'] = run_dmmio
+    else:
+      print(f'distributed_mmio not built ({MTX_TO_BMTX_CONVERTER}), benchmarking the native converter only')
+
+    for name, run in engines.items():
+      best = float('inf')
+      for _ in range(args.repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+      print(f'{name:>10}: {best:8.3f} s  {size_mb / best:8.1f} MB/s')
+
+    if 'dmmio' in engines:
+      identical = (tmp / 'native.bmtx').read_bytes() == (tmp / 'dmmio.bmtx').read_bytes()
+      print(f"Outputs {'are identical' if identical else 'DIFFER'}")
+      if not identical:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
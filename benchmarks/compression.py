@@ -0,0 +1,114 @@
+"""
+Compression ratio and decode throughput of compressed matrix files (`mtxman.io.compressed`),
+against reading the uncompressed `.mtx` / `.bmtx` files.
+
+For each input format and codec, reports the compression ratio, the compression throughput, the
+throughput of decoding every entry with each of the `--workers` thread counts (MB/s of the
+uncompressed file), and the average time to read a random range of `--row-range` rows.
+The uncompressed baselines stream the entries with `mtxman.io.stats.iter_entries`. Files are
+read back right after being written, so they are usually in the page cache: the decode numbers
+measure CPU cost, not disk bandwidth (which is where compression pays off on shared storage).
+
+Usage:
+  python benchmarks/compression.py --nnz 5000000
+  python benchmarks/compression.py --nnz 20000000 --codecs zstd --workers 1 2 4 8
+  python benchmarks/compression.py --pattern --block-size 1
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+from mtxman.io import compressed, stats
+from mtxman.io.bmtx import mtx_to_bmtx
+from mtxman.io.mtx import default_workers
+
+
+def write_mtx(path: Path, n: int, nnz: int, pattern: bool, seed: int = 0):
+  """Random matrix with entries sorted by row (as after `postprocess: [sort]`), so row ranges map to few blocks."""
+  rng = np.random.default_rng(seed)
+  rows = np.sort(rng.integers(1, n + 1, nnz))
+  cols = rng.integers(1, n + 1, nnz)
+  with open(path, 'w') as f:
+    f.write(f"%%MatrixMarket matrix coordinate {'pattern' if pattern else 'real'} general\n")
+    f.write(f'{n} {n} {nnz}\n')
+    if pattern:
+      np.savetxt(f, np.column_stack((rows, cols)), fmt='%d %d')
+    else:
+      vals = rng.standard_normal(nnz).astype(np.float32)
+      for start in range(0, nnz, 1_000_000):
+        stop = start + 1_000_000
+        f.writelines(f'{r} {c} {v:.9g}\n' for r, c, v in zip(rows[start:stop], cols[start:stop], vals[start:stop].tolist()))
+
+
+def best_of(repeat: int, run) -> float:
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    run()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+def consume(chunks):
+  """Touches every entry (memory-mapped chunks are not read until used)."""
+  for chunk in chunks:
+    for array in chunk:
+      if array is not None:
+        array.max()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--rows', type=int, default=1 << 20)
+  parser.add_argument('--nnz', type=int, default=2_000_000)
+  parser.add_argument('--pattern', action='store_true')
+  parser.add_argument('--codecs', nargs='+', default=[c.value for c in compressed.Codec], choices=[c.value for c in compressed.Codec])
+  parser.add_argument('--block-size', type=float, default=compressed.BLOCK_SIZE / 2 ** 20, help='Block size (MiB)')
+  parser.add_argument('--row-range', type=int, default=1000, help='Rows read by each random access')
+  parser.add_argument('--lookups', type=int, default=50)
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, default_workers()}))
+  args = parser.parse_args()
+  block_size = int(args.block_size * 2 ** 20)
+  rng = np.random.default_rng(1)
+  starts = rng.integers(0, max(1, args.rows - args.row_range), args.lookups)
+
+  with tempfile.TemporaryDirectory() as tmp:
+    tmp = Path(tmp)
+    sources = {'mtx': tmp / 'matrix.mtx', 'bmtx': tmp / 'matrix.bmtx'}
+    write_mtx(sources['mtx'], args.rows, args.nnz, args.pattern)
+    mtx_to_bmtx(sources['mtx'], sources['bmtx'])
+    print(f'Input: {args.nnz} entries, blocks of {block_size / 2 ** 20:g} MiB')
+
+    for source_format, source in sources.items():
+      size_mb = source.stat().st_size / 1e6
+      read = best_of(args.repeat, lambda: consume(stats.iter_entries(source)))
+      print(f'\n{source_format} ({size_mb:.1f} MB): uncompressed read {read:7.3f} s  {size_mb / read:8.1f} MB/s')
+
+      for codec in map(compressed.Codec, args.codecs):
+        try:
+          compressed.check_codec(codec)
+        except Exception as e:
+          print(f'  {codec.value}: skipped ({e})')
+          continue
+        output = tmp / f'{source.name}.{codec.value}{compressed.COMPRESSED_SUFFIX}'
+        write = best_of(args.repeat, lambda: compressed.compress_file(source, output, codec, block_size, max(args.workers)))
+        ratio = source.stat().st_size / output.stat().st_size
+        print(f'  {codec.value:>4}: ratio {ratio:5.2f}x  compress ({max(args.workers)} threads) {size_mb / write:8.1f} MB/s')
+        with compressed.CompressedMatrix(output) as matrix:
+          for workers in args.workers:
+            decode = best_of(args.repeat, lambda: consume(matrix.iter_coo_chunks(workers=workers)))
+            print(f'        decode {workers:>2} threads {decode:7.3f} s  {size_mb / decode:8.1f} MB/s')
+          start = time.perf_counter()
+          blocks = 0
+          for row in starts:
+            blocks += len(matrix.blocks_for_rows(int(row), int(row) + args.row_range))
+            matrix.read_rows(int(row), int(row) + args.row_range)
+          lookup = (time.perf_counter() - start) / args.lookups
+          print(f'        {args.row_range} rows: {lookup * 1e3:7.2f} ms ({blocks / args.lookups:.1f} blocks of {len(matrix.blocks)})')
+
+
+if __name__ == '__main__':
+  main()
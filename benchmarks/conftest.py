@@ -0,0 +1,45 @@
+import functools
+import http.server
+import threading
+from pathlib import Path
+
+import pytest
+
+
+def pytest_addoption(parser):
+  parser.addoption('--scale', type=float, default=1.0, help='Multiplies the size of the benchmark fixtures')
+
+
+@pytest.fixture(scope='session')
+def scale(request) -> float:
+  return request.config.getoption('--scale')
+
+
+@pytest.fixture(scope='session', autouse=True)
+def isolated_cache(tmp_path_factory):
+  """Metadata and index caches of MtxMan go to a temporary folder (read when MtxMan is imported, by the cases)."""
+  with pytest.MonkeyPatch.context() as monkeypatch:
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path_factory.mktemp('cache')))
+    yield
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+  def log_message(self, *args):
+    pass
+
+
+@pytest.fixture(scope='session')
+def http_server():
+  """Serves folders over HTTP on local ports (stand-in for download servers): `http_server(root)` returns the URL of `root`."""
+  servers = []
+
+  def serve(root: Path) -> str:
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(_QuietHandler, directory=str(root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    servers.append(server)
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+  yield serve
+  for server in servers:
+    server.shutdown()
+    server.server_close()
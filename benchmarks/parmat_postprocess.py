@@ -0,0 +1,80 @@
+"""
+Throughput benchmark for the PaRMAT post-processing step (edge list -> .mtx).
+
+Compares the streaming converter (`mtxman.generators.parmat.parmat_to_mtx`)
+with the previous implementation, which read the whole file in memory and
+rewrote it in place.
+
+Usage:
+  python benchmarks/parmat_postprocess.py --edges 2000000
+"""
+import argparse
+import random
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from mtxman.generators.parmat import parmat_to_mtx
+
+
+def write_edge_list(path: Path, N: int, M: int, seed: int = 0):
+  rng = random.Random(seed)
+  with open(path, 'w') as f:
+    for _ in range(M):
+      f.write(f'{rng.randrange(N)}\t{rng.randrange(N)}\n')
+
+
+def legacy_rewrite(path: Path, N: int, M: int):
+  """The in-memory, regex based rewrite used before the streaming converter."""
+  with open(path, 'r+') as f:
+    content = f.read()
+    lines = content.split('\n')
+    coords = []
+    for line in lines:
+      line = re.sub(r'\s+', ' ', line)
+      rc = line.split(' ')
+      if len(rc) == 2:
+        r, c = rc
+        coords.append(f'{int(r)+1} {int(c)+1}')
+    f.seek(0, 0)
+    f.write('%%MatrixMarket matrix coordinate pattern general\n')
+    f.write(f'{N} {N} {M}\n')
+    f.write('\n'.join(coords))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--vertices', type=int, default=1 << 20)
+  parser.add_argument('--edges', type=int, default=1_000_000)
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    tmp = Path(tmp)
+    edge_list = tmp / 'edges.txt'
+    write_edge_list(edge_list, args.vertices, args.edges)
+    size_mb = edge_list.stat().st_size / 1e6
+    print(f'Edge list: {args.edges} edges, {size_mb:.1f} MB')
+
+    results = {}
+    for name in ('legacy', 'streaming'):
+      best = float('inf')
+      for _ in range(args.repeat):
+        work = tmp / f'{name}.txt'
+        shutil.copyfile(edge_list, work)
+        start = time.perf_counter()
+        if name == 'legacy':
+          legacy_rewrite(work, args.vertices, args.edges)
+        else:
+          parmat_to_mtx(work, tmp / f'{name}.mtx', args.vertices, args.edges)
+        best = min(best, time.perf_counter() - start)
+      results[name] = best
+      print(f'{name:>10}: {best:8.3f} s  {args.edges / best / 1e6:8.2f} M edges/s')
+
+    print(f'{"speedup":>10}: {results["legacy"] / results["streaming"]:8.2f}x')
+
+
+if __name__ == '__main__':
+  main()
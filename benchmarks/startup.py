@@ -0,0 +1,85 @@
+"""
+Startup time of the `mtxman` CLI, with a budget for `--version` and `--help`.
+
+Runs `python -m mtxman.cli --version` and `--help` in fresh interpreters (`--repeat` times each,
+the median wall time is reported), then imports the CLI under `python -X importtime` to list
+the slowest imports. Commands import their backends lazily, so the modules of `--forbid`
+(NumPy, requests, YAML, BeautifulSoup) must not be imported by the CLI module itself.
+
+Exits with status 1 if a command exceeds its budget or a forbidden module is imported, so that
+it can be run by CI. The interpreter alone takes part of the budget: check it with `--baseline`.
+
+Usage:
+  python benchmarks/startup.py
+  python benchmarks/startup.py --repeat 20 --top 15
+  python benchmarks/startup.py --version-budget-ms 150 --help-budget-ms 250 --baseline
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)\s*$')
+
+
+def median_ms(command, repeat: int) -> float:
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    times.append((time.perf_counter() - start) * 1e3)
+  return statistics.median(times)
+
+
+def import_times(module: str):
+  """(module, self us, cumulative us, depth) for every module imported by `import module`."""
+  result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          check=True, capture_output=True, text=True)
+  entries = []
+  for line in result.stderr.splitlines():
+    match = IMPORTTIME_LINE.match(line)
+    if match:
+      self_us, cumulative_us, indent, name = match.groups()
+      entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+  return entries
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--repeat', type=int, default=10)
+  parser.add_argument('--version-budget-ms', type=float, default=300)
+  parser.add_argument('--help-budget-ms', type=float, default=400)
+  parser.add_argument('--top', type=int, default=10, help='Slowest imports to list (cumulative time)')
+  parser.add_argument('--forbid', nargs='*', default=['numpy', 'requests', 'yaml', 'bs4'],
+                      help='Top-level modules that importing the CLI must not import')
+  parser.add_argument('--baseline', action='store_true', help='Also time a bare interpreter start')
+  args = parser.parse_args()
+  failed = False
+
+  if args.baseline:
+    print(f"{'python -c pass':<32} {median_ms([sys.executable, '-c', 'pass'], args.repeat):8.1f} ms")
+  for flag, budget in (('--version', args.version_budget_ms), ('--help', args.help_budget_ms)):
+    elapsed = median_ms([sys.executable, '-m', 'mtxman.cli', flag], args.repeat)
+    over = elapsed > budget
+    failed |= over
+    print(f"{'mtxman ' + flag:<32} {elapsed:8.1f} ms  (budget {budget:g} ms){'  OVER BUDGET' if over else ''}")
+
+  entries = import_times('mtxman.cli')
+  total = next((cumulative for name, _, cumulative, depth in entries if name == 'mtxman.cli' and depth == 0), 0)
+  print(f'\nimport mtxman.cli: {total / 1e3:.1f} ms, {len(entries)} modules. Slowest top-level imports:')
+  top_level = sorted((e for e in entries if e[3] <= 1), key=lambda e: e[2], reverse=True)
+  for name, _, cumulative, _ in top_level[:args.top]:
+    print(f'  {cumulative / 1e3:8.1f} ms  {name}')
+
+  imported = {name.split('.')[0] for name, _, _, _ in entries}
+  forbidden = sorted(imported & set(args.forbid))
+  if forbidden:
+    failed = True
+    print(f"\nImporting the CLI imports {', '.join(forbidden)}: import them in the commands that use them")
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+  main()
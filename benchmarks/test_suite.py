@@ -0,0 +1,218 @@
+"""
+Benchmark suite for the hot paths of a sync, run with pytest-benchmark to store results and detect
+regressions between versions.
+
+Cases (on fixtures generated in a temporary folder, with fixed seeds; `--scale` multiplies their size):
+  mtx_header          read the headers of 2000 `.mtx` files (`mtxman.io.stats.read_info`)
+  parmat_postprocess  PaRMAT edge list (1M edges) -> `.mtx` (`mtxman.generators.parmat.parmat_to_mtx`)
+  mtx_to_bmtx         native MTX -> BMTX conversion of 1M entries (`mtxman.io.bmtx.mtx_to_bmtx`)
+  summaries           register 10k matrices and write the category and global summaries
+  metadata_csv        `matrices_metadata.csv` of 10k matrices (`mtxman.core.metadata.export_metadata_csv`)
+  config_load         load a YAML configuration with 1000 categories (`mtxman.core.core.load_config_file`)
+  tar_extract         extract one matrix from a `.tar.gz` archive (`mtxman.core.archive.extract_tar_stream`)
+  http_download       download a matrix from a local HTTP server (`mtxman.core.http.Downloader.download`)
+  http_tar_stream     stream the `.tar.gz` archive from the local HTTP server and extract the matrix
+
+Cases reading a single input record its size as `input_bytes` in their `extra_info` (throughput =
+input_bytes / median). Timings depend on the machine (and its load): only compare results from the
+same machine, with the same `--scale`.
+
+Usage:
+  pytest benchmarks --benchmark-autosave
+  pytest benchmarks --benchmark-compare --benchmark-compare-fail=median:25%
+  pytest benchmarks -k "mtx_to_bmtx or tar_extract" --scale 4
+"""
+import io
+import tarfile
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+
+def scaled(n: int, scale: float) -> int:
+  return max(1, int(n * scale))
+
+
+# Fixtures
+# MtxMan modules are imported by the cases, once `isolated_cache` has moved the MtxMan cache to a temporary folder
+
+def write_mtx(path: Path, n: int, nnz: int, seed: int = 0, comments: int = 0):
+  rng = np.random.default_rng(seed)
+  rows = rng.integers(1, n + 1, nnz)
+  cols = rng.integers(1, n + 1, nnz)
+  vals = rng.standard_normal(nnz)
+  path.parent.mkdir(parents=True, exist_ok=True)
+  with open(path, 'w') as f:
+    f.write('%%MatrixMarket matrix coordinate real general\n')
+    f.writelines(f'% comment line {i}\n' for i in range(comments))
+    f.write(f'{n} {n} {nnz}\n')
+    np.savetxt(f, np.column_stack((rows, cols, vals)), fmt='%d %d %.6g')
+
+
+def write_tarball(path: Path, members: Dict[str, Path], padding: int, seed: int = 0):
+  """`.tar.gz` archive with the `members` files and `padding` bytes of other (random, incompressible) files before them."""
+  rng = np.random.default_rng(seed)
+  with tarfile.open(path, 'w:gz') as tar:
+    for i in range(4):
+      data = rng.bytes(padding // 4)
+      info = tarfile.TarInfo(f'matrix/extra_{i}.bin')
+      info.size = len(data)
+      tar.addfile(info, io.BytesIO(data))
+    for name, member in members.items():
+      tar.add(member, arcname=name)
+
+
+def dataset_files(base_path: Path, count: int) -> List[Path]:
+  """`count` small matrix files spread over the Graph500, PaRMAT and DirectURL folders of two categories."""
+  files = []
+  for i in range(count):
+    category = f'cat{i % 2}'
+    if i % 3 == 0:
+      path = base_path / category / 'Graph500' / f'graph500_{4 + i % 8}_8_seed{i}-{i + 1}.mtx'
+    elif i % 3 == 1:
+      path = base_path / category / 'PaRMAT' / f'parmat_N{1000 + i}_M5000_a450_b150_c150.mtx'
+    else:
+      path = base_path / category / 'DirectURL' / f'matrix{i}' / f'matrix{i}.mtx'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(f'%%MatrixMarket matrix coordinate real general\n{i + 1} {i + 1} 1\n1 1 1.0\n')
+    files.append(path)
+  return files
+
+
+@pytest.fixture(scope='module')
+def tarball(tmp_path_factory, scale) -> Path:
+  tmp = tmp_path_factory.mktemp('serve')
+  matrix = tmp_path_factory.mktemp('archive') / 'matrix.mtx'
+  write_mtx(matrix, 1 << 16, scaled(500_000, scale))
+  path = tmp / 'archive.tar.gz'
+  write_tarball(path, {'matrix/matrix.mtx': matrix}, scaled(8 << 20, scale))
+  return path
+
+
+def _select_matrix(dest: Path):
+  return lambda name: dest if name.endswith('.mtx') else None
+
+
+# Cases
+
+def test_mtx_header(benchmark, tmp_path, scale):
+  """Read the headers of 2000 .mtx files."""
+  from mtxman.io.stats import read_info
+  paths = []
+  for i in range(scaled(2000, scale)):
+    path = tmp_path / f'm{i}.mtx'
+    write_mtx(path, 1000, 10, seed=i, comments=20)
+    paths.append(path)
+
+  def run():
+    for path in paths:
+      read_info(path)
+  benchmark(run)
+
+
+def test_parmat_postprocess(benchmark, tmp_path, scale):
+  """PaRMAT edge list (1M edges) to .mtx."""
+  from mtxman.generators.parmat import parmat_to_mtx
+  n, m = 1 << 20, scaled(1_000_000, scale)
+  rng = np.random.default_rng(0)
+  edge_list = tmp_path / 'parmat.txt'
+  np.savetxt(edge_list, rng.integers(0, n, (m, 2)), fmt='%d', delimiter='\t')
+  benchmark.extra_info['input_bytes'] = edge_list.stat().st_size
+  benchmark(parmat_to_mtx, edge_list, tmp_path / 'parmat.mtx', n, m)
+
+
+def test_mtx_to_bmtx(benchmark, tmp_path, scale):
+  """Native MTX to BMTX conversion (1M entries)."""
+  from mtxman.io.bmtx import mtx_to_bmtx
+  path = tmp_path / 'convert.mtx'
+  write_mtx(path, 1 << 20, scaled(1_000_000, scale))
+  benchmark.extra_info['input_bytes'] = path.stat().st_size
+  benchmark(mtx_to_bmtx, path, tmp_path / 'convert.bmtx')
+
+
+def test_summaries(benchmark, tmp_path, scale):
+  """Register 10k matrices and write the summaries."""
+  from mtxman.core.core import DatasetManager
+  files = dataset_files(tmp_path, scaled(10_000, scale))
+
+  def run():
+    DatasetManager.all_matrices = []
+    managers = {}
+    for path in files:
+      category = path.relative_to(tmp_path).parts[0]
+      if category not in managers:
+        managers[category] = DatasetManager(tmp_path, category)
+      managers[category].register_matrix_path(path, False)
+    for manager in managers.values():
+      manager.write_category_summary()
+    DatasetManager.write_global_summary(tmp_path)
+  benchmark(run)
+
+
+def test_metadata_csv(benchmark, tmp_path, scale):
+  """matrices_metadata.csv of 10k matrices."""
+  from mtxman.core.metadata import export_metadata_csv
+  files = dataset_files(tmp_path, scaled(10_000, scale))
+  benchmark(export_metadata_csv, tmp_path.resolve(), files, tmp_path / 'matrices_metadata.csv')
+
+
+def test_config_load(benchmark, tmp_path, scale):
+  """Load a YAML configuration with 1000 categories."""
+  from mtxman.core.core import load_config_file
+  path = tmp_path / 'config.yaml'
+  with open(path, 'w') as f:
+    f.write(f"path: {tmp_path / 'datasets'}\n")
+    for i in range(scaled(1000, scale)):
+      f.write(
+        f'category_{i}:\n'
+        f'  postprocess: [sort, dedup]\n'
+        f'  generators:\n'
+        f'    graph500: {{ scale: [4, 6, 8], edge_factor: [5, 10], engine: native }}\n'
+        f'    parmat:\n'
+        f'      defaults: {{ N: 32, a: 0.25, b: 0.25, c: 0.25, undirected: 1 }}\n'
+        f'      matrices: [{{ M: 64 }}, {{ M: 128 }}, {{ N: 64, M: 64, noEdgeToSelf: 1 }}]\n'
+        f'  suite_sparse_matrix_list: [HB/ash219, HB/arc130, Averous/epb0]\n'
+        f'  suite_sparse_matrix_range: {{ min_nnzs: 100, max_nnzs: 1000, limit: 4, kind: [graph], sort_by: -nnz }}\n'
+        f'  direct_urls:\n'
+        f'    - {{ url: "https://example.org/MM/HB/m{i}.tar.gz", filename: m{i}.mtx, rename: r{i}.mtx }}\n'
+      )
+  benchmark(load_config_file, path)
+
+
+def test_tar_extract(benchmark, tmp_path, tarball):
+  """Extract one matrix from a .tar.gz archive."""
+  from mtxman.core.archive import extract_tar_stream
+
+  def run():
+    with open(tarball, 'rb') as f:
+      extract_tar_stream(f, _select_matrix(tmp_path / 'extracted.mtx'))
+  benchmark.extra_info['input_bytes'] = tarball.stat().st_size
+  benchmark(run)
+
+
+def test_http_download(benchmark, tmp_path, scale, http_server):
+  """Download a matrix from a local HTTP server."""
+  from mtxman.core.http import Downloader
+  path = tmp_path / 'serve' / 'download.mtx'
+  write_mtx(path, 1 << 20, scaled(1_000_000, scale))
+  url = f'{http_server(path.parent)}/{path.name}'
+  downloader = Downloader()
+  dest = tmp_path / 'downloaded.mtx'
+
+  def run():
+    dest.unlink(missing_ok=True)
+    downloader.download(url, dest)
+  benchmark.extra_info['input_bytes'] = path.stat().st_size
+  benchmark(run)
+
+
+def test_http_tar_stream(benchmark, tmp_path, tarball, http_server):
+  """Stream a .tar.gz archive from a local HTTP server and extract the matrix."""
+  from mtxman.core.archive import extract_tar_stream
+  from mtxman.core.http import Downloader
+  url = f'{http_server(tarball.parent)}/{tarball.name}'
+  downloader = Downloader()
+  benchmark.extra_info['input_bytes'] = tarball.stat().st_size
+  benchmark(downloader.stream, url, lambda f: extract_tar_stream(f, _select_matrix(tmp_path / 'streamed.mtx')))
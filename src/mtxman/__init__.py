@@ -0,0 +1,29 @@
+"""
+MtxMan: download, generate and convert sparse matrices.
+
+`mtxman.load(path)` loads the CSR export of a synced matrix (see `mtxman.io.csr`), and
+`mtxman.read_bmtx(path)` memory-maps the entries of a `.bmtx` file (see `mtxman.io.bmtx`).
+"""
+import importlib
+
+__all__ = ['BmtxMatrix', 'CsrMatrix', 'load', 'read_bmtx']
+
+# Imported on first access (PEP 562), so that importing the CLI does not import NumPy
+_LAZY_ATTRIBUTES = {
+  'BmtxMatrix': 'mtxman.io.bmtx',
+  'read_bmtx': 'mtxman.io.bmtx',
+  'CsrMatrix': 'mtxman.io.csr',
+  'load': 'mtxman.io.csr',
+}
+
+
+def __getattr__(name: str):
+  if name in _LAZY_ATTRIBUTES:
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    globals()[name] = value
+    return value
+  raise AttributeError(f"module 'mtxman' has no attribute '{name}'")
+
+
+def __dir__():
+  return sorted(set(globals()) | set(__all__))
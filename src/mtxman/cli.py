@@ -1,24 +1,27 @@
-import importlib
+import os
+import time
 from pathlib import Path
 import typer
 from typing_extensions import Annotated
 from typing import List, Optional
 from rich.console import Console
 
+# Only light modules are imported here: commands import their backends (NumPy, requests, YAML...)
+# when they run, so that '--version', '--help' and scripted calls start fast
+from mtxman import enums
 from mtxman.exceptions import MtxManError
-import mtxman.core.core as core
-import mtxman.core.dependencies as dependencies
-import mtxman.generators.graph500 as graph500_generator
-import mtxman.generators.parmat as parmat_generator
-import mtxman.downloaders.suite_sparse as suite_sparse_downloader
-import mtxman.downloaders.direct_url as direct_url_downloader
+import mtxman.core.manifest as manifest
+import mtxman.core.store as store
 
 app = typer.Typer(help="A utility that simplifies the download and generation of Matrix Market (`.mtx`) files.", add_completion=True)
+index_app = typer.Typer(help="Manage the local index of the SuiteSparse Matrix Collection.")
+app.add_typer(index_app, name="index")
 console = Console()
 
 def version_callback(value: bool):
   if not value:
     return
+  import importlib.metadata
   try:
     console.print(f"MtxMan version: [bold cyan]{importlib.metadata.version('mtxman')}[/bold cyan]")
   except importlib.metadata.PackageNotFoundError:
@@ -51,83 +54,311 @@ def sync(
   binary_mtx: bool = typer.Option(False, "--binary-mtx", "-bmtx", help="Generate binary '.bmtx' files."),
   keep_mtx: bool = typer.Option(False, "--keep-mtx", "-kmtx", help="(Used with --binary-mtx) Keep original '.mtx' files."),
   binary_mtx_double_vals: bool = typer.Option(False, "--binary-mtx-double-vals", "-bmtxd", help="(Used with --binary-mtx) Store values using 8 bytes instead of 4."),
-  skip_metadata: bool = typer.Option(False, "--skip-metadata", "-nometa", help="If set, the 'matrices_metadata.csv' file will not be generated.")
+  converter: enums.BmtxConverter = typer.Option(enums.BmtxConverter.DMMIO, "--converter", help="(Used with --binary-mtx) 'native' uses the built-in converter, 'dmmio' builds and runs distributed_mmio's mtx_to_bmtx."),
+  skip_metadata: bool = typer.Option(False, "--skip-metadata", "-nometa", help="If set, the 'matrices_metadata.csv' file will not be generated."),
+  deep_stats: bool = typer.Option(False, "--deep-stats", help="Add row statistics (empty rows, min/max/avg row nnz, bandwidth, degree histogram) to 'matrices_metadata.csv'. Reads every matrix once."),
+  jobs: int = typer.Option(1, "--jobs", "-j", help="Number of concurrent conversion jobs. Also the default for '--net-jobs' and '--cpu-jobs'."),
+  net_jobs: Optional[int] = typer.Option(None, "--net-jobs", help="Number of concurrent downloads (default: '--jobs') and metadata lookups (default: 8)."),
+  cpu_jobs: Optional[int] = typer.Option(None, "--cpu-jobs", help="Number of concurrent generator runs (default: '--jobs')."),
+  queue_size: int = typer.Option(2, "--queue-size", help="Maximum number of matrices waiting between two stages (download, extraction, conversion)."),
+  min_free_scratch: float = typer.Option(1.0, "--min-free-scratch", help="Free space (GB) that downloads must leave in the scratch folder."),
+  connections: int = typer.Option(1, "--connections", "-c", help="Concurrent connections used to download large files (segmented download)."),
+  parse_jobs: Optional[int] = typer.Option(None, "--parse-jobs", help="(Used with --converter native) Processes used to parse large '.mtx' files (default: all CPUs)."),
+  generator_threads: Optional[int] = typer.Option(None, "--generator-threads", help="Threads of each Graph500 generator run, processes of each 'engine: native' generator run (default: all CPUs)."),
+  postprocess_memory: float = typer.Option(1.0, "--postprocess-memory", help="Memory (GB) used by each 'postprocess:' run (sort and dedup spill to disk beyond it), CSR export and sharding."),
+  compress: Optional[enums.Codec] = typer.Option(None, "--compress", help="Store matrix files as '<file>.cblk': independently compressed blocks with a block index (needs the 'zstandard' or 'lz4' package)."),
+  csr: bool = typer.Option(False, "--csr", help="Also export every matrix to a '.csr' folder of raw arrays, loadable with 'mtxman.load(path)'."),
+  shards: int = typer.Option(0, "--shards", min=0, help="Also split every matrix into N row shards (one file per rank) in a '.shards' folder with a 'partition.json' manifest."),
+  partition: enums.Partition = typer.Option(enums.Partition.NNZ_BALANCED, "--partition", help="(Used with --shards) 'rows' gives every shard the same number of rows, 'nnz-balanced' the same number of entries."),
+  store_path: Optional[str] = typer.Option(None, "--store", help=f"Folder of the matrix store, which can be shared by several configurations (default: '<path>/{store.STORE_DIRNAME}')."),
+  no_store: bool = typer.Option(False, "--no-store", help="Do not use the matrix store: every category keeps its own copy of its matrices."),
+  trace: Optional[str] = typer.Option(None, "--trace", help="Write the wall time, bytes in/out, peak RSS and child CPU time of every stage of every matrix to this file: JSON lines if it ends with '.jsonl', a Chrome trace (chrome://tracing, ui.perfetto.dev) otherwise."),
+  verify: bool = typer.Option(False, "--verify", help=f"Re-hash every matrix recorded in '<path>/{manifest.MANIFEST_FILENAME}' (with '--cpu-jobs' threads, default: all CPUs) and sync again the corrupted ones."),
 ):
   """
   Synchronizes the matrices configured via '[FILE]'
   """
+  import mtxman.core.core as core
+  import mtxman.core.dependencies as dependencies
+  import mtxman.core.scheduler as scheduler
+  import mtxman.core.trace as tracing
+  import mtxman.generators.graph500 as graph500_generator
+  import mtxman.generators.parmat as parmat_generator
+  import mtxman.downloaders.suite_sparse as suite_sparse_downloader
+  import mtxman.downloaders.direct_url as direct_url_downloader
+  import mtxman.io.compressed as compressed_io
+  import mtxman.io.mtx as mtx_io
+
   config = core.load_config_file(Path(file))
   flags = core.Flags(
     binary_mtx=binary_mtx,
     binary_mtx_double_vals=binary_mtx_double_vals,
     keep_mtx=keep_mtx,
     keep_all_files=keep_all_files,
+    scratch_min_free=int(min_free_scratch * 1e9),
+    download_connections=connections,
+    converter=converter,
+    parse_jobs=parse_jobs,
+    generator_threads=generator_threads,
+    postprocess_memory=int(postprocess_memory * 1e9),
+    csr=csr,
+    compress=compress,
+    shards=shards,
+    partition=partition,
   )
+
+  if compress is not None:
+    try:
+      compressed_io.check_codec(compress)
+    except MtxManError as e:
+      console.print(f"[bold red]{e}[/bold red]")
+      raise typer.Exit(code=1)
   
-  if binary_mtx:
-    dependencies.download_and_build_mtx_to_bmtx_converter()
-    
+  if binary_mtx and converter == core.BmtxConverter.DMMIO:
+    # Built in the background, while the first matrices are downloaded
+    dependencies.prepare(dependencies.DEPS.DISTRIBUTED_MMIO)
+
+  # Native parsers and generators share one process pool: size it once, before any job uses it
+  mtx_io.configure_process_pool(max(parse_jobs or mtx_io.default_workers(), generator_threads or mtx_io.default_workers()))
+
+  sync_scheduler = scheduler.SyncScheduler(
+    net_jobs=net_jobs or jobs,
+    cpu_jobs=cpu_jobs or jobs,
+    convert_jobs=jobs,
+    extract_jobs=jobs,
+    queue_size=queue_size,
+    tracer=tracing.Tracer(),
+  )
+  category_datasets_managers: List[core.DatasetManager] = []
+  matrix_store = None if no_store else store.MatrixStore(Path(store_path) if store_path else config.path / store.STORE_DIRNAME)
+  config.path.mkdir(parents=True, exist_ok=True)
+  sync_manifest = manifest.SyncManifest(config.path)
+
+  if verify:
+    console.print('[bold green]>> Verifying the synced matrices...[/bold green]')
+    start = time.perf_counter()
+    stats = sync_manifest.verify(jobs=cpu_jobs or os.cpu_count() or 1, store=matrix_store)
+    console.print(f"[green]{stats.verified} matrices verified, {stats.invalid} corrupted, {stats.missing} missing ({time.perf_counter() - start:.2f}s)[/green]")
+
   for category_name, category_config in config.categories.items():
     if category_name in skip:
       console.print(f'[bold yellow]>> Skipping category "{category_name}"[/bold yellow]')
       continue
 
-    console.print(f'[bold green]>> Syncing category "{category_name}"...[/bold green]')
-
-    category_datasets_manager = core.DatasetManager(config.path, category_name, keep_mtx)
-
-    parmat_generator.generate(
-      config=category_config,
-      flags=flags,
-      dataset_manager=category_datasets_manager,
-    )
-    graph500_generator.generate(
-      config=category_config,
-      flags=flags,
-      dataset_manager=category_datasets_manager
-    )
-    suite_sparse_downloader.download_list(
-      config=category_config,
-      flags=flags,
-      dataset_manager=category_datasets_manager
-    )
-    suite_sparse_downloader.download_range(
-      config=category_config,
-      flags=flags,
-      dataset_manager=category_datasets_manager
-    )
-    direct_url_downloader.download_url_list(
-      config=category_config,
-      flags=flags,
-      dataset_manager=category_datasets_manager
-    )
+    console.print(f'[bold green]>> Planning category "{category_name}"...[/bold green]')
 
-    category_datasets_manager.write_category_summary()
+    category_datasets_manager = core.DatasetManager(config.path, category_name, keep_mtx, matrix_store, sync_manifest, csr, shards, partition)
+    category_datasets_managers.append(category_datasets_manager)
 
-    console.print(f'[bold green]>> Category "{category_name}", up to date![/bold green]\n')
+    for plan in (
+      parmat_generator.plan,
+      graph500_generator.plan,
+      suite_sparse_downloader.plan_list,
+      suite_sparse_downloader.plan_range,
+      direct_url_downloader.plan,
+    ):
+      sync_scheduler.add(plan(
+        config=category_config,
+        flags=flags,
+        dataset_manager=category_datasets_manager,
+      ))
 
-  core.DatasetManager.write_global_summary(config.path, keep_mtx)
+  console.print('[bold green]>> Syncing matrices...[/bold green]')
+  sync_scheduler.run()
+  console.print(f'[bold green]>> {len(sync_scheduler.tasks)} matrices processed[/bold green]')
+  if any(span.stage != 'plan' for span in sync_scheduler.tracer.spans):
+    console.print(sync_scheduler.tracer.summary_table())
+  if trace:
+    sync_scheduler.tracer.write(Path(trace))
+    console.print(f"Trace written to: '{trace}'")
+
+  for category_datasets_manager in category_datasets_managers:
+    category_datasets_manager.write_category_summary()
+    console.print(f'[bold green]>> Category "{category_datasets_manager.category}", up to date![/bold green]\n')
+
+  core.DatasetManager.write_global_summary(config.path, keep_mtx, csr, shards > 0)
 
   if not skip_metadata:
-    config.export_matrices_metadata_csv('matrices_metadata.csv')
+    config.export_matrices_metadata_csv('matrices_metadata.csv', jobs=net_jobs or 8, deep_stats=deep_stats)
+  sync_manifest.close()
 
 pipe_sep = '|'
 @app.command('update-deps')
 def update_deps(
-  deps: List[str] = typer.Option(None, help=f'Available options "{pipe_sep.join([d.value for d in dependencies.DEPS])}". Default: all. Example: "--deps {dependencies.DEPS.DISTRIBUTED_MMIO.value} --deps {dependencies.DEPS.GRAPH500.value}"')
+  deps: List[str] = typer.Option(None, help=f'Available options "{pipe_sep.join([d.value for d in enums.DEPS])}". Default: all. Example: "--deps {enums.DEPS.DISTRIBUTED_MMIO.value} --deps {enums.DEPS.GRAPH500.value}"'),
+  cache: bool = typer.Option(False, "--cache", help="Reuse the build of the shared build cache if it holds the same one (same commit and compiler) instead of building again."),
 ):
   """
-  Explicitly Build or Rebuild dependencies.
+  Explicitly Build or Rebuild dependencies (concurrently).
   """
+  import mtxman.core.dependencies as dependencies
+
   if not deps:
-    deps = [d.value for d in dependencies.DEPS]
+    deps = [d.value for d in enums.DEPS]
+  builds = {}
   for d in deps:
-    if d == dependencies.DEPS.DISTRIBUTED_MMIO.value:
-      dependencies.download_and_build_mtx_to_bmtx_converter(force=True)
-    elif d == dependencies.DEPS.GRAPH500.value:
-      dependencies.download_and_build_graph500_generator(force=True)
-    elif d == dependencies.DEPS.PARMAT.value:
-      dependencies.download_and_build_parmat_generator(force=True)
+    try:
+      dep = enums.DEPS(d)
+    except ValueError:
+      console.print(f"[red]Unknown dependency '{d}'[/red]")
+      raise typer.Exit(code=1)
+    builds[dep] = dependencies.prepare(dep, force=True, rebuild=not cache)
+  failed = False
+  for dep, build in builds.items():
+    try:
+      build.result()
+    except MtxManError as e:
+      console.print(f"[red]{e}[/red]")
+      failed = True
+  if failed:
+    raise typer.Exit(code=1)
+
+
+@app.command()
+def gc(
+  file: Annotated[str, typer.Argument(help='Path to the YAML configuration file')],
+  store_path: Optional[str] = typer.Option(None, "--store", help=f"Folder of the matrix store (default: '<path>/{store.STORE_DIRNAME}')."),
+  dry_run: bool = typer.Option(False, "--dry-run", help="Only report what would be removed."),
+):
+  """
+  Removes the files of the matrix store that no category links to anymore.
+  """
+  import mtxman.core.core as core
+
+  config = core.load_config_file(Path(file))
+  matrix_store = store.MatrixStore(Path(store_path) if store_path else config.path / store.STORE_DIRNAME)
+  stats = matrix_store.collect_garbage(dry_run)
+  action = 'Would remove' if dry_run else 'Removed'
+  console.print(f"[green]{action} {stats.objects} unreferenced matrix files ({stats.bytes / 1e6:.1f} MB) and {stats.refs} stale references from {matrix_store.root}[/green]")
+
+@app.command('bmtx-to-mtx')
+def bmtx_to_mtx(
+  files: Annotated[List[str], typer.Argument(help="'.bmtx' files to convert")],
+  output: Optional[str] = typer.Option(None, "--output", "-o", help="Output '.mtx' file (a single input only). Default: next to each input, with the '.mtx' extension."),
+  force: bool = typer.Option(False, "--force", "-f", help="Overwrite existing '.mtx' files."),
+):
+  """
+  Converts '.bmtx' files back to Matrix Market ('.mtx') files.
+  """
+  import mtxman.io.bmtx as bmtx_io
+
+  if output is not None and len(files) > 1:
+    console.print("[bold red]'--output' can only be used with a single input file[/bold red]")
+    raise typer.Exit(code=1)
+  failed = False
+  for file in files:
+    bmtx_path = Path(file)
+    mtx_path = Path(output) if output is not None else bmtx_path.with_suffix('.mtx')
+    if mtx_path.exists() and not force:
+      console.print(f"[yellow]'{mtx_path}' already exists, skipped (use '--force' to overwrite it)[/yellow]")
+      continue
+    start = time.perf_counter()
+    try:
+      header = bmtx_io.bmtx_to_mtx(bmtx_path, mtx_path)
+    except (OSError, MtxManError) as e:
+      console.print(f"[red]Failed to convert '{bmtx_path}': {e}[/red]")
+      failed = True
+      continue
+    console.print(f"[green]✅ '{mtx_path}' written ({header.nnz} entries, {time.perf_counter() - start:.2f}s)[/green]")
+  if failed:
+    raise typer.Exit(code=1)
+
+@app.command()
+def decompress(
+  files: Annotated[List[str], typer.Argument(help="'.cblk' files to decompress")],
+  force: bool = typer.Option(False, "--force", "-f", help="Overwrite existing '.mtx'/'.bmtx' files."),
+  jobs: Optional[int] = typer.Option(None, "--jobs", "-j", help="Threads decompressing blocks (default: all CPUs)."),
+):
+  """
+  Decompresses '.cblk' files (written by 'sync --compress') next to them, keeping the compressed files.
+  """
+  import mtxman.io.compressed as compressed_io
+
+  failed = False
+  for file in files:
+    path = Path(file)
+    output = compressed_io.uncompressed_path(path)
+    if output == path:
+      console.print(f"[red]'{path}' is not a '{compressed_io.COMPRESSED_SUFFIX}' file[/red]")
+      failed = True
+      continue
+    if output.exists() and not force:
+      console.print(f"[yellow]'{output}' already exists, skipped (use '--force' to overwrite it)[/yellow]")
+      continue
+    start = time.perf_counter()
+    try:
+      with compressed_io.CompressedMatrix(path) as matrix:
+        compressed_io.check_codec(matrix.header.codec)
+        matrix.decompress(output, workers=jobs or os.cpu_count() or 1)
+    except (OSError, MtxManError) as e:
+      console.print(f"[red]Failed to decompress '{path}': {e}[/red]")
+      failed = True
+      continue
+    console.print(f"[green]✅ '{output}' written ({time.perf_counter() - start:.2f}s)[/green]")
+  if failed:
+    raise typer.Exit(code=1)
+
+@app.command()
+def shard(
+  files: Annotated[List[str], typer.Argument(help="'.mtx', '.bmtx' or '.cblk' files to split")],
+  parts: int = typer.Option(..., "--shards", "-n", min=1, help="Number of shards (ranks)."),
+  partition: enums.Partition = typer.Option(enums.Partition.NNZ_BALANCED, "--partition", help="'rows' gives every shard the same number of rows, 'nnz-balanced' the same number of entries."),
+  memory: float = typer.Option(1.0, "--memory", help="Memory (GB) used while splitting."),
+  force: bool = typer.Option(False, "--force", "-f", help="Split again matrices whose shards are up to date."),
+):
+  """
+  Splits matrix files into row shards, in a '.shards' folder next to each of them.
+  """
+  import mtxman.io.shard as shard_io
+
+  failed = False
+  for file in files:
+    path = Path(file)
+    dest = shard_io.shards_path_for(path)
+    if not force and shard_io.is_complete(dest, path, parts, partition):
+      console.print(f"[yellow]'{dest}' is up to date, skipped (use '--force' to split again)[/yellow]")
+      continue
+    start = time.perf_counter()
+    try:
+      result = shard_io.shard_matrix(path, parts, partition, dest, int(memory * 1e9))
+    except (OSError, MtxManError) as e:
+      console.print(f"[red]Failed to split '{path}': {e}[/red]")
+      failed = True
+      continue
+    largest = max(s.nnz for s in result.shards)
+    console.print(f"[green]✅ '{dest}' written ({parts} shards, largest: {largest} of {result.nnz} entries, {time.perf_counter() - start:.2f}s)[/green]")
+  if failed:
+    raise typer.Exit(code=1)
+
+@index_app.command('refresh')
+def index_refresh():
+  """
+  Downloads the SuiteSparse collection statistics and rebuilds the local index.
+  """
+  import mtxman.core.suite_sparse_index as suite_sparse_index
+
+  try:
+    suite_sparse_index.SuiteSparseIndex().refresh()
+  except MtxManError as e:
+    console.print(f"[bold red]{e}[/bold red]")
+    raise typer.Exit(code=1)
+
+@index_app.command('info')
+def index_info():
+  """
+  Shows the location and age of the local SuiteSparse index.
+  """
+  import mtxman.core.suite_sparse_index as suite_sparse_index
+
+  index = suite_sparse_index.SuiteSparseIndex()
+  info = index.info()
+  if not info:
+    console.print(f"[yellow]No SuiteSparse index at {index.path} (run 'mtxman index refresh')[/yellow]")
+    return
+  age_days = (time.time() - float(info.get('updated_at', 0))) / 86400
+  console.print(f"Index: [bold cyan]{index.path}[/bold cyan]")
+  console.print(f"Matrices: {info.get('count', '?')} (collection updated on {info.get('source_date', '?')})")
+  console.print(f"Last refresh: {age_days:.1f} days ago{'' if index.is_fresh() else ' [yellow](stale)[/yellow]'}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,69 @@
+import shutil
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Callable, List, Optional
+
+from mtxman.core.trace import add_io
+from mtxman.io.atomic import atomic_write
+
+# Given the name of an archive member, returns where to write it (None to skip it)
+MemberSelector = Callable[[str], Optional[Path]]
+
+
+def _write_member(src: BinaryIO, dest: Path):
+  dest.parent.mkdir(parents=True, exist_ok=True)
+  with atomic_write(dest) as f:
+    shutil.copyfileobj(src, f, 1024 * 1024)
+    add_io(bytes_out=f.tell())
+
+
+def extract_tar_stream(fileobj: BinaryIO, select: MemberSelector) -> List[Path]:
+  """
+  Reads a (possibly compressed) tar archive as a stream and writes only the selected members.
+
+  Members are read sequentially (`r|*` mode), so the archive never needs to be stored on disk:
+  skipped members are just read through.
+
+  Returns:
+    List[Path]: the written files.
+  """
+  written = []
+  with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+    for member in tar:
+      if not member.isfile():
+        continue
+      dest = select(member.name)
+      if dest is None:
+        continue
+      _write_member(tar.extractfile(member), dest)
+      written.append(dest)
+  return written
+
+
+def extract_zip(path: Path, select: MemberSelector) -> List[Path]:
+  """Writes only the selected members of a ZIP archive (which needs random access, so it must be on disk)."""
+  written = []
+  add_io(bytes_in=path.stat().st_size)
+  with zipfile.ZipFile(path) as archive:
+    for info in archive.infolist():
+      if info.is_dir():
+        continue
+      dest = select(info.filename)
+      if dest is None:
+        continue
+      with archive.open(info) as src:
+        _write_member(src, dest)
+      written.append(dest)
+  return written
+
+
+def member_relative_path(member_name: str, strip_components: int = 0) -> Optional[Path]:
+  """
+  Returns the path of an archive member relative to its extraction folder,
+  or None if it would escape that folder (absolute paths or '..').
+  """
+  parts = PurePosixPath(member_name).parts[strip_components:]
+  if not parts or PurePosixPath(member_name).is_absolute() or '..' in parts:
+    return None
+  return Path(*parts)
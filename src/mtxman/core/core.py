@@ -1,33 +1,69 @@
-import csv
+import hashlib
+import json
 import os
-import re
 import subprocess
 import yaml
 from typing import List, Tuple, Union
 from pathlib import Path
-from bs4 import BeautifulSoup
 from rich.console import Console
-import requests
-from dataclasses import dataclass
-
-from mtxman.core.dependencies import MTX_TO_BMTX_CONVERTER
-from mtxman.exceptions import ConfigurationFileNotFoundError, ConfigurationFormatError
+from dataclasses import asdict, dataclass
+from enum import Enum
+
+from mtxman.core.dependencies import DEPS, MTX_TO_BMTX_CONVERTER, require
+from mtxman.core.manifest import SyncManifest
+from mtxman.core.metadata import export_metadata_csv
+from mtxman.core.store import MatrixStore, resolve_matrix_path
+from mtxman.core.suite_sparse_index import RangeQuery
+from mtxman.core.trace import add_io, file_size
+from mtxman.io.atomic import atomic_write, commit
+from mtxman.io.mtx import default_workers
+from mtxman.io.bmtx import mtx_to_bmtx
+from mtxman.io.compressed import COMPRESSED_SUFFIX, Codec, compress_file, compressed_path_for, uncompressed_path
+from mtxman.io.csr import csr_path_for, export_csr, is_complete as csr_is_complete
+from mtxman.io.shard import MANIFEST_FILENAME as PARTITION_MANIFEST_FILENAME, Partition, is_complete as shards_are_complete, shard_matrix, shards_path_for
+from mtxman.io.postprocess import PostProcess, describe, parse_postprocess, postprocess_matrix
+from mtxman.enums import BmtxConverter
+from mtxman.exceptions import ConfigurationFileNotFoundError, ConfigurationFormatError, MatrixFormatError, MtxManError
 
 console = Console()
 
+
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import List, Dict, Union, Optional
 
+
+# Seeds of the Graph500 generator used when none are configured
+GRAPH500_DEFAULT_SEEDS = (12345, 67890)
+
+
+class GeneratorEngine(str, Enum):
+  EXTERNAL = 'external'  # The upstream generator (built on first use)
+  NATIVE = 'native'      # Built-in NumPy generator (mtxman.generators.native)
+
 @dataclass
 class Graph500Matrix:
   scale: int
   edge_factor: int
+  seed1: int = GRAPH500_DEFAULT_SEEDS[0]
+  seed2: int = GRAPH500_DEFAULT_SEEDS[1]
+
+  @property
+  def default_seeds(self) -> bool:
+    return (self.seed1, self.seed2) == GRAPH500_DEFAULT_SEEDS
 
 @dataclass
 class ConfigGraph500:
   scale: Union[List[int], int]
   edge_factor: Union[List[int], int]
+  seed1: int = GRAPH500_DEFAULT_SEEDS[0]
+  seed2: int = GRAPH500_DEFAULT_SEEDS[1]
+  engine: GeneratorEngine = GeneratorEngine.EXTERNAL
+  postprocess: List[PostProcess] = field(default_factory=list)
+
+  def __post_init__(self):
+    self.engine = GeneratorEngine(self.engine)
+    self.postprocess = parse_postprocess(self.postprocess)
 
   def get_matrices(self) -> List[Graph500Matrix]:
     scales = []
@@ -47,7 +83,7 @@ class ConfigGraph500:
     else:
       raise Exception(f"Combination of scale and edge_factor not allowed {self.scale=}, {self.edge_factor=}. Refer to the config.example.yaml file")
     
-    return [Graph500Matrix(s, e) for s, e in zip(scales, edge_factors)]
+    return [Graph500Matrix(s, e, self.seed1, self.seed2) for s, e in zip(scales, edge_factors)]
   
 
 @dataclass
@@ -79,6 +115,8 @@ class PaRMATMatrixPartial:
 class ConfigPaRMAT:
   _defaults: Optional[PaRMATMatrixPartial] = None
   _matrices: List[PaRMATMatrixPartial] = field(default_factory=list)
+  engine: GeneratorEngine = GeneratorEngine.EXTERNAL
+  postprocess: List[PostProcess] = field(default_factory=list)
 
   def get_matrices(self) -> List[PaRMATMatrix]:
     """
@@ -148,6 +186,38 @@ class ConfigSuiteSparseRange:
   min_nnzs: int
   max_nnzs: int
   limit: int
+  min_rows: Optional[int] = None
+  max_rows: Optional[int] = None
+  min_cols: Optional[int] = None
+  max_cols: Optional[int] = None
+  kind: Union[List[str], str, None] = None    # Substring(s) of the SuiteSparse kind (e.g., 'graph')
+  symmetry: Optional[str] = None              # symmetric | unsymmetric | pattern-symmetric | spd
+  field: Union[List[str], str, None] = None   # real | complex | pattern
+  group: Union[List[str], str, None] = None   # Glob pattern(s) of the group (e.g., 'SNAP', 'DIMACS*')
+  sort_by: str = 'id'                         # id | group | name | rows | cols | nnz | psym | nsym, '-' prefix for descending
+  sample: bool = False                        # Pick `limit` random matches instead of the first ones
+  seed: int = 0
+
+  def __post_init__(self):
+    self.query()  # Validates the selector
+
+  def query(self) -> RangeQuery:
+    def as_list(value) -> List[str]:
+      return [value] if isinstance(value, str) else list(value or [])
+    return RangeQuery(
+      min_nnz=self.min_nnzs, max_nnz=self.max_nnzs,
+      min_rows=self.min_rows, max_rows=self.max_rows,
+      min_cols=self.min_cols, max_cols=self.max_cols,
+      kinds=as_list(self.kind), symmetry=self.symmetry, fields=as_list(self.field), groups=as_list(self.group),
+      sort_by=self.sort_by, limit=self.limit, sample=self.sample, seed=self.seed,
+    )
+
+  def selector_id(self) -> Optional[str]:
+    """Short digest of the filters besides the nnz range and limit (None without any), to tell range folders apart."""
+    extra = {k: v for k, v in asdict(self).items() if k not in ('min_nnzs', 'max_nnzs', 'limit') and v != getattr(ConfigSuiteSparseRange, k)}
+    if not extra:
+      return None
+    return hashlib.sha1(json.dumps(extra, sort_keys=True).encode()).hexdigest()[:8]
 
 @dataclass
 class ConfigCategory:
@@ -156,6 +226,7 @@ class ConfigCategory:
   suite_sparse_matrix_list: Optional[List[Tuple[str, str]]] = field(default_factory=list)
   suite_sparse_matrix_range: Optional[ConfigSuiteSparseRange] = None
   direct_urls: Optional[List[Dict]] = None
+  postprocess: List[PostProcess] = field(default_factory=list)  # Of the downloaded matrices
 
 
 @dataclass
@@ -163,12 +234,14 @@ class Config:
   path: Path
   categories: Dict[str, ConfigCategory]
 
-  def export_matrices_metadata_csv(self, output_csv: Union[Path, str]):
+  def export_matrices_metadata_csv(self, output_csv: Union[Path, str], jobs: int = 8, deep_stats: bool = False):
     """
     Generate a CSV file with metadata for all matrices listed in the config.
 
     Args:
         output_csv (Path | str): Name of the output CSV file.
+        jobs (int): Maximum number of concurrent metadata lookups (web pages, statistics).
+        deep_stats (bool): Also compute row statistics, reading every matrix once.
     """
     self.path = self.path.resolve()
     output_csv = self.path / output_csv
@@ -184,112 +257,7 @@ class Config:
       with matrix_list_txt.open("r") as f:
         matrix_files = [line.strip() for line in f.readlines() if line.strip()]
 
-    fields = [
-      "Name", "Category", "Group", "MatrixID", "NumRows", "NumCols",
-      "Nonzeros", "Symmetric", "SparsityRatio", "Link", "ImageLink",
-      "Source", "Params"
-    ]
-    output_csv.parent.mkdir(parents=True, exist_ok=True)
-
-    with output_csv.open("w", newline="") as f:
-      writer = csv.writer(f)
-      writer.writerow(fields)
-
-      for file in matrix_files:
-        file_path = Path(file)
-        if len(file_path.parts) < 2:
-          continue
-
-        category = file_path.resolve().relative_to(self.path).parts[0]  # user-defined category path
-        source = file_path.resolve().relative_to(self.path).parts[1]  # Matrix type: DirectURL, Graph500, PaRMAT
-        name = file_path.stem
-        url = None
-
-        if source == "Graph500":
-          matches = re.match(r'graph500_(\d+)_(\d+)', str(name))
-          if not matches or len(matches.groups()) < 2:
-            console.print(f'[red]Could not parse Graph500 matrix name "{name}"[/red]')
-            continue
-          scale = int(matches.group(1))
-          edgefactor = int(matches.group(2))
-          param_str = f"{scale=},{edgefactor=}"
-          N = 2 ** scale
-          M = N * edgefactor
-          spr = float(M) / float(N * N)
-          writer.writerow([name, category, "", "", N, N, M, "No", f"{spr:.10f}", "", "", "Graph500", param_str])
-          console.print(f"[dim blue]Logged synthetic matrix (Graph500): {name}[/dim blue]")
-          continue
-
-        elif source == "PaRMAT":
-          matches = re.match(r'parmat_N(\d+)_M(\d+)_a(\d+)_b(\d+)_c(\d+)\w*', str(name))
-          if not matches or len(matches.groups()) < 5:
-            console.print(f'[red]Could not parse PaRMAT matrix name "{name}"[/red]')
-            continue
-          N = int(matches.group(1))
-          M = int(matches.group(2))
-          spr = float(M) / float(N * N)
-          param_str = (
-              f"{N=},{M=},a={matches.group(3)},b={matches.group(4)},c={matches.group(5)},"
-              f"noDuplicateEdges={'noDup' in name},undirected={'undir' in name},"
-              f"noEdgeToSelf={'noSelf' in name},sorted={'sorted' in name}"
-          )
-          spr = float(M) / float(N * N)
-          writer.writerow([name, category, "", "", N, N, M, "No", f"{spr:.10f}", "", "", "PaRMAT", param_str])
-          console.print(f"[dim blue]Logged synthetic matrix (PaRMAT): {name}[/dim blue]")
-          continue
-
-        # DirectURL
-        elif source == "DirectURL":
-          writer.writerow([name, category, "", "", "", "", "", "", "", "", "", "DirectURL", ""])
-          console.print(f"[dim blue]Logged synthetic matrix (DirectURL): {name}[/dim blue]")
-          continue
-          
-        group = file_path.parts[-3]
-        full_name = f"{group}/{name}"
-        url = f"https://sparse.tamu.edu/{full_name}"
-        console.print(f"[dim blue]Fetching metadata for[/dim blue] {full_name}")          
-        
-        try:
-          response = requests.get(url)
-          response.raise_for_status()
-        except Exception as e:
-          console.print(f"[red]Failed to fetch {url}: {e}[/red]")
-          continue
-
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        def extract_text_between(th_text):
-          for th in soup.find_all("th"):
-            if th_text.strip().lower() == th.get_text(strip=True).split("\n")[0].strip().lower():
-              td = th.find_next("td")
-              if td:
-                return td.get_text(strip=True)
-          return ""
-
-        def extract_image_link():
-          div = soup.find("div", class_="carousel-item active")
-          if div and (a_tag := div.find("a", href=True)):
-            return a_tag["href"]
-          return ""
-
-        name_field = extract_text_between("Name")
-        group_field = extract_text_between("Group")
-        matrix_id = extract_text_between("Matrix ID")
-        num_rows = int(re.sub(",", "", extract_text_between("Num Rows")) or 0)
-        num_cols = int(re.sub(",", "", extract_text_between("Num Cols")) or 0)
-        nonzeros = int(re.sub(",", "", extract_text_between("Nonzeros")) or 0)
-        spr = nonzeros / (num_rows * num_cols) if num_rows and num_cols else 0
-        symmetric = extract_text_between("Symmetric")
-        image_link = extract_image_link()
-
-        writer.writerow([
-          name_field, category, group_field, matrix_id,
-          num_rows, num_cols, nonzeros, symmetric,
-          f"{spr:.10f}", url, image_link,
-          "SuiteSparse", ""
-        ])
-        console.print(f"[dim blue]Logged SuiteSparse matrix: {full_name}[/dim blue]")
-
+    export_metadata_csv(self.path, matrix_files, output_csv, jobs, deep_stats)
     console.print(f"[green]CSV written to[/green] {output_csv}")
   
   @staticmethod
@@ -306,25 +274,64 @@ class Flags:
   binary_mtx_double_vals (bool): Whether to use double values in BMTX.\n
   keep_mtx (bool): Whether to keep the original MTX files after conversion.\n
   keep_all_mtx (bool): Whether to keep all MTX files (not just the main one).\n
+  scratch_min_free (int): Bytes that downloads must leave free in the scratch folder.\n
+  download_connections (int): Concurrent connections used to download large files.\n
+  converter (BmtxConverter): Engine used to convert matrices to BMTX.\n
+  parse_jobs (int): Processes used to parse large MTX files (None: all the usable CPUs).\n
+  generator_threads (int): Threads of each Graph500 generator run, processes of each native generator run (None: all the usable CPUs).\n
+  postprocess_memory (int): Bytes of memory used by each post-processing run (see `mtxman.io.postprocess`), CSR export and sharding.\n
+  csr (bool): Whether to also export matrices to CSR folders (see `mtxman.io.csr`).\n
+  compress (Codec): Codec used to compress the matrix files (see `mtxman.io.compressed`), None to keep them uncompressed.\n
+  shards (int): Number of row shards written for each matrix (see `mtxman.io.shard`), 0 for none.\n
+  partition (Partition): How the rows are split between the shards.\n
   """
   binary_mtx: bool
   binary_mtx_double_vals: bool
   keep_mtx: bool
   keep_all_files: bool
+  scratch_min_free: int = 0
+  download_connections: int = 1
+  converter: BmtxConverter = BmtxConverter.DMMIO
+  parse_jobs: Optional[int] = None
+  generator_threads: Optional[int] = None
+  postprocess_memory: int = 1 << 30
+  csr: bool = False
+  compress: Optional[Codec] = None
+  shards: int = 0
+  partition: Partition = Partition.NNZ_BALANCED
+
+
+def postprocessed_identity(identity: str, ops: List[PostProcess]) -> str:
+  """Identity of a matrix obtained from `identity` and post-processed with `ops`."""
+  return f'{identity}|postprocess={describe(ops)}' if ops else identity
 
 
 class DatasetManager:
   MATRICES_SUMMARY_FILENAME = "matrices_list.txt"
   MATRICES_SUMMARY_FILENAME_MTX = "matrices_list_mtx.txt"
-  # Static attribute to store all matrices generated or downloaded
+  MATRICES_SUMMARY_FILENAME_CSR = "matrices_list_csr.txt"
+  MATRICES_SUMMARY_FILENAME_SHARDS = "matrices_list_shards.txt"
+  # Static attributes to store all matrices generated or downloaded (and their CSR exports and shards)
   all_matrices: List[Path] = []
+  all_csr_matrices: List[Path] = []
+  all_sharded_matrices: List[Path] = []
 
-  def __init__(self, base_path: Path, category: str, keep_mtx=False):
+  def __init__(
+    self, base_path: Path, category: str, keep_mtx=False, store: Optional[MatrixStore] = None, manifest: Optional[SyncManifest] = None, csr=False,
+    shards=0, partition: Partition = Partition.NNZ_BALANCED,
+  ):
     self.base_path = base_path.resolve()
     self.base_path.mkdir(parents=True, exist_ok=True)
     self.category = category
     self.category_matrices = []
+    self.category_csr_matrices = []
+    self.category_sharded_matrices = []
     self.keep_mtx = keep_mtx
+    self.csr = csr
+    self.shards = shards
+    self.partition = partition
+    self.store = store
+    self.manifest = manifest
 
   def get_category_path(self) -> Path:
     """Returns the path for a dataset category folder."""
@@ -336,17 +343,19 @@ class DatasetManager:
     """Returns the path for SuiteSparse matrices selected by explicit list."""
     return self.get_category_path()
 
-  def get_suite_sparse_range_path(self, min_nnz: int, max_nnz: int, limit: int) -> Path:
-    """Returns the path for SuiteSparse matrices selected by range."""
-    subfolder = f"SuiteSparse_{min_nnz}_{max_nnz}_{limit}"
+  def get_suite_sparse_range_path(self, min_nnz: int, max_nnz: int, limit: int, selector_id: Optional[str] = None) -> Path:
+    """Returns the path for SuiteSparse matrices selected by range (`selector_id` tells apart ranges with other filters)."""
+    subfolder = f"SuiteSparse_{min_nnz}_{max_nnz}_{limit}" + (f"_{selector_id}" if selector_id else "")
     path = self.get_category_path() / subfolder
     path.parent.mkdir(parents=True, exist_ok=True)
     return path
   
-  def get_graph500_path(self, matrix: Graph500Matrix) -> Path:
+  def get_graph500_path(self, matrix: Graph500Matrix, engine: GeneratorEngine = GeneratorEngine.EXTERNAL) -> Path:
     """Returns the path for a Graph500 matrix."""
     subfolder = 'Graph500'
-    mtx_file = f'graph500_{matrix.scale}_{matrix.edge_factor}.mtx'
+    seeds = '' if matrix.default_seeds else f'_seed{matrix.seed1}-{matrix.seed2}'
+    suffix = '_native' if engine == GeneratorEngine.NATIVE else ''
+    mtx_file = f'graph500_{matrix.scale}_{matrix.edge_factor}{seeds}{suffix}.mtx'
     path = self.get_category_path() / subfolder / mtx_file
     path.parent.mkdir(parents=True, exist_ok=True)
     return path
@@ -359,7 +368,7 @@ class DatasetManager:
     path.parent.mkdir(parents=True, exist_ok=True)
     return path
   
-  def get_parmat_path_and_cli_args(self, matrix: PaRMATMatrix) -> Tuple[Path, List[str]]:
+  def get_parmat_path_and_cli_args(self, matrix: PaRMATMatrix, engine: GeneratorEngine = GeneratorEngine.EXTERNAL) -> Tuple[Path, List[str]]:
     """Returns the path for a PaRMAT matrix."""
     cli_args = [
       '-nVertices', matrix.N, '-nEdges', matrix.M,
@@ -376,9 +385,11 @@ class DatasetManager:
     if matrix.noEdgeToSelf:
       params.append("noSelf")
       cli_args.append("-noEdgeToSelf")
-    if sorted:
+    if matrix.sorted:
       params.append("sorted")
       cli_args.append("-sorted")
+    if engine == GeneratorEngine.NATIVE:
+      params.append("native")
     param_str = "_" + "_".join(params) if params else ""
     matrix_full_name = f"parmat_N{matrix.N}_M{matrix.M}{param_str}.mtx"
 
@@ -387,13 +398,35 @@ class DatasetManager:
     path.parent.mkdir(parents=True, exist_ok=True)
     return path, cli_args
 
+  def matrix_file(self, matrix_path: Path, is_bmtx: bool) -> Path:
+    """The `.mtx` (`.bmtx` with `is_bmtx`) file of a matrix, or its compressed version if it was compressed."""
+    path = resolve_matrix_path(matrix_path).with_suffix('.bmtx' if is_bmtx else '.mtx')
+    compressed_path = compressed_path_for(path)
+    return compressed_path if not path.is_file() and compressed_path.is_file() else path
+
   def register_matrix_path(self, path: Path, is_bmtx: bool):
     """Registers a matrix file path for tracking."""
-    path = path.resolve().with_suffix('.bmtx' if is_bmtx else '.mtx')
+    path = self.matrix_file(path, is_bmtx)
     if path.is_file():
+      if self.manifest is not None:
+        self.manifest.mark_stage(path, 'registered')
       self.category_matrices.append(path)
       self.all_matrices.append(path)
       console.print(f"➡️ [dim cyan]Registered matrix:[/dim cyan] [dim purple]{path}[/dim purple]")
+      if self.csr:
+        csr_path = csr_path_for(path)
+        if csr_is_complete(csr_path, path):
+          self.category_csr_matrices.append(csr_path)
+          self.all_csr_matrices.append(csr_path)
+        else:
+          console.print(f"⚠️ [yellow]Missing or outdated CSR export:[/yellow] [dim purple]{csr_path}[/dim purple]")
+      if self.shards:
+        shards_path = shards_path_for(path)
+        if shards_are_complete(shards_path, path, self.shards, self.partition):
+          self.category_sharded_matrices.append(shards_path / PARTITION_MANIFEST_FILENAME)
+          self.all_sharded_matrices.append(shards_path / PARTITION_MANIFEST_FILENAME)
+        else:
+          console.print(f"⚠️ [yellow]Missing or outdated shards:[/yellow] [dim purple]{shards_path}[/dim purple]")
     else:
       console.print(f"⚠️ [yellow]Ignored non-matrix file:[/yellow] [dim purple]{path}[/dim purple]")
 
@@ -405,55 +438,157 @@ class DatasetManager:
   def write_category_summary(self):
     """Writes a summary of all category collected matrix paths to a file."""
     summary_file = self.base_path / self.category / DatasetManager.MATRICES_SUMMARY_FILENAME
-    with open(summary_file, "w") as f:
+    with atomic_write(summary_file, "w") as f:
       for matrix_path in self.category_matrices:
-        f.write(str(Path(matrix_path).resolve().absolute()) + "\n")
+        f.write(str(resolve_matrix_path(matrix_path)) + "\n")
     console.print(f"[green]✅ Summary written to:[/green] [purple]'{summary_file}'[/purple]")
     
     if self.keep_mtx:
       summary_file = self.base_path / self.category / DatasetManager.MATRICES_SUMMARY_FILENAME_MTX
-      with open(summary_file, "w") as f:
+      with atomic_write(summary_file, "w") as f:
         for matrix_path in self.category_matrices:
-          f.write(str(Path(matrix_path).with_suffix('.mtx').resolve().absolute()) + "\n")
+          f.write(str(uncompressed_path(resolve_matrix_path(matrix_path)).with_suffix('.mtx')) + "\n")
       console.print(f"[green]✅ Alternative summary (MTX matrices paths) written to:[/green] [purple]'{summary_file}'[/purple]")
+
+    if self.csr:
+      summary_file = self.base_path / self.category / DatasetManager.MATRICES_SUMMARY_FILENAME_CSR
+      with atomic_write(summary_file, "w") as f:
+        for csr_path in self.category_csr_matrices:
+          f.write(str(csr_path) + "\n")
+      console.print(f"[green]✅ Alternative summary (CSR folders paths) written to:[/green] [purple]'{summary_file}'[/purple]")
+
+    if self.shards:
+      summary_file = self.base_path / self.category / DatasetManager.MATRICES_SUMMARY_FILENAME_SHARDS
+      with atomic_write(summary_file, "w") as f:
+        for manifest_path in self.category_sharded_matrices:
+          f.write(str(manifest_path) + "\n")
+      console.print(f"[green]✅ Alternative summary (partition manifests paths) written to:[/green] [purple]'{summary_file}'[/purple]")
     
 
   @staticmethod
-  def write_global_summary(base_path: Path, keep_mtx=False):
+  def write_global_summary(base_path: Path, keep_mtx=False, csr=False, shards=False):
     """
     Write global summary at <base_path>/matrices_list.txt.
     """
     base_path = base_path.resolve()
     summary_file = base_path / DatasetManager.MATRICES_SUMMARY_FILENAME
-    with summary_file.open("w") as f:
+    with atomic_write(summary_file, "w") as f:
       for matrix_path in DatasetManager.all_matrices:
-        f.write(str(Path(matrix_path).resolve().absolute()) + "\n")
+        f.write(str(resolve_matrix_path(matrix_path)) + "\n")
     console.print(f"[bold cyan]Global summary written to:[/bold cyan] [purple]'{summary_file.absolute()}'[/purple]")
     
     if keep_mtx:
       summary_file = base_path / DatasetManager.MATRICES_SUMMARY_FILENAME_MTX
-      with open(summary_file, "w") as f:
+      with atomic_write(summary_file, "w") as f:
         for matrix_path in DatasetManager.all_matrices:
-          f.write(str(Path(matrix_path).with_suffix('.mtx').resolve().absolute()) + "\n")
+          f.write(str(uncompressed_path(resolve_matrix_path(matrix_path)).with_suffix('.mtx')) + "\n")
       console.print(f"[green]✅ Alternative global summary (MTX matrices paths) written to:[/green] [purple]'{summary_file}'[/purple]")
+
+    if csr:
+      summary_file = base_path / DatasetManager.MATRICES_SUMMARY_FILENAME_CSR
+      with atomic_write(summary_file, "w") as f:
+        for csr_path in DatasetManager.all_csr_matrices:
+          f.write(str(csr_path) + "\n")
+      console.print(f"[green]✅ Alternative global summary (CSR folders paths) written to:[/green] [purple]'{summary_file}'[/purple]")
+
+    if shards:
+      summary_file = base_path / DatasetManager.MATRICES_SUMMARY_FILENAME_SHARDS
+      with atomic_write(summary_file, "w") as f:
+        for manifest_path in DatasetManager.all_sharded_matrices:
+          f.write(str(manifest_path) + "\n")
+      console.print(f"[green]✅ Alternative global summary (partition manifests paths) written to:[/green] [purple]'{summary_file}'[/purple]")
     
 
-  def check_matrix_status(self, matrix_path: Path, flags: Flags, downloading: bool, matrix_full_name: str) -> Tuple[bool, bool]:
+  @staticmethod
+  def _store_variants(flags: Flags) -> Dict[str, str]:
+    """
+    The files kept for each matrix (by suffix), with their variant name in the matrix store.
+    With `compress`, the main file (`.bmtx` with `binary_mtx`, `.mtx` otherwise) is compressed.
+    """
+    bmtx_variant = '.bmtx-f64' if flags.binary_mtx_double_vals else '.bmtx'
+    if not flags.binary_mtx:
+      variants = {'.mtx': '.mtx'}
+    elif flags.keep_mtx:
+      variants = {'.mtx': '.mtx', '.bmtx': bmtx_variant}
+    else:
+      variants = {'.bmtx': bmtx_variant}
+    if flags.compress is not None:
+      main = '.bmtx' if flags.binary_mtx else '.mtx'
+      variants[main + COMPRESSED_SUFFIX] = f'{variants.pop(main)}{COMPRESSED_SUFFIX}-{flags.compress.value}'
+    return variants
+
+  def link_from_store(self, matrix_path: Path, identity: str, flags: Flags) -> bool:
+    """Links the missing files of a matrix from the store. Returns True if none is missing afterwards."""
+    complete = True
+    for suffix, variant in self._store_variants(flags).items():
+      path = matrix_path.with_suffix(suffix)
+      if not path.is_file():
+        complete = self.store.link(identity, variant, path) and complete
+    return complete
+
+  def record_matrix(self, matrix_path: Path, identity: str, flags: Flags):
+    """
+    Records the files of a matrix in the sync manifest (with their checksum) and moves them into
+    the store, replacing them with links. Files already recorded are not read again.
+    """
+    for suffix, variant in self._store_variants(flags).items():
+      path = resolve_matrix_path(matrix_path.with_suffix(suffix))
+      if not path.is_file():
+        continue
+      if self.store is None and (self.manifest is None or self.manifest.is_recorded(path)):
+        continue
+      add_io(bytes_in=file_size(path))  # Hashed
+      checksum = self.store.add(identity, variant, path) if self.store is not None else None
+      if self.manifest is not None:
+        self.manifest.record_file(path, identity, checksum)
+
+  def mark_stage(self, matrix_path: Path, is_bmtx: bool, stage: str):
+    """Records in the sync manifest that a stage of the matrix completed."""
+    if self.manifest is not None:
+      self.manifest.mark_stage(resolve_matrix_path(matrix_path).with_suffix('.bmtx' if is_bmtx else '.mtx'), stage)
+
+  def _is_complete(self, path: Path, identity: Optional[str] = None) -> bool:
+    """
+    True if the file exists and, according to the sync manifest, is complete and unchanged
+    (and was produced from `identity`, e.g., with the same post-processing).
+    """
+    if self.manifest is None:
+      return path.is_file()
+    path = resolve_matrix_path(path)
+    if identity is not None:
+      record = self.manifest.get(path)
+      if record is not None and record.identity is not None and record.identity != identity and path.is_file():
+        console.print(f"[yellow]'{path}' was synced from '{record.identity}', syncing it again[/yellow]")
+        return False
+    return self.manifest.is_up_to_date(path)
+
+  def check_matrix_status(self, matrix_path: Path, flags: Flags, downloading: bool, matrix_full_name: str, identity: Optional[str] = None) -> Tuple[bool, bool]:
     """
     Check the status of a matrix: if needs to be downloaded/generated and converted.
+    Files already in the matrix store are linked first. Files that changed since they were
+    recorded in the sync manifest (or look truncated) are produced again.
 
     Args:
       matrix_path: the file extension will be automatically handled (depending on flags)
       downloading: if true, console logs will say that the matrix is being "downloaded", otherwise, "generated"
       matrix_full_name: just for console logs
+      identity: identifies the source of the matrix in the store (e.g., "suitesparse:HB/ash219")
 
     Returns:
       (to_download_or_generate, to_convert)
     """
+    if self.store is not None and identity is not None:
+      missing = [suffix for suffix in self._store_variants(flags) if not matrix_path.with_suffix(suffix).is_file()]
+      if missing and self.link_from_store(matrix_path, identity, flags):
+        console.print(f"[yellow]==> \"{matrix_full_name}\" linked from the matrix store, skipped[/yellow]")
+        return False, False
     mtx_path = matrix_path.with_suffix('.mtx')
     bmtx_path = matrix_path.with_suffix('.bmtx')
-    mtx_exists = mtx_path.is_file()
-    bmtx_exists = bmtx_path.is_file()
+    if flags.compress is not None and self._is_complete(compressed_path_for(bmtx_path if flags.binary_mtx else mtx_path), identity):
+      console.print(f"[yellow]==> \"{matrix_full_name}\" already {'downloaded' if downloading else 'generated'} and compressed, skipped[/yellow]")
+      return False, False
+    bmtx_exists = flags.binary_mtx and self._is_complete(bmtx_path, identity)
+    mtx_exists = not bmtx_exists and self._is_complete(mtx_path, identity)
 
     if flags.binary_mtx and bmtx_exists:
       console.print(f"[yellow]==> \"{matrix_full_name}\" already {'downloaded' if downloading else 'generated'} and converted, skipped[/yellow]")
@@ -483,13 +618,113 @@ class DatasetManager:
 
     return download, convert
 
-  def convert_to_bmtx(self, matrix_path: Path, flags: Flags, matrix_full_name: str):
+  def postprocess_matrix(self, matrix_path: Path, is_bmtx: bool, ops: List[PostProcess], flags: Flags, matrix_full_name: str) -> bool:
+    """Post-processes the produced `.mtx` (`.bmtx` with `is_bmtx`) file in place (atomically)."""
+    path = resolve_matrix_path(matrix_path).with_suffix('.bmtx' if is_bmtx else '.mtx')
+    console.print(f"⚙️ Post-processing '{matrix_full_name}' ({describe(ops)})")
+    size = file_size(path)
+    try:
+      nnz = postprocess_matrix(path, ops, flags.postprocess_memory)
+    except (OSError, MatrixFormatError) as e:
+      console.print(f"[red]Failed to post-process '{matrix_full_name}': {e}[/red]")
+      return False
+    add_io(size, file_size(path))
+    console.print(f"==> Post-processed '{matrix_full_name}' ({nnz} entries)")
+    return True
+
+  def is_csr_up_to_date(self, matrix_path: Path, is_bmtx: bool) -> bool:
+    """True if the CSR export of the matrix file (see `matrix_file`) is complete and was exported from its current version."""
+    path = self.matrix_file(matrix_path, is_bmtx)
+    return csr_is_complete(csr_path_for(path), path)
+
+  def export_csr(self, matrix_path: Path, is_bmtx: bool, flags: Flags, matrix_full_name: str) -> bool:
+    """Exports the matrix file (see `matrix_file`) to a CSR folder next to it, unless the export is up to date."""
+    if self.is_csr_up_to_date(matrix_path, is_bmtx):
+      return True
+    path = self.matrix_file(matrix_path, is_bmtx)
+    console.print(f"⚙️ Exporting '{matrix_full_name}' to CSR")
+    try:
+      header = export_csr(path, csr_path_for(path), flags.postprocess_memory)
+    except (OSError, MatrixFormatError) as e:
+      console.print(f"[red]Failed to export '{matrix_full_name}' to CSR: {e}[/red]")
+      return False
+    add_io(file_size(path), file_size(csr_path_for(path)))
+    console.print(f"==> Exported '{matrix_full_name}' to CSR ({header.nnz} entries)")
+    return True
+
+  def are_shards_up_to_date(self, matrix_path: Path, is_bmtx: bool, flags: Flags) -> bool:
+    """True if the shards of the matrix file (see `matrix_file`) are complete, match `flags` and were written from its current version."""
+    path = self.matrix_file(matrix_path, is_bmtx)
+    return shards_are_complete(shards_path_for(path), path, flags.shards, flags.partition)
+
+  def shard_matrix(self, matrix_path: Path, is_bmtx: bool, flags: Flags, matrix_full_name: str) -> bool:
+    """Splits the matrix file (see `matrix_file`) into `flags.shards` row shards in a folder next to it, unless they are up to date."""
+    if self.are_shards_up_to_date(matrix_path, is_bmtx, flags):
+      return True
+    path = self.matrix_file(matrix_path, is_bmtx)
+    console.print(f"⚙️ Splitting '{matrix_full_name}' into {flags.shards} shards ({flags.partition.value})")
+    try:
+      partition = shard_matrix(path, flags.shards, flags.partition, shards_path_for(path), flags.postprocess_memory)
+    except (OSError, MatrixFormatError) as e:
+      console.print(f"[red]Failed to shard '{matrix_full_name}': {e}[/red]")
+      return False
+    add_io(file_size(path), file_size(shards_path_for(path)))
+    console.print(f"==> Split '{matrix_full_name}' into {partition.parts} shards (largest: {max(s.nnz for s in partition.shards)} of {partition.nnz} entries)")
+    return True
+
+  def compress_matrix(self, matrix_path: Path, is_bmtx: bool, flags: Flags, matrix_full_name: str) -> bool:
+    """Replaces the `.mtx` (`.bmtx` with `is_bmtx`) file with its compressed version (`<file>.cblk`)."""
+    path = resolve_matrix_path(matrix_path).with_suffix('.bmtx' if is_bmtx else '.mtx')
+    compressed_path = compressed_path_for(path)
+    if not path.is_file():
+      return compressed_path.is_file()
+    console.print(f"⚙️ Compressing '{matrix_full_name}' ({flags.compress.value})")
+    try:
+      header = compress_file(path, compressed_path, flags.compress, workers=default_workers())
+    except (OSError, MtxManError) as e:
+      console.print(f"[red]Failed to compress '{matrix_full_name}': {e}[/red]")
+      return False
+    add_io(file_size(path), file_size(compressed_path))
+    os.remove(path)
+    if self.manifest is not None:
+      self.manifest.forget(path)
+    ratio = header.raw_size / max(1, compressed_path.stat().st_size)
+    console.print(f"==> Compressed '{matrix_full_name}' ({ratio:.2f}x)")
+    return True
+
+  def convert_to_bmtx(self, matrix_path: Path, flags: Flags, matrix_full_name: str) -> bool:
+    """Converts the `.mtx` file to BMTX (atomically). The `.mtx` file is deleted only once converted."""
     console.print(f"⚙️ Converting '{matrix_full_name}' to BMTX")
-    subprocess.run([MTX_TO_BMTX_CONVERTER, matrix_path.resolve().absolute()] + (['-d'] if flags.binary_mtx_double_vals else []))
+    matrix_path = resolve_matrix_path(matrix_path)
+    bmtx_path = matrix_path.with_suffix('.bmtx')
+    if flags.converter == BmtxConverter.NATIVE:
+      try:
+        mtx_to_bmtx(matrix_path, bmtx_path, flags.binary_mtx_double_vals, flags.parse_jobs)
+      except (OSError, MatrixFormatError) as e:
+        console.print(f"[red]Conversion of '{matrix_full_name}' failed ({e}), '.mtx' file kept[/red]")
+        return False
+    else:
+      # mtx_to_bmtx writes next to its input: convert a temporary link, then rename its output
+      tmp_mtx_path = matrix_path.with_name(f'{matrix_path.stem}.tmp.mtx')
+      tmp_bmtx_path = tmp_mtx_path.with_suffix('.bmtx')
+      require(DEPS.DISTRIBUTED_MMIO)
+      tmp_mtx_path.unlink(missing_ok=True)
+      os.symlink(matrix_path, tmp_mtx_path)
+      try:
+        result = subprocess.run([MTX_TO_BMTX_CONVERTER, tmp_mtx_path] + (['-d'] if flags.binary_mtx_double_vals else []))
+        if result.returncode != 0 or not tmp_bmtx_path.is_file():
+          console.print(f"[red]Conversion of '{matrix_full_name}' failed (exit code {result.returncode}), '.mtx' file kept[/red]")
+          return False
+        commit(tmp_bmtx_path, bmtx_path)
+      finally:
+        tmp_mtx_path.unlink(missing_ok=True)
+        tmp_bmtx_path.unlink(missing_ok=True)
+    add_io(file_size(matrix_path), file_size(bmtx_path))
     if not flags.keep_mtx:
-      os.remove(matrix_path.resolve())
+      os.remove(matrix_path)
       console.print('Deleted .mtx file')
     console.print('Converted!')
+    return True
 
 
 def load_config_file(path: Path) -> Config:
@@ -524,7 +759,7 @@ def load_config_file(path: Path) -> Config:
       if "graph500" in generators:
         try:
           graph500 = ConfigGraph500(**generators["graph500"])
-        except TypeError as e:
+        except (TypeError, ValueError) as e:
           raise ConfigurationFormatError(f"[{cat_name}] Invalid 'graph500' config: {e}")
 
       if "parmat" in generators:
@@ -534,15 +769,20 @@ def load_config_file(path: Path) -> Config:
           if "defaults" in raw_parmat:
             defaults = PaRMATMatrixPartial(**raw_parmat["defaults"])
           matrices = [PaRMATMatrixPartial(**m) for m in raw_parmat.get("matrices", [])]
-          parmat = ConfigPaRMAT(_defaults=defaults, _matrices=matrices)
-        except TypeError as e:
+          parmat = ConfigPaRMAT(
+            _defaults=defaults,
+            _matrices=matrices,
+            engine=GeneratorEngine(raw_parmat.get("engine", GeneratorEngine.EXTERNAL)),
+            postprocess=parse_postprocess(raw_parmat.get("postprocess")),
+          )
+        except (TypeError, ValueError) as e:
           raise ConfigurationFormatError(f"[{cat_name}] Invalid 'parmat' config: {e}")
 
       suite_range = None
       if "suite_sparse_matrix_range" in cat_data:
         try:
           suite_range = ConfigSuiteSparseRange(**cat_data["suite_sparse_matrix_range"])
-        except TypeError as e:
+        except (TypeError, ValueError) as e:
           raise ConfigurationFormatError(f"[{cat_name}] Invalid 'suite_sparse_matrix_range': {e}")
         
       suite_list = cat_data.get("suite_sparse_matrix_list", [])
@@ -553,10 +793,20 @@ def load_config_file(path: Path) -> Config:
           raise ConfigurationFormatError(f"[{cat_name}] Invalid 'suite_sparse_matrix_list': this must be a list of string in the form 'mtx_group/mtx_name'.\nInvalid value '{m}'")
         parsed_suite_list.append((ms[0],ms[1]))
         
+      try:
+        postprocess = parse_postprocess(cat_data.get("postprocess"))
+      except ValueError as e:
+        raise ConfigurationFormatError(f"[{cat_name}] Invalid 'postprocess': {e}")
+
       if "direct_urls" in cat_data:
         for matrix_direct_url in cat_data["direct_urls"]:
           if not (matrix_direct_url.get('url') and matrix_direct_url.get('filename')):
             raise ConfigurationFormatError(f"[{cat_name}] Invalid 'direct_urls'. `url` and `filename` fields are mandatory. Not found in: {matrix_direct_url}")
+          try:
+            # URLs without their own list use the one of the category
+            matrix_direct_url['postprocess'] = parse_postprocess(matrix_direct_url.get('postprocess', postprocess))
+          except ValueError as e:
+            raise ConfigurationFormatError(f"[{cat_name}] Invalid 'postprocess' of {matrix_direct_url['url']}: {e}")
 
       category = ConfigCategory(
         scratch_path=Config.get_scratch_path(base_path),
@@ -564,6 +814,7 @@ def load_config_file(path: Path) -> Config:
         suite_sparse_matrix_list=parsed_suite_list,
         suite_sparse_matrix_range=suite_range,
         direct_urls=cat_data.get("direct_urls"),
+        postprocess=postprocess,
       )
 
       categories[cat_name] = category
@@ -1,146 +1,350 @@
+"""
+External dependencies (distributed_mmio's converter, the Graph500 and PaRMAT generators), built
+from their GitHub sources on first use.
+
+Builds are cached in a shared folder (`$MTXMAN_DEPS_CACHE`, default `<cache>/mtxman/deps`), keyed
+by repository, branch, commit, build recipe and compiler, so that several installs and virtualenvs
+build each version once. With `$MTXMAN_DEPS_MIRROR` set to a folder holding the source archives
+(`<repo>-<branch>.tar.gz`, `.tgz` or `.zip`, as downloaded from GitHub), nothing is downloaded.
+
+`prepare` starts a build in the background (builds run concurrently with each other and with the
+first downloads of `sync`), `require` waits for it.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from enum import Enum
+from functools import lru_cache
+import fcntl
+import hashlib
+import json
+import os
+import platform
 import shutil
 import subprocess
+import tarfile
+import threading
 import zipfile
 import requests
 from pathlib import Path
 from rich.console import Console
-from typing import Callable, Optional, List, Tuple, Union
+from typing import Callable, Dict, Optional, List, Tuple, Union
 
+from mtxman.core.suite_sparse_index import CACHE_DIR
+from mtxman.enums import DEPS
 from mtxman.exceptions import DependencyError
+from mtxman.io.mtx import default_workers
 
 console = Console()
 
-class DEPS(Enum):
-  DISTRIBUTED_MMIO = 'distributed_mmio'
-  GRAPH500 = 'graph500'
-  PARMAT = 'parmat'
-
 DEPS_DIR = Path(__file__).resolve().parent.parent / 'deps'
+DEPS_CACHE_DIR = Path(os.environ.get('MTXMAN_DEPS_CACHE') or CACHE_DIR / 'deps')
+DEPS_MIRROR_DIR = Path(os.environ['MTXMAN_DEPS_MIRROR']) if os.environ.get('MTXMAN_DEPS_MIRROR') else None
+# Written in a built dependency folder once the build is complete
+BUILD_INFO_FILENAME = '.mtxman-build.json'
+# Placeholder of the parallelism flag in build commands (replaced with -j<CPUs>, not part of the cache key)
+MAKE_JOBS = '<jobs>'
 
 MTX_TO_BMTX_CONVERTER = DEPS_DIR / 'distributed_mmio/build/mtx_to_bmtx'
 GRAPH500_GENERATOR = DEPS_DIR / 'graph500/generator/graph500_gen'
 PARMAT_GENERATOR = DEPS_DIR / 'PaRMAT/Release/PaRMAT'
 
+BuildCommand = Union[Tuple[Path, List[str]], List[str], Callable[[Path], None]]
+
+
+def _first_line(command: List[str]) -> str:
+  try:
+    result = subprocess.run(command, capture_output=True, text=True, timeout=30)
+  except (OSError, subprocess.TimeoutExpired):
+    return ''
+  return result.stdout.splitlines()[0] if result.stdout else ''
+
+
+@lru_cache(maxsize=None)
+def toolchain_id() -> str:
+  """The machine and the versions of the compilers and build tools (part of the cache key)."""
+  tools = [_first_line([tool, '--version']) for tool in ('cc', 'gcc', 'c++', 'cmake')]
+  return ' | '.join([platform.machine(), *tools])
+
+
+def resolve_commit(url: str, branch: str) -> Optional[str]:
+  """The commit at the head of `branch` of the GitHub repository `url`, None if it cannot be resolved (e.g., offline)."""
+  owner, repo = url.rstrip('/').split('/')[-2:]
+  try:
+    response = requests.get(
+      f'https://api.github.com/repos/{owner}/{repo}/commits/{branch}',
+      headers={'Accept': 'application/vnd.github.sha'}, timeout=30,
+    )
+    response.raise_for_status()
+  except requests.RequestException:
+    return None
+  commit = response.text.strip()
+  return commit if len(commit) == 40 else None
+
+
+def mirror_archive(url: str, branch: str) -> Optional[Path]:
+  """The source archive of `branch` in the local mirror (`$MTXMAN_DEPS_MIRROR`), if any."""
+  if DEPS_MIRROR_DIR is None:
+    return None
+  repo = url.rstrip('/').split('/')[-1]
+  for suffix in ('.tar.gz', '.tgz', '.zip'):
+    path = DEPS_MIRROR_DIR / f'{repo}-{branch}{suffix}'
+    if path.is_file():
+      return path
+  return None
+
+
+def _file_digest(path: Path) -> str:
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    while block := f.read(1 << 20):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def _extract(archive: Path, dest: Path) -> Path:
+  """Extracts a `.zip` or `.tar.gz` source archive into `dest`; returns its (single) top-level folder."""
+  try:
+    if archive.suffix == '.zip':
+      with zipfile.ZipFile(archive, 'r') as zip_ref:
+        zip_ref.extractall(dest)
+    else:
+      with tarfile.open(archive, 'r:*') as tar:
+        # Refuse members outside `dest` (links, absolute paths) where supported
+        tar.extractall(dest, **({'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}))
+  except (zipfile.BadZipFile, tarfile.TarError) as e:
+    raise DependencyError(f"Failed to extract '{archive}': {e}")
+  entries = list(dest.iterdir())
+  if len(entries) != 1 or not entries[0].is_dir():
+    raise DependencyError(f"'{archive}' does not contain a single top-level folder")
+  return entries[0]
+
+
+def _download(url: str, dest: Path, name: str):
+  console.print(f"📦 [blue]Downloading '{name}' from {url}...[/blue]")
+  try:
+    with requests.get(url, stream=True, timeout=60) as response:
+      response.raise_for_status()
+      with open(dest, 'wb') as f:
+        for block in response.iter_content(1 << 20):
+          f.write(block)
+  except (requests.RequestException, OSError) as e:
+    raise DependencyError(f"Failed to download {name} from {url}: {e}")
+
+
+def _read_build_info(path: Path) -> Optional[dict]:
+  try:
+    return json.loads((path / BUILD_INFO_FILENAME).read_text())
+  except (OSError, ValueError):
+    return None
+
+
 @dataclass
 class DependencyManager:
+  @staticmethod
+  def _run_build(name: str, root: Path, build_commands: List[BuildCommand]):
+    jobs = f'-j{default_workers()}'
+    console.print(f"🔧 [yellow]Building '{name}' ({jobs})...[/yellow]")
+    for command in build_commands:
+      try:
+        if isinstance(command, Callable):
+          command(root)
+        elif isinstance(command, tuple):
+          subprocess.run([jobs if a == MAKE_JOBS else a for a in command[1]], cwd=root / command[0], check=True, stdout=subprocess.DEVNULL)
+        elif isinstance(command, list):
+          subprocess.run([jobs if a == MAKE_JOBS else a for a in command], cwd=root, check=True, stdout=subprocess.DEVNULL)
+        else:
+          raise RuntimeError(f'Invalid build command type "{type(command)}": {command}')
+      except (subprocess.CalledProcessError, OSError) as e:
+        raise DependencyError(f"Build failed for {name}: {e}")
+    console.print(f"[green]✅ Build complete for '{name}'.[/green]")
+
   @staticmethod
   def install(
     name: str,
     url: str,
     subdir: Optional[str] = None,
     branch: str = "main",
-    build_commands: Optional[List[Union[Tuple[Path, List[str]], List[str], Callable]]] = None,
+    build_commands: Optional[List[BuildCommand]] = None,
     force: bool = False,
+    recipe_extra: str = '',
+    rebuild: bool = False,
   ) -> Path:
     """
-    Downloads and builds a dependency.
+    Downloads and builds a dependency into `DEPS_DIR/<name>`, reusing the shared build cache.
 
     Parameters:
     - name: folder name to extract to
     - url: base GitHub URL (e.g., https://github.com/user/repo)
     - subdir: optional subdirectory inside the archive to treat as root
     - branch: git branch to download from
-    - build_commands: list of commands to run for building (e.g., [["make"]])
-    - force: if True, re-download and rebuild
+    - build_commands: list of commands to run for building (e.g., [["make", MAKE_JOBS]]);
+      callables get the root folder of the sources
+    - force: if True, resolve the branch again and rebuild (unless the new commit is cached)
+    - recipe_extra: other inputs of the build (e.g., a digest of patched files), part of the cache key
+    - rebuild: if True, build again even if the cache holds the same build (implies force)
     """
     DEPS_DIR.mkdir(exist_ok=True, parents=True)
     target_dir = DEPS_DIR / name
+    build_commands = build_commands or []
+    recipe = hashlib.sha256(json.dumps(
+      [url, branch, subdir, [c if not callable(c) else 'callable' for c in build_commands], recipe_extra, toolchain_id()],
+      default=str,
+    ).encode()).hexdigest()
 
-    if force and target_dir.exists():
-      console.print(f"[yellow]Removing existing dependency '{name}'...[/yellow]")
-      shutil.rmtree(target_dir)
+    if target_dir.exists() and not (force or rebuild):
+      info = _read_build_info(target_dir)
+      # Folders built by older versions (without build info) are kept as they are
+      if info is None or info.get('recipe') == recipe:
+        return target_dir
 
-    if target_dir.exists():
-      # console.print(f"[green]✅ Dependency '{name}' already exists.[/green]")
-      return target_dir
+    # The source: the local mirror, else the commit at the head of the branch, else the branch archive
+    archive = mirror_archive(url, branch)
+    commit = None
+    if archive is not None:
+      source_id = f'sha256:{_file_digest(archive)}'
+    else:
+      commit = resolve_commit(url, branch)
+      source_id = commit
+    cache_root = DEPS_CACHE_DIR / name
+    cache_root.mkdir(parents=True, exist_ok=True)
 
-    zip_url = f"{url}/archive/refs/heads/{branch}.zip"
-    zip_path = DEPS_DIR / f"{name}.zip"
-
-    console.print(f"📦 [blue]Downloading '{name}' from {zip_url}...[/blue]")
+    tmp_download = None
     try:
-      response = requests.get(zip_url)
-      response.raise_for_status()
-      with open(zip_path, "wb") as f:
-          f.write(response.content)
-    except Exception as e:
-      raise DependencyError(f"Failed to download {name} from {zip_url}: {e}")
+      if source_id is None:
+        tmp_download = cache_root / f'{branch}.{os.getpid()}.{threading.get_ident()}.zip'
+        _download(f"{url}/archive/refs/heads/{branch}.zip", tmp_download, name)
+        archive = tmp_download
+        source_id = f'sha256:{_file_digest(archive)}'
 
-    console.print(f"📁 [cyan]Extracting '{name}'...[/cyan]")
-    try:
-      with zipfile.ZipFile(zip_path, "r") as zip_ref:
-        zip_ref.extractall(DEPS_DIR)
-    except zipfile.BadZipFile as e:
-      raise DependencyError(f"Failed to extract ZIP archive for {name}: {e}")
+      key = hashlib.sha256(f'{recipe}|{source_id}'.encode()).hexdigest()[:16]
+      cache_dir = cache_root / key
+      # Builds of the same key (from other processes too) run one at a time
+      with open(cache_root / f'{key}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if _read_build_info(cache_dir) is not None and not rebuild:
+          console.print(f"[green]✅ Reusing the cached build of '{name}' ({cache_dir}).[/green]")
+        else:
+          if cache_dir.exists():
+            shutil.rmtree(cache_dir)  # Interrupted build
+          if archive is None:
+            tmp_download = cache_root / f'{key}.{os.getpid()}.zip'
+            _download(f"{url}/archive/{commit}.zip", tmp_download, name)
+            archive = tmp_download
+          console.print(f"📁 [cyan]Extracting '{name}'...[/cyan]")
+          extract_dir = cache_root / f'{key}.extract'
+          if extract_dir.exists():
+            shutil.rmtree(extract_dir)
+          extract_dir.mkdir()
+          try:
+            source_dir = _extract(archive, extract_dir)
+            if subdir:
+              source_dir = source_dir / subdir
+            if not source_dir.exists():
+              raise DependencyError(f"Extracted directory '{source_dir}' not found")
+            # Built in its final folder: build trees may refer to their own absolute paths
+            source_dir.rename(cache_dir)
+          finally:
+            shutil.rmtree(extract_dir, ignore_errors=True)
+          DependencyManager._run_build(name, cache_dir, build_commands)
+          info = {'name': name, 'url': url, 'branch': branch, 'source': source_id, 'recipe': recipe, 'toolchain': toolchain_id()}
+          (cache_dir / BUILD_INFO_FILENAME).write_text(json.dumps(info, indent=2) + '\n')
+        # Still under the lock: a rebuild of the same key cannot remove the build while it is copied
+        DependencyManager._copy_build(name, cache_dir, target_dir)
     finally:
-      zip_path.unlink(missing_ok=True)
-
-    extracted_dir = DEPS_DIR / f"{url.rstrip('/').split('/')[-1]}-{branch}"
-    if subdir:
-      extracted_dir = extracted_dir / subdir
-
-    if not extracted_dir.exists():
-      raise DependencyError(f"Extracted directory '{extracted_dir}' not found")
-
-    extracted_dir.rename(target_dir)
-
-    if build_commands:
-      console.print(f"🔧 [yellow]Building '{name}'...[/yellow]")
-      for command in build_commands:
-        try:
-          if isinstance(command, Callable):
-            command()
-          elif isinstance(command, tuple):
-            subprocess.run(command[1], cwd=target_dir / command[0], check=True, stdout=subprocess.DEVNULL)
-          elif isinstance(command, list):
-            subprocess.run(command, cwd=target_dir, check=True, stdout=subprocess.DEVNULL)
-          else:
-            raise RuntimeError(f'Invalid build command type "{type(command)}": {command}')
-        except subprocess.CalledProcessError as e:
-            raise DependencyError(f"Build failed for {name}: {e}")
-
-      console.print(f"[green]✅ Build complete for '{name}'.[/green]")
-
+      if tmp_download is not None:
+        tmp_download.unlink(missing_ok=True)
     return target_dir
 
-def download_and_build_mtx_to_bmtx_converter(force=False):
+  @staticmethod
+  def _copy_build(name: str, cache_dir: Path, target_dir: Path):
+    """Copies a cached build to `target_dir`: each install gets its own copy (generators are run from their folder)."""
+    # Installs of the same dependency (from other processes too) run one at a time
+    with open(DEPS_DIR / f'.{name}.lock', 'w') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      unique = f'{os.getpid()}.{threading.get_ident()}'
+      tmp_target = DEPS_DIR / f'{name}.tmp.{unique}'
+      try:
+        shutil.copytree(cache_dir, tmp_target, symlinks=True)
+        if target_dir.exists():
+          console.print(f"[yellow]Replacing existing dependency '{name}'...[/yellow]")
+          # Swapped by renames: the dependency folder is never left half removed
+          old_target = DEPS_DIR / f'{name}.old.{unique}'
+          target_dir.rename(old_target)
+          tmp_target.rename(target_dir)
+          shutil.rmtree(old_target, ignore_errors=True)
+        else:
+          tmp_target.rename(target_dir)
+      finally:
+        shutil.rmtree(tmp_target, ignore_errors=True)
+
+def download_and_build_mtx_to_bmtx_converter(force=False, rebuild=False):
   DependencyManager.install(
     name="distributed_mmio",
     url="https://github.com/HicrestLaboratory/distributed_mmio",
     build_commands=[
       ["cmake", "-DDMMIO_ENABLE_MPI=OFF", "-DCCUTILS_ENABLE_MPI=OFF", "-DCCUTILS_ENABLE_CUDA=OFF", "-DDMMIO_TOOLS=ON", "-B", "build"],
-      (Path('build'), ["make", "mtx_to_bmtx"]),
+      (Path('build'), ["make", MAKE_JOBS, "mtx_to_bmtx"]),
     ],
     force=force,
+    rebuild=rebuild,
   )
 
-def download_and_build_graph500_generator(force=False):
+def download_and_build_graph500_generator(force=False, rebuild=False):
   G500_GEN_MAIN_C = 'graph500_generator_main.c'
+  custom_main_c = DEPS_DIR / 'custom' / G500_GEN_MAIN_C
+  # Generators built from another version of the custom main are rebuilt (its arguments may differ)
+  built_main_c = DEPS_DIR / 'graph500/generator' / G500_GEN_MAIN_C
+  if built_main_c.exists() and built_main_c.read_bytes() != custom_main_c.read_bytes():
+    force = True
   DependencyManager.install(
     name="graph500",
     url="https://github.com/graph500/graph500",
     branch='newreference',
     build_commands=[
-      lambda: shutil.copy2(DEPS_DIR / 'custom' / G500_GEN_MAIN_C, DEPS_DIR / 'graph500/generator' / G500_GEN_MAIN_C),
+      lambda root: shutil.copy2(custom_main_c, root / 'generator' / G500_GEN_MAIN_C),
       (Path('generator'), [
-        'gcc', '-O3', '-I', './',
+        'gcc', '-O3', '-fopenmp', '-I', './',
         '-o', 'graph500_gen',
         G500_GEN_MAIN_C, 'make_graph.c', 'splittable_mrg.c', 'graph_generator.c', 'utils.c',
         '-lm', '-w'
       ]),
     ],
     force=force,
+    recipe_extra=_file_digest(custom_main_c),
+    rebuild=rebuild,
   )
 
-def download_and_build_parmat_generator(force=False):
+def download_and_build_parmat_generator(force=False, rebuild=False):
   DependencyManager.install(
     name="PaRMAT",
     url="https://github.com/farkhor/PaRMAT",
     build_commands=[
-      (Path('Release'), ['make']),
+      (Path('Release'), ['make', MAKE_JOBS]),
     ],
     branch='master',
     force=force,
+    rebuild=rebuild,
   )
+
+
+INSTALLERS: Dict[DEPS, Callable[..., None]] = {
+  DEPS.DISTRIBUTED_MMIO: download_and_build_mtx_to_bmtx_converter,
+  DEPS.GRAPH500: download_and_build_graph500_generator,
+  DEPS.PARMAT: download_and_build_parmat_generator,
+}
+
+_builds: Dict[DEPS, Future] = {}
+_builds_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=len(DEPS), thread_name_prefix='mtxman-deps')
+
+
+def prepare(dep: DEPS, force: bool = False, rebuild: bool = False) -> Future:
+  """Starts installing `dep` in the background (once per process, unless `force`/`rebuild`); returns its future."""
+  with _builds_lock:
+    if force or rebuild or dep not in _builds:
+      _builds[dep] = _executor.submit(INSTALLERS[dep], force=force, rebuild=rebuild)
+    return _builds[dep]
+
+
+def require(dep: DEPS):
+  """Waits until `dep` is installed (installing it if needed). Raises DependencyError if it cannot be built."""
+  prepare(dep).result()
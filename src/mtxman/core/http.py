@@ -0,0 +1,309 @@
+import json
+import os
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, List, Optional, Tuple, TypeVar
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as TransportError
+from rich.console import Console
+
+from mtxman.core.trace import add_io
+from mtxman.exceptions import DownloadError
+from mtxman.io.atomic import commit
+
+console = Console()
+
+CHUNK_SIZE = 1024 * 1024
+# Files smaller than this are always downloaded with a single connection
+SEGMENTED_MIN_SIZE = 64 * 1024 * 1024
+# HTTP status codes that are worth retrying
+RETRY_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+T = TypeVar('T')
+
+
+@dataclass
+class DownloadStats:
+  url: str
+  path: Path
+  size: int           # Final file size
+  transferred: int    # Bytes transferred by this run (excludes resumed bytes)
+  elapsed: float
+  connections: int = 1
+
+  @property
+  def throughput(self) -> float:
+    """Bytes per second transferred by this run."""
+    return self.transferred / self.elapsed if self.elapsed > 0 else 0.0
+
+
+@dataclass
+class _Segment:
+  start: int
+  end: Optional[int]  # Inclusive, None if the size is unknown
+  done: int = 0
+
+  @property
+  def complete(self) -> bool:
+    return self.end is not None and self.start + self.done > self.end
+
+
+def part_path_for(dest: Path) -> Path:
+  """Where `Downloader.download` writes `dest` until it is complete."""
+  return dest.with_name(dest.name + '.part')
+
+
+class _CountingReader:
+  """Read-only file-like wrapper counting the bytes read."""
+
+  def __init__(self, raw):
+    self.raw = raw
+    self.count = 0
+
+  def read(self, n: int = -1) -> bytes:
+    data = self.raw.read(n if n is not None and n >= 0 else None)
+    self.count += len(data)
+    return data
+
+
+class Downloader:
+  """
+  In-process HTTP downloader sharing a pooled `requests.Session` across threads.
+
+  Files are written to `<dest>.part` and renamed once complete. Interrupted downloads resume
+  from the partial file with HTTP Range requests, failures are retried with exponential backoff,
+  and large files can be fetched with several concurrent connections (one byte range each).
+  """
+
+  def __init__(self, retries: int = 5, backoff: float = 1.0, timeout: float = 60, pool_size: int = 32):
+    self.retries = retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+    # Byte-exact transfers: sizes and ranges refer to the file, not to an encoded stream
+    self.session.headers.update({'Accept-Encoding': 'identity', 'User-Agent': 'mtxman'})
+
+  def remote_info(self, url: str) -> Tuple[Optional[int], bool]:
+    """
+    Returns:
+      (size, accepts_ranges): size is None if the server does not advertise it.
+    """
+    def head():
+      response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+      if response.status_code in RETRY_STATUS_CODES:
+        raise requests.HTTPError(f"{response.status_code} {response.reason}", response=response)
+      return response
+
+    response = self._with_retries(head, url)
+    if response.status_code >= 400:
+      # Some servers do not implement HEAD: the GET request will tell
+      return None, False
+    length = response.headers.get('Content-Length')
+    size = int(length) if length else None
+    accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    return size, accepts_ranges
+
+  def remote_size(self, url: str) -> Optional[int]:
+    try:
+      return self.remote_info(url)[0]
+    except DownloadError:
+      return None
+
+  def download(self, url: str, dest: Path, connections: int = 1, name: Optional[str] = None) -> DownloadStats:
+    """
+    Downloads `url` to `dest`, resuming a previous partial download if any.
+
+    Args:
+      connections: number of concurrent connections used for files of at least `SEGMENTED_MIN_SIZE` bytes.
+      name: just for console logs
+    """
+    dest = Path(dest)
+    part_path = part_path_for(dest)
+    state_path = dest.with_name(dest.name + '.part.json')
+    name = name or dest.name
+
+    size, accepts_ranges = self.remote_info(url)
+    segments = self._load_segments(state_path, url, size)
+    if segments is None:
+      if connections > 1 and accepts_ranges and size is not None and size >= SEGMENTED_MIN_SIZE:
+        step = -(-size // connections)
+        segments = [_Segment(start, min(start + step, size) - 1) for start in range(0, size, step)]
+      else:
+        resumed = part_path.stat().st_size if part_path.exists() else 0
+        if size is not None and resumed > size:
+          resumed = 0
+        segments = [_Segment(0, size - 1 if size is not None else None, resumed)]
+    if not part_path.exists() or len(segments) > 1 and part_path.stat().st_size != size:
+      with open(part_path, 'wb') as f:
+        if len(segments) > 1:
+          f.truncate(size)
+      if len(segments) == 1:
+        segments[0].done = 0
+
+    resumed = sum(s.done for s in segments)
+    if resumed > 0:
+      console.print(f"[dim]Resuming '{name}' from {resumed / 1e6:.1f} MB[/dim]")
+
+    start = time.perf_counter()
+    if len(segments) == 1:
+      self._fetch_segment(url, part_path, segments[0], allow_restart=True)
+    else:
+      state_lock = threading.Lock()
+      try:
+        with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+          futures = [pool.submit(self._fetch_segment, url, part_path, s, False, state_path, segments, state_lock) for s in segments]
+          for future in futures:
+            future.result()
+      except BaseException:
+        self._save_segments(state_path, url, size, segments, state_lock)
+        raise
+    elapsed = time.perf_counter() - start
+
+    final_size = part_path.stat().st_size
+    if size is not None and final_size != size:
+      raise DownloadError(f"Incomplete download of {url}: got {final_size} bytes, expected {size}")
+    commit(part_path, dest)
+    state_path.unlink(missing_ok=True)
+
+    stats = DownloadStats(url, dest, final_size, sum(s.done for s in segments) - resumed, elapsed, len(segments))
+    add_io(stats.transferred, stats.transferred)
+    console.print(
+      f"⬇️ [dim]Downloaded '{name}': {stats.size / 1e6:.1f} MB in {stats.elapsed:.1f}s "
+      f"({stats.throughput / 1e6:.1f} MB/s, {stats.connections} connection{'s' if stats.connections > 1 else ''})[/dim]"
+    )
+    return stats
+
+  def stream(self, url: str, consume: Callable[[BinaryIO], T], name: Optional[str] = None) -> T:
+    """
+    Passes the body of `url` to `consume` as a file-like object, without storing it.
+
+    A stream cannot be resumed: when a transfer fails, `consume` is called again from the start,
+    so it must be idempotent (e.g., write its outputs atomically). A `tarfile.TarError` or `EOFError`
+    raised by `consume` before the whole body is read counts as a failed transfer.
+    """
+    name = name or url
+    stats = {}
+
+    def attempt():
+      with self.session.get(url, stream=True, timeout=self.timeout) as response:
+        if response.status_code in RETRY_STATUS_CODES:
+          raise requests.HTTPError(f"{response.status_code} {response.reason}", response=response)
+        if response.status_code >= 400:
+          raise DownloadError(f"Failed to download {url}: {response.status_code} {response.reason}")
+        reader = _CountingReader(response.raw)
+        start = time.perf_counter()
+        try:
+          result = consume(reader)
+        except (tarfile.TarError, EOFError) as e:
+          # A truncated body reads as a truncated archive: retry, unless the archive itself is broken
+          # (the error came before the end of the body, or with the whole body received)
+          length = response.headers.get('Content-Length')
+          if response.raw.read(1) or length is not None and reader.count >= int(length):
+            raise
+          raise requests.ConnectionError(f"Stream ended after {reader.count} bytes ({e})")
+        stats['transferred'] = reader.count
+        stats['elapsed'] = time.perf_counter() - start
+        return result
+
+    result = self._with_retries(attempt, url)
+    add_io(bytes_in=stats['transferred'])
+    throughput = stats['transferred'] / stats['elapsed'] if stats['elapsed'] > 0 else 0.0
+    console.print(
+      f"⬇️ [dim]Streamed '{name}': {stats['transferred'] / 1e6:.1f} MB in {stats['elapsed']:.1f}s "
+      f"({throughput / 1e6:.1f} MB/s)[/dim]"
+    )
+    return result
+
+  def _fetch_segment(
+    self, url: str, part_path: Path, segment: _Segment, allow_restart: bool,
+    state_path: Optional[Path] = None, segments: Optional[List[_Segment]] = None, state_lock: Optional[threading.Lock] = None,
+  ):
+    def fetch():
+      if segment.complete:
+        return
+      pos = segment.start + segment.done
+      headers = {}
+      if pos > 0 or not allow_restart:
+        headers['Range'] = f"bytes={pos}-{segment.end if segment.end is not None else ''}"
+      with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+        if response.status_code in RETRY_STATUS_CODES:
+          raise requests.HTTPError(f"{response.status_code} {response.reason}", response=response)
+        if response.status_code >= 400:
+          # Nothing to resume next time
+          if allow_restart:
+            part_path.unlink(missing_ok=True)
+          raise DownloadError(f"Failed to download {url}: {response.status_code} {response.reason}")
+        if 'Range' in headers and response.status_code != 206:
+          if not allow_restart:
+            raise DownloadError(f"Server ignored the range request for {url}")
+          # The server does not support resuming: start over
+          segment.done = 0
+          pos = 0
+        with open(part_path, 'r+b') as f:
+          f.seek(pos)
+          if pos == 0 and allow_restart:
+            f.truncate()
+          saved = segment.done
+          for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+            f.write(chunk)
+            segment.done += len(chunk)
+            if state_path is not None and segment.done - saved >= 16 * CHUNK_SIZE:
+              self._save_segments(state_path, url, segments[-1].end + 1, segments, state_lock)
+              saved = segment.done
+      if segment.end is not None and not segment.complete:
+        raise requests.ConnectionError(f"Connection closed after {segment.done} bytes")
+
+    self._with_retries(fetch, url)
+
+  def _with_retries(self, fn, url: str):
+    for attempt in range(self.retries + 1):
+      try:
+        return fn()
+      except (requests.ConnectionError, requests.Timeout, requests.HTTPError, TransportError) as e:
+        if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code not in RETRY_STATUS_CODES:
+          raise DownloadError(f"Failed to download {url}: {e}")
+        if attempt == self.retries:
+          raise DownloadError(f"Failed to download {url} after {self.retries + 1} attempts: {e}")
+        delay = self.backoff * (2 ** attempt)
+        console.print(f"[yellow]Download of {url} failed ({e}), retrying in {delay:.1f}s[/yellow]")
+        time.sleep(delay)
+
+  @staticmethod
+  def _load_segments(state_path: Path, url: str, size: Optional[int]) -> Optional[List[_Segment]]:
+    """Loads the progress of a previous segmented download of the same file."""
+    if not state_path.exists():
+      return None
+    try:
+      state = json.loads(state_path.read_text())
+      if state['url'] != url or state['size'] != size:
+        return None
+      return [_Segment(**s) for s in state['segments']]
+    except (ValueError, KeyError, TypeError):
+      return None
+
+  @staticmethod
+  def _save_segments(state_path: Path, url: str, size: int, segments: List[_Segment], lock: threading.Lock):
+    with lock:
+      tmp_path = state_path.with_name(state_path.name + '.tmp')
+      tmp_path.write_text(json.dumps({'url': url, 'size': size, 'segments': [asdict(s) for s in segments]}))
+      os.replace(tmp_path, state_path)
+
+
+_downloader: Optional[Downloader] = None
+_downloader_lock = threading.Lock()
+
+def get_downloader() -> Downloader:
+  """Returns the downloader shared by the whole process (and its connection pool)."""
+  global _downloader
+  with _downloader_lock:
+    if _downloader is None:
+      _downloader = Downloader()
+    return _downloader
@@ -0,0 +1,195 @@
+"""
+Sync manifest: what MtxMan knows about every matrix file of a dataset.
+
+For each registered file (`.mtx` or `.bmtx`) the manifest records its source identity, size,
+modification time, SHA-256 checksum and when each stage (download, extraction, generation,
+post-processing, conversion, registration) last completed. A file is up to date when its size
+and modification time still match the manifest (one `stat`), so re-syncs never read matrices
+again; `verify` re-hashes them.
+"""
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional
+from rich.console import Console
+
+from mtxman.core.store import MatrixStore, hash_file
+from mtxman.exceptions import MatrixFormatError
+
+console = Console()
+
+MANIFEST_FILENAME = '.mtxman_manifest.sqlite'
+STAGES = ('downloaded', 'extracted', 'generated', 'postprocessed', 'converted', 'registered')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+  path TEXT PRIMARY KEY,
+  identity TEXT,
+  size INTEGER,
+  mtime_ns INTEGER,
+  sha256 TEXT,
+  downloaded REAL,
+  extracted REAL,
+  generated REAL,
+  postprocessed REAL,
+  converted REAL,
+  registered REAL
+)
+'''
+
+
+def _check_file(path: Path, deep: bool = False):
+  # Imported on use: the matrix readers import NumPy, which commands not reading matrices do not need
+  from mtxman.io.stats import check_file
+  check_file(path, deep=deep)
+
+
+@dataclass
+class FileRecord:
+  path: str
+  identity: Optional[str]
+  size: Optional[int]
+  mtime_ns: Optional[int]
+  sha256: Optional[str]
+
+  def matches(self, st: os.stat_result) -> bool:
+    return self.size == st.st_size and self.mtime_ns == st.st_mtime_ns
+
+
+@dataclass
+class VerifyStats:
+  verified: int = 0
+  invalid: int = 0
+  missing: int = 0
+
+
+class SyncManifest:
+  """Thread-safe access to the manifest of a dataset (see the module docstring)."""
+
+  def __init__(self, base_path: Path):
+    self.path = base_path / MANIFEST_FILENAME
+    self._conn = sqlite3.connect(self.path, check_same_thread=False)
+    self._conn.execute(_SCHEMA)
+    # Stages added by later versions
+    columns = {row[1] for row in self._conn.execute('PRAGMA table_info(files)')}
+    for stage in STAGES:
+      if stage not in columns:
+        self._conn.execute(f'ALTER TABLE files ADD COLUMN {stage} REAL')
+    self._lock = threading.Lock()
+    # Files found up to date by this process (so that they are not checked twice)
+    self._up_to_date = set()
+
+  def get(self, path: Path) -> Optional[FileRecord]:
+    with self._lock:
+      row = self._conn.execute('SELECT path, identity, size, mtime_ns, sha256 FROM files WHERE path = ?', (str(path),)).fetchone()
+    return FileRecord(*row) if row else None
+
+  def is_up_to_date(self, path: Path) -> bool:
+    """
+    True if `path` exists and is unchanged since it was recorded (one `stat`). Files that were
+    never recorded (e.g., from older versions) pass if a constant-time check of their header and
+    size succeeds, and are recorded by `record_file`.
+    """
+    if path in self._up_to_date:
+      return True
+    try:
+      st = path.stat()
+    except OSError:
+      return False
+    record = self.get(path)
+    if record is not None and record.size is not None:
+      if not record.matches(st):
+        console.print(f"[yellow]'{path}' changed since it was synced (or is incomplete), syncing it again[/yellow]")
+        return False
+    else:
+      try:
+        _check_file(path)
+      except (OSError, ValueError, MatrixFormatError) as e:
+        console.print(f"[yellow]'{path}' is incomplete ({e}), syncing it again[/yellow]")
+        return False
+    self._up_to_date.add(path)
+    return True
+
+  def is_recorded(self, path: Path) -> bool:
+    """True if `path` is up to date and its checksum is known."""
+    record = self.get(path)
+    return path in self._up_to_date and record is not None and record.sha256 is not None
+
+  def mark_stage(self, path: Path, stage: str):
+    if stage not in STAGES:
+      raise ValueError(f"Unknown stage '{stage}'")
+    with self._lock, self._conn:
+      self._conn.execute('INSERT OR IGNORE INTO files (path) VALUES (?)', (str(path),))
+      self._conn.execute(f'UPDATE files SET {stage} = ? WHERE path = ?', (time.time(), str(path)))
+
+  def record_file(self, path: Path, identity: Optional[str], sha256: Optional[str] = None):
+    """Records the current size, modification time and checksum (computed if not given) of `path`."""
+    sha256 = sha256 or hash_file(path)
+    st = path.stat()
+    with self._lock, self._conn:
+      self._conn.execute('INSERT OR IGNORE INTO files (path) VALUES (?)', (str(path),))
+      self._conn.execute(
+        'UPDATE files SET identity = ?, size = ?, mtime_ns = ?, sha256 = ? WHERE path = ?',
+        (identity, st.st_size, st.st_mtime_ns, sha256, str(path)),
+      )
+    self._up_to_date.add(path)
+
+  def forget(self, path: Path):
+    with self._lock, self._conn:
+      self._conn.execute('DELETE FROM files WHERE path = ?', (str(path),))
+    self._up_to_date.discard(path)
+
+  def paths(self) -> List[Path]:
+    with self._lock:
+      return [Path(row[0]) for row in self._conn.execute('SELECT path FROM files ORDER BY path')]
+
+  def _verify_file(self, path: Path) -> Optional[bool]:
+    """Returns None if `path` is missing, otherwise whether its content matches the manifest."""
+    record = self.get(path)
+    if not path.is_file():
+      return None
+    try:
+      if record is None or record.sha256 is None:
+        _check_file(path, deep=True)
+        self.record_file(path, record.identity if record else None)
+        return True
+      if hash_file(path) != record.sha256:
+        return False
+      # Content is fine: refresh the stat fields (e.g., a touched file)
+      self.record_file(path, record.identity, record.sha256)
+      return True
+    except (OSError, ValueError, MatrixFormatError):
+      return False
+
+  def verify(self, paths: Optional[Iterable[Path]] = None, jobs: int = 4, store: Optional[MatrixStore] = None) -> VerifyStats:
+    """
+    Re-hashes the recorded files (in parallel) and removes the ones whose content does not match
+    the manifest, together with their records (and their object in `store`, which shares their
+    content), so that the next sync produces them again.
+    Files without a checksum are fully parsed for consistency with their header instead.
+    """
+    stats = VerifyStats()
+    paths = list(paths) if paths is not None else self.paths()
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+      for path, result in zip(paths, pool.map(self._verify_file, paths)):
+        if result is None:
+          stats.missing += 1
+          self.forget(path)
+        elif result:
+          stats.verified += 1
+        else:
+          stats.invalid += 1
+          console.print(f"[red]'{path}' is corrupted, it will be synced again[/red]")
+          record = self.get(path)
+          if store is not None and record is not None and record.sha256 is not None:
+            store.discard(record.sha256 + path.suffix, path)
+          path.unlink(missing_ok=True)
+          self.forget(path)
+    return stats
+
+  def close(self):
+    self._conn.close()
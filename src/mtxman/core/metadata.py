@@ -0,0 +1,299 @@
+"""
+Metadata of the synced matrices (`matrices_metadata.csv`).
+
+Sizes, symmetry and sparsity come from the header of each matrix file. The other columns come from
+the file names (synthetic matrices) or the local SuiteSparse index (`suite_sparse_index`).
+Only SuiteSparse matrices that are neither in the index nor on disk are looked up on their web
+page. Web pages and the optional row statistics are computed concurrently and stored in a
+persistent cache, so that each is computed only once.
+"""
+import csv
+import json
+import re
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+import requests
+from bs4 import BeautifulSoup
+from rich.console import Console
+
+from mtxman.core.store import resolve_matrix_path
+from mtxman.core.suite_sparse_index import CACHE_DIR, SUITE_SPARSE_URL, SuiteSparseIndex, get_index
+from mtxman.exceptions import MatrixFormatError, SuiteSparseIndexError
+from mtxman.io.atomic import commit, tmp_path_for
+from mtxman.io.compressed import uncompressed_path
+from mtxman.io.stats import compute_stats, read_info
+
+console = Console()
+
+FIELDS = [
+  "Name", "Category", "Group", "MatrixID", "NumRows", "NumCols",
+  "Nonzeros", "Symmetric", "SparsityRatio", "Link", "ImageLink",
+  "Source", "Params"
+]
+# Columns added by `--deep-stats`
+DEEP_STATS_FIELDS = [
+  "EmptyRows", "MinRowNnz", "MaxRowNnz", "AvgRowNnz", "StdRowNnz", "Bandwidth", "DegreeHistogram"
+]
+# Columns of `local_row` that do not override a SuiteSparse index (or web page) row
+ENTRY_COUNT_FIELDS = ["Nonzeros", "SparsityRatio"]
+
+METADATA_CACHE_PATH = CACHE_DIR / 'metadata_cache.sqlite'
+# Cached rows are computed again after this time
+METADATA_CACHE_TTL = 90 * 24 * 3600  # Seconds
+
+# A CSV row without its category (which depends on where the matrix is stored)
+Row = Dict[str, Union[str, int]]
+
+
+class MetadataCache:
+  """
+  Persistent cache of partial metadata rows, keyed by `suitesparse:<group>/<name>` (web pages)
+  or `stats:<path>:<size>:<mtime>` (row statistics, recomputed whenever the file changes).
+  """
+
+  def __init__(self, path: Path = METADATA_CACHE_PATH, ttl: float = METADATA_CACHE_TTL):
+    self.ttl = ttl
+    path.parent.mkdir(parents=True, exist_ok=True)
+    self.conn = sqlite3.connect(path)
+    self.conn.execute('CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, row TEXT NOT NULL, fetched_at REAL NOT NULL)')
+
+  def get(self, key: str) -> Optional[Row]:
+    result = self.conn.execute('SELECT row, fetched_at FROM metadata WHERE key = ?', (key,)).fetchone()
+    if result is None or time.time() - result[1] > self.ttl:
+      return None
+    return json.loads(result[0])
+
+  def put(self, key: str, row: Row):
+    with self.conn:
+      self.conn.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?)', (key, json.dumps(row), time.time()))
+
+  def close(self):
+    self.conn.close()
+
+
+def _sparsity(nnz: int, rows: int, cols: int) -> str:
+  return f"{nnz / (rows * cols) if rows and cols else 0:.10f}"
+
+
+def graph500_row(name: str) -> Optional[Row]:
+  matches = re.match(r'graph500_(\d+)_(\d+)(?:_seed(\d+)-(\d+))?', name)
+  if not matches:
+    console.print(f'[red]Could not parse Graph500 matrix name "{name}"[/red]')
+    return None
+  scale = int(matches.group(1))
+  edgefactor = int(matches.group(2))
+  seeds = f",seed1={matches.group(3)},seed2={matches.group(4)}" if matches.group(3) else ""
+  N = 2 ** scale
+  M = N * edgefactor
+  return {
+    "Name": name, "NumRows": N, "NumCols": N, "Nonzeros": M, "Symmetric": "No",
+    "SparsityRatio": _sparsity(M, N, N), "Source": "Graph500", "Params": f"{scale=},{edgefactor=}{seeds}",
+  }
+
+
+def parmat_row(name: str) -> Optional[Row]:
+  matches = re.match(r'parmat_N(\d+)_M(\d+)_a(\d+)_b(\d+)_c(\d+)\w*', name)
+  if not matches:
+    console.print(f'[red]Could not parse PaRMAT matrix name "{name}"[/red]')
+    return None
+  N = int(matches.group(1))
+  M = int(matches.group(2))
+  params = (
+    f"{N=},{M=},a={matches.group(3)},b={matches.group(4)},c={matches.group(5)},"
+    f"noDuplicateEdges={'noDup' in name},undirected={'undir' in name},"
+    f"noEdgeToSelf={'noSelf' in name},sorted={'sorted' in name}"
+  )
+  return {
+    "Name": name, "NumRows": N, "NumCols": N, "Nonzeros": M, "Symmetric": "No",
+    "SparsityRatio": _sparsity(M, N, N), "Source": "PaRMAT", "Params": params,
+  }
+
+
+def suite_sparse_index_row(index: SuiteSparseIndex, group: str, name: str) -> Optional[Row]:
+  matrix = index.lookup(group, name)
+  if matrix is None:
+    return None
+  return {
+    "Name": matrix.name, "Group": matrix.group, "MatrixID": matrix.id,
+    "NumRows": matrix.rows, "NumCols": matrix.cols, "Nonzeros": matrix.nnz,
+    "Symmetric": "Yes" if matrix.symmetric else "No", "SparsityRatio": _sparsity(matrix.nnz, matrix.rows, matrix.cols),
+    "Link": matrix.info_url(), "ImageLink": matrix.image_url(), "Source": "SuiteSparse",
+  }
+
+
+def suite_sparse_page_row(session: requests.Session, group: str, name: str) -> Optional[Row]:
+  """Scrapes the web page of a SuiteSparse matrix (for matrices missing from the local index)."""
+  full_name = f"{group}/{name}"
+  url = f"{SUITE_SPARSE_URL}/{full_name}"
+  console.print(f"[dim blue]Fetching metadata for[/dim blue] {full_name}")
+  try:
+    response = session.get(url, timeout=60)
+    response.raise_for_status()
+  except Exception as e:
+    console.print(f"[red]Failed to fetch {url}: {e}[/red]")
+    return None
+
+  soup = BeautifulSoup(response.text, "html.parser")
+
+  def extract_text_between(th_text):
+    for th in soup.find_all("th"):
+      if th_text.strip().lower() == th.get_text(strip=True).split("\n")[0].strip().lower():
+        td = th.find_next("td")
+        if td:
+          return td.get_text(strip=True)
+    return ""
+
+  def extract_image_link():
+    div = soup.find("div", class_="carousel-item active")
+    if div and (a_tag := div.find("a", href=True)):
+      return a_tag["href"]
+    return ""
+
+  num_rows = int(re.sub(",", "", extract_text_between("Num Rows")) or 0)
+  num_cols = int(re.sub(",", "", extract_text_between("Num Cols")) or 0)
+  nonzeros = int(re.sub(",", "", extract_text_between("Nonzeros")) or 0)
+  return {
+    "Name": extract_text_between("Name"), "Group": extract_text_between("Group"),
+    "MatrixID": extract_text_between("Matrix ID"),
+    "NumRows": num_rows, "NumCols": num_cols, "Nonzeros": nonzeros,
+    "Symmetric": extract_text_between("Symmetric"), "SparsityRatio": _sparsity(nonzeros, num_rows, num_cols),
+    "Link": url, "ImageLink": extract_image_link(), "Source": "SuiteSparse",
+  }
+
+
+def local_row(path: Path) -> Optional[Row]:
+  """
+  Sizes and symmetry read from the header of the matrix file (None if it cannot be read).
+  Nonzeros counts the stored entries: only one triangle of symmetric matrices.
+  """
+  try:
+    info = read_info(path)
+  except (OSError, ValueError, MatrixFormatError):
+    return None
+  return {
+    "NumRows": info.nrows, "NumCols": info.ncols, "Nonzeros": info.nnz,
+    "Symmetric": "Yes" if info.symmetric else "No", "SparsityRatio": f"{info.sparsity:.10f}",
+  }
+
+
+def deep_stats_row(path: Path) -> Optional[Row]:
+  try:
+    stats = compute_stats(path)
+  except (OSError, ValueError, MatrixFormatError) as e:
+    console.print(f"[red]Failed to compute the statistics of '{path}': {e}[/red]")
+    return None
+  return {
+    "EmptyRows": stats.empty_rows, "MinRowNnz": stats.min_row_nnz, "MaxRowNnz": stats.max_row_nnz,
+    "AvgRowNnz": f"{stats.avg_row_nnz:.4f}", "StdRowNnz": f"{stats.std_row_nnz:.4f}",
+    "Bandwidth": stats.bandwidth, "DegreeHistogram": stats.histogram_str(),
+  }
+
+
+def _resolve(pending, cache: MetadataCache) -> Optional[Row]:
+  """Returns a row, waiting for (and caching) it if it is still being computed."""
+  if isinstance(pending, tuple):
+    key, future = pending
+    row = future.result()
+    if row is not None:
+      cache.put(key, row)
+    return row
+  return pending
+
+
+def export_metadata_csv(base_path: Path, matrix_files: List[Union[Path, str]], output_csv: Path, jobs: int = 8, deep_stats: bool = False):
+  """
+  Writes the metadata of `matrix_files` (stored under `base_path`) to `output_csv`, in the same order.
+
+  Sizes, symmetry and sparsity are read from the header of each matrix file, except the Nonzeros and
+  SparsityRatio of SuiteSparse matrices, which come from the collection (that counts both triangles of
+  symmetric matrices, while their files store one). Rows are written as
+  soon as they (and all the previous ones) are available, to a temporary file that replaces
+  `output_csv` once complete.
+
+  Args:
+    jobs: maximum number of concurrent metadata lookups (web pages, statistics).
+    deep_stats: also compute row statistics (`DEEP_STATS_FIELDS`), reading each matrix once.
+  """
+  start = time.perf_counter()
+  output_csv.parent.mkdir(parents=True, exist_ok=True)
+  tmp_csv = tmp_path_for(output_csv)
+
+  index: Optional[SuiteSparseIndex] = None
+  index_loaded = False
+  cache = MetadataCache()
+  session = requests.Session()
+  pending: Dict[str, Future] = {}
+  logged = 0
+
+  def submit(key: str, fn, *args):
+    row = cache.get(key)
+    if row is not None:
+      return row
+    if key not in pending:
+      pending[key] = pool.submit(fn, *args)
+    return key, pending[key]
+
+  try:
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool, tmp_csv.open("w", newline="") as f:
+      # Rows (or pending rows) in file order: (category, base row, local row, statistics row)
+      rows: List[tuple] = []
+      for file in matrix_files:
+        file_path = Path(file)
+        if len(file_path.parts) < 2:
+          continue
+
+        relative_parts = resolve_matrix_path(file_path).relative_to(base_path).parts
+        category = relative_parts[0]  # user-defined category path
+        source = relative_parts[1]    # Matrix type: DirectURL, Graph500, PaRMAT, SuiteSparse...
+        name = uncompressed_path(file_path).stem
+        local = local_row(file_path)
+
+        if source == "Graph500":
+          row = graph500_row(name)
+        elif source == "PaRMAT":
+          row = parmat_row(name)
+        elif source == "DirectURL":
+          row = {"Name": name, "Source": "DirectURL"}
+        else:
+          group = file_path.parts[-3]
+          if not index_loaded:
+            index_loaded = True
+            try:
+              index = get_index()
+            except SuiteSparseIndexError as e:
+              console.print(f"[yellow]{e}[/yellow]")
+          row = suite_sparse_index_row(index, group, name) if index is not None else None
+          if row is None and local is not None:
+            row = {"Name": name, "Group": group, "Link": f"{SUITE_SPARSE_URL}/{group}/{name}", "Source": "SuiteSparse"}
+          else:
+            if row is None:
+              # Neither in the local index nor readable: fall back to the (cached) matrix web page
+              row = submit(f"suitesparse:{group}/{name}", suite_sparse_page_row, session, group, name)
+            # SuiteSparse counts the entries of both triangles of symmetric matrices: keep its count
+            local = {k: v for k, v in local.items() if k not in ENTRY_COUNT_FIELDS} if local is not None else None
+
+        stats = None
+        if deep_stats and local is not None:
+          stat = file_path.stat()
+          stats = submit(f"stats:{resolve_matrix_path(file_path)}:{stat.st_size}:{stat.st_mtime_ns}", deep_stats_row, file_path)
+        rows.append((category, row, local, stats))
+
+      writer = csv.DictWriter(f, fieldnames=FIELDS + (DEEP_STATS_FIELDS if deep_stats else []), restval="")
+      writer.writeheader()
+      for category, row, local, stats in rows:
+        row = _resolve(row, cache)
+        if row is None:
+          continue
+        writer.writerow({**row, **(local or {}), **(_resolve(stats, cache) or {}), "Category": category})
+        f.flush()
+        logged += 1
+    commit(tmp_csv, output_csv)
+  finally:
+    cache.close()
+    session.close()
+    tmp_csv.unlink(missing_ok=True)
+
+  console.print(f"[dim blue]Logged {logged} matrices ({len(pending)} lookups) in {time.perf_counter() - start:.2f}s[/dim blue]")
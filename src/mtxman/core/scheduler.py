@@ -0,0 +1,289 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+from rich.console import Console
+
+from mtxman.core.core import DatasetManager, Flags, PostProcess, resolve_matrix_path
+from mtxman.core.trace import Tracer
+from mtxman.io.compressed import compressed_path_for
+
+console = Console()
+
+
+class JobKind(Enum):
+  """Worker pools, in pipeline order: the steps of a task must follow this order."""
+  NET = 'net'          # Downloads
+  EXTRACT = 'extract'  # Archive extraction
+  CPU = 'cpu'          # Generators and other CPU-heavy work
+  CONVERT = 'convert'  # Format conversions (e.g., MTX to BMTX)
+
+PIPELINE_ORDER = list(JobKind)
+# Stage recorded in the sync manifest when a step of each kind completes
+STAGES = {
+  JobKind.NET: 'downloaded',
+  JobKind.EXTRACT: 'extracted',
+  JobKind.CPU: 'generated',
+  JobKind.CONVERT: 'converted',
+}
+# Name of the steps of each kind in traces (see `mtxman.core.trace`)
+STEP_NAMES = {
+  JobKind.NET: 'download',
+  JobKind.EXTRACT: 'extract',
+  JobKind.CPU: 'generate',
+  JobKind.CONVERT: 'convert',
+}
+
+
+@dataclass
+class Step:
+  """
+  A unit of work executed on the worker pool of its `kind`.
+  `run` may return False to stop the task: following steps are skipped and the matrix is not registered.
+  """
+  kind: JobKind
+  run: Callable[[], Optional[bool]]
+  stage: Optional[str] = None  # Recorded in the sync manifest once `run` completes
+  name: str = ''               # Name of the step in traces
+
+
+@dataclass
+class MatrixTask:
+  """All the steps needed to bring a single matrix up to date, executed in order."""
+  name: str
+  path: Path
+  dataset_manager: DatasetManager
+  is_bmtx: bool
+  steps: List[Step] = field(default_factory=list)
+  ok: bool = True
+  identity: Optional[str] = None  # Source identity of the matrix (set by `add_record_step`)
+  flags: Optional[Flags] = None
+  failure_hooks: List[Callable[[], None]] = field(default_factory=list)
+
+  def add_failure_hook(self, hook: Callable[[], None]):
+    """
+    Registers `hook` to run if the task fails or stops early, to release what its steps hold
+    (e.g., scratch space reserved by a download whose extraction step never runs).
+    """
+    self.failure_hooks.append(hook)
+
+  def fail(self):
+    """Marks the task as failed and runs its failure hooks (once)."""
+    self.ok = False
+    hooks, self.failure_hooks = self.failure_hooks, []
+    for hook in hooks:
+      try:
+        hook()
+      except Exception as e:
+        console.print(f"[red]Failed to clean up after '{self.name}': {e}[/red]")
+
+  def add_step(self, kind: JobKind, run: Callable[[], Optional[bool]], stage: Optional[str] = None, name: Optional[str] = None):
+    """Appends a step; `stage` and `name` default to the stage and name of its kind (see `STAGES` and `STEP_NAMES`)."""
+    # A worker may block waiting for a slot in the pool of the next step: keeping steps in
+    # pipeline order guarantees that those waits can never form a cycle
+    if self.steps and PIPELINE_ORDER.index(kind) < PIPELINE_ORDER.index(self.steps[-1].kind):
+      raise ValueError(f"Step '{kind.value}' cannot follow step '{self.steps[-1].kind.value}'")
+    self.steps.append(Step(kind, run, stage or STAGES[kind], name or STEP_NAMES[kind]))
+
+  def add_postprocess_step(self, ops: List[PostProcess], flags: Flags, is_bmtx: bool = False):
+    """Post-processes the produced file (`.bmtx` with `is_bmtx`, `.mtx` otherwise), if `ops` is not empty."""
+    if ops:
+      self.add_step(
+        JobKind.CPU,
+        lambda: self.dataset_manager.postprocess_matrix(self.path, is_bmtx, ops, flags, self.name),
+        stage='postprocessed',
+        name='postprocess',
+      )
+
+  def add_convert_step(self, flags: Flags):
+    self.add_step(JobKind.CONVERT, lambda: self.dataset_manager.convert_to_bmtx(self.path, flags, self.name))
+
+  def add_compress_step(self, flags: Flags):
+    """Compresses the produced file (with `--compress`), if the matrix is produced again or is not compressed yet."""
+    compressed_path = compressed_path_for(self.path.with_suffix('.bmtx' if self.is_bmtx else '.mtx'))
+    if flags.compress is not None and (self.steps or not compressed_path.is_file()):
+      self.add_step(JobKind.CONVERT, lambda: self.dataset_manager.compress_matrix(self.path, self.is_bmtx, flags, self.name), name='compress')
+      self.steps[-1].stage = None
+
+  def add_csr_step(self, flags: Flags):
+    """Exports the produced file to CSR (with `--csr`), if the matrix is produced again or its export is missing or outdated."""
+    if flags.csr and (self.steps or not self.dataset_manager.is_csr_up_to_date(self.path, self.is_bmtx)):
+      self.add_step(JobKind.CONVERT, lambda: self.dataset_manager.export_csr(self.path, self.is_bmtx, flags, self.name), name='csr')
+      self.steps[-1].stage = None
+
+  def add_shard_step(self, flags: Flags):
+    """Splits the produced file into row shards (with `--shards`), if the matrix is produced again or its shards are missing or outdated."""
+    if flags.shards and (self.steps or not self.dataset_manager.are_shards_up_to_date(self.path, self.is_bmtx, flags)):
+      self.add_step(JobKind.CONVERT, lambda: self.dataset_manager.shard_matrix(self.path, self.is_bmtx, flags, self.name), name='shard')
+      self.steps[-1].stage = None
+
+  def add_record_step(self, identity: str, flags: Flags):
+    """
+    Last step: records the produced files in the sync manifest and moves them into the matrix
+    store (if enabled), replacing them with links.
+    """
+    if self.dataset_manager.store is None and self.dataset_manager.manifest is None:
+      return
+    self.identity = identity
+    self.flags = flags
+    self.add_step(JobKind.CONVERT, lambda: self.dataset_manager.record_matrix(self.path, identity, flags), name='record')
+    self.steps[-1].stage = None
+
+  @property
+  def has_work(self) -> bool:
+    """True if the task produces files (not just records existing ones)."""
+    return len(self.steps) > (1 if self.identity is not None else 0)
+
+
+class SyncScheduler:
+  """
+  Runs the steps of all the planned matrix tasks on bounded worker pools (one per `JobKind`).
+
+  Steps of the same task run one after the other, while steps of different tasks run concurrently,
+  so the pools form a pipeline (e.g., matrix N+1 downloads while matrix N is extracted and
+  matrix N-1 is converted). Hand-offs between pools are bounded: at most `queue_size` tasks can
+  wait for a free worker of a given kind, otherwise the worker that produced them blocks
+  (back-pressure), so fast stages cannot run arbitrarily ahead of slow ones.
+
+  Tasks are planned lazily: `add` accepts any iterable (e.g., a generator over an index query),
+  which `run` consumes in order, starting each task as soon as it is planned.
+
+  Matrices are registered in the `DatasetManager`s only once every task is done, following the
+  order in which tasks were added (i.e., the configuration order), so summaries are deterministic.
+
+  Tasks producing a matrix with the same store identity as an earlier task (e.g., the same
+  SuiteSparse matrix in two categories) do not run: once every task is done, their files are
+  linked from the store.
+
+  Every step (and the planning of every task) is measured as a span of `tracer`.
+  """
+
+  def __init__(self, net_jobs: int = 1, cpu_jobs: int = 1, convert_jobs: int = 1, extract_jobs: int = 1, queue_size: int = 2, tracer: Optional[Tracer] = None):
+    self.limits: Dict[JobKind, int] = {
+      JobKind.NET: max(1, net_jobs),
+      JobKind.EXTRACT: max(1, extract_jobs),
+      JobKind.CPU: max(1, cpu_jobs),
+      JobKind.CONVERT: max(1, convert_jobs),
+    }
+    self.queue_size = max(0, queue_size)
+    self.tracer = tracer or Tracer()
+    self.tasks: List[MatrixTask] = []
+    self._sources: List[Iterable[MatrixTask]] = []
+    self._planned_paths = set()
+    self._leaders: Dict[str, MatrixTask] = {}
+    self._followers: List[MatrixTask] = []
+    self._remaining = 0
+    self._done = threading.Condition()
+
+  def add(self, tasks: Iterable[MatrixTask]):
+    """Adds tasks, consumed (planned) by `run` only."""
+    self._sources.append(tasks)
+
+  def _plan(self, task: MatrixTask):
+    key = resolve_matrix_path(task.path)
+    if key in self._planned_paths:
+      # The same matrix is listed more than once: produce it once, register it every time
+      task.steps = []
+    elif task.identity is not None and task.dataset_manager.store is not None:
+      if task.identity not in self._leaders:
+        self._leaders[task.identity] = task
+      elif task.has_work:
+        task.steps = []
+        self._followers.append(task)
+    self._planned_paths.add(key)
+    self.tasks.append(task)
+
+  def run(self):
+    """Plans and executes all the added tasks, then registers the produced matrices in order."""
+    executors = {
+      kind: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f'mtxman-{kind.value}')
+      for kind, n in self.limits.items()
+    }
+    # Running + queued steps per pool
+    slots = {
+      kind: threading.BoundedSemaphore(n + self.queue_size)
+      for kind, n in self.limits.items()
+    }
+
+    def finish(task: MatrixTask, ok: bool):
+      if ok:
+        task.ok = True
+      else:
+        task.fail()
+      with self._done:
+        self._remaining -= 1
+        self._done.notify_all()
+
+    def advance(task: MatrixTask, i: int):
+      if i >= len(task.steps):
+        finish(task, True)
+        return
+      kind = task.steps[i].kind
+      slots[kind].acquire()
+      executors[kind].submit(run_step, task, i)
+
+    def run_step(task: MatrixTask, i: int):
+      kind = task.steps[i].kind
+      result = None
+      try:
+        # Consecutive steps of the same kind run on the same worker
+        while result is not False and i < len(task.steps) and task.steps[i].kind == kind:
+          step = task.steps[i]
+          with self.tracer.span(task.name, step.name, kind.value) as span:
+            result = step.run()
+            span.ok = result is not False
+          if result is not False and step.stage is not None:
+            task.dataset_manager.mark_stage(task.path, task.is_bmtx, step.stage)
+          i += 1
+      except Exception as e:
+        console.print(f"[red]'{task.name}' failed: {e}[/red]")
+        result = False
+      finally:
+        slots[kind].release()
+      if result is False:
+        finish(task, False)
+      else:
+        advance(task, i)
+
+    try:
+      for source in self._sources:
+        tasks = iter(source)
+        while True:
+          # Planning a task checks its files (and may query indexes): measured until it is yielded
+          with self.tracer.span('', 'plan', 'plan') as span:
+            task = next(tasks, None)
+            if task is not None:
+              span.matrix = task.name
+          if task is None:
+            break
+          self._plan(task)
+          with self._done:
+            self._remaining += 1
+          advance(task, 0)
+      self._sources = []
+      with self._done:
+        while self._remaining > 0:
+          self._done.wait(timeout=0.5)
+    finally:
+      for executor in executors.values():
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    for task in self._followers:
+      leader = self._leaders[task.identity]
+      with self.tracer.span(task.name, 'link', JobKind.CONVERT.value):
+        task.ok = leader.ok and task.dataset_manager.link_from_store(task.path, task.identity, task.flags)
+      if task.ok:
+        task.dataset_manager.record_matrix(task.path, task.identity, task.flags)
+        console.print(f"[dim]'{task.name}' linked from the matrix store[/dim]")
+        if task.flags.csr:
+          with self.tracer.span(task.name, 'csr', JobKind.CONVERT.value):
+            task.ok = task.dataset_manager.export_csr(task.path, task.is_bmtx, task.flags, task.name)
+        if task.ok and task.flags.shards:
+          with self.tracer.span(task.name, 'shard', JobKind.CONVERT.value):
+            task.ok = task.dataset_manager.shard_matrix(task.path, task.is_bmtx, task.flags, task.name)
+
+    for task in self.tasks:
+      if task.ok:
+        task.dataset_manager.register_matrix_path(task.path, task.is_bmtx)
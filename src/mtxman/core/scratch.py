@@ -0,0 +1,140 @@
+import hashlib
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+from rich.console import Console
+
+from mtxman.core.http import get_downloader, part_path_for
+
+console = Console()
+
+# Size assumed for downloads whose length is not advertised by the server
+DEFAULT_DOWNLOAD_SIZE_ESTIMATE = 256 * 1024 * 1024
+
+
+class Reservation:
+  """Scratch space reserved for a single download. Release it once the downloaded file is removed."""
+
+  def __init__(self, space: 'ScratchSpace', nbytes: int, path: Optional[Path]):
+    self.space = space
+    self.nbytes = nbytes
+    self.path = path
+    self.released = False
+
+  def outstanding(self) -> int:
+    """Reserved bytes that are not yet written to disk."""
+    written = 0
+    if self.path is not None:
+      # The file is downloaded to its '.part' file, then renamed. Segmented downloads preallocate
+      # the '.part' file as a sparse file: count the allocated blocks, not the apparent size
+      for path in (self.path, part_path_for(self.path)):
+        try:
+          st = path.stat()
+        except OSError:
+          continue
+        written = max(written, st.st_blocks * 512 if hasattr(st, 'st_blocks') else st.st_size)
+    return max(0, self.nbytes - written)
+
+  def release(self):
+    self.space.release(self)
+
+
+class ScratchSpace:
+  """
+  Tracks the free space of a scratch folder shared by concurrent downloads.
+
+  `reserve` blocks until the expected size of a download fits in the scratch folder without
+  bringing its free space below `min_free` bytes. This is the back-pressure that keeps
+  downloads from running ahead of extraction and filling up the disk.
+  """
+  _instances: Dict[Path, 'ScratchSpace'] = {}
+  _instances_lock = threading.Lock()
+
+  def __init__(self, path: Path, min_free: int):
+    self.path = path
+    self.min_free = min_free
+    self.reservations: List[Reservation] = []
+    self._cond = threading.Condition()
+
+  @classmethod
+  def get(cls, path: Path, min_free: int = 0) -> 'ScratchSpace':
+    path = Path(path).resolve()
+    with cls._instances_lock:
+      if path not in cls._instances:
+        cls._instances[path] = ScratchSpace(path, min_free)
+      return cls._instances[path]
+
+  def _available(self) -> int:
+    self.path.mkdir(parents=True, exist_ok=True)
+    free = shutil.disk_usage(self.path).free
+    return free - self.min_free - sum(r.outstanding() for r in self.reservations)
+
+  def reserve(self, nbytes: Optional[int], path: Optional[Path] = None, name: str = '') -> Reservation:
+    """
+    Reserves `nbytes` of scratch space for a file that will be written at `path`.
+
+    If nothing else holds a reservation, the request is granted even if it does not fit,
+    since waiting could never free more space.
+    """
+    nbytes = nbytes if nbytes is not None else DEFAULT_DOWNLOAD_SIZE_ESTIMATE
+    warned = False
+    with self._cond:
+      while self.reservations and self._available() < nbytes:
+        if not warned:
+          console.print(f"[yellow]⏳ Waiting for scratch space ({nbytes / 1e6:.1f} MB) to download '{name}'[/yellow]")
+          warned = True
+        self._cond.wait(timeout=5)
+      if not self.reservations and self._available() < nbytes:
+        console.print(f"[yellow]Warning: scratch folder '{self.path}' may not have enough free space for '{name}'[/yellow]")
+      reservation = Reservation(self, nbytes, path)
+      self.reservations.append(reservation)
+      return reservation
+
+  def release(self, reservation: Reservation):
+    with self._cond:
+      if not reservation.released:
+        reservation.released = True
+        self.reservations.remove(reservation)
+        self._cond.notify_all()
+
+
+class ScratchDownload:
+  """
+  A download that lives in a private scratch folder until it is extracted.
+
+  `start` blocks until the scratch space for the download can be reserved, `cleanup`
+  removes the folder and releases the reservation. The folder name only depends on the
+  download, so a partial download left by a failed or interrupted run is resumed.
+  """
+
+  def __init__(self, scratch_path: Path, min_free: int, name: str):
+    self.scratch_path = Path(scratch_path)
+    self.min_free = min_free
+    self.name = name
+    self.dir: Optional[Path] = None
+    self.file: Optional[Path] = None
+    self.reservation: Optional[Reservation] = None
+
+  def start(self, url: str, filename: str) -> Path:
+    """Reserves space for `url` and returns the scratch path where it must be downloaded to."""
+    key = hashlib.sha1(f'{self.name}|{url}'.encode()).hexdigest()[:16]
+    self.dir = self.scratch_path / f'download_{key}'
+    self.dir.mkdir(parents=True, exist_ok=True)
+    self.file = self.dir / filename
+    space = ScratchSpace.get(self.scratch_path, self.min_free)
+    self.reservation = space.reserve(get_downloader().remote_size(url), self.file, self.name)
+    return self.file
+
+  def cleanup(self, keep_files: bool = False):
+    """
+    Releases the reservation. With `keep_files`, partial downloads are left for the next run.
+    Calling it again is harmless.
+    """
+    if self.dir is not None and self.dir.is_dir():
+      if not keep_files:
+        shutil.rmtree(self.dir, ignore_errors=True)
+      elif not any(self.dir.iterdir()):
+        self.dir.rmdir()
+    if self.reservation is not None:
+      self.reservation.release()
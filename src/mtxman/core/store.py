@@ -0,0 +1,212 @@
+"""
+Content-addressed store of matrix files.
+
+Files are stored once, under `objects/<hash[:2]>/<sha256><suffix>`, and the matrix paths of the
+categories become hardlinks to them (symlinks when the store is on another file system).
+`refs/` maps each source identity (e.g., `suitesparse:HB/ash219`) and file variant (`.mtx`,
+`.bmtx`, `.bmtx-f64`) to its object, together with the paths linked to it, which is how
+`collect_garbage` finds the objects that are no longer used.
+"""
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from rich.console import Console
+
+console = Console()
+
+STORE_DIRNAME = '.mtxman_store'
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def resolve_matrix_path(path: Union[Path, str]) -> Path:
+  """Resolves the folders of a matrix path, but not the file itself (it may be a symlink into the store)."""
+  path = Path(path)
+  return path.parent.resolve() / path.name
+
+
+def hash_file(path: Path) -> str:
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    while chunk := f.read(HASH_CHUNK_SIZE):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def _points_to(link: Path, target: Path) -> bool:
+  try:
+    return os.path.samefile(link, target)
+  except OSError:
+    return False
+
+
+@dataclass
+class GcStats:
+  objects: int = 0    # Objects removed
+  bytes: int = 0      # Bytes freed
+  refs: int = 0       # Dangling references removed
+
+
+class MatrixStore:
+  """Thread-safe access to a content-addressed store (see the module docstring)."""
+
+  def __init__(self, root: Path):
+    self.root = Path(root).absolute()
+    self.objects_dir = self.root / 'objects'
+    self.refs_dir = self.root / 'refs'
+    self._lock = threading.RLock()
+
+  # ---- references ------------------------------------------------------------------------------
+
+  def _ref_path(self, identity: str) -> Path:
+    key = hashlib.sha1(identity.encode('utf-8')).hexdigest()
+    return self.refs_dir / key[:2] / f'{key}.json'
+
+  def _read_ref(self, identity: str) -> dict:
+    path = self._ref_path(identity)
+    try:
+      ref = json.loads(path.read_text())
+      if ref.get('identity') == identity:
+        return ref
+    except (OSError, ValueError):
+      pass
+    return {'identity': identity, 'variants': {}}
+
+  def _write_ref(self, ref: dict):
+    path = self._ref_path(ref['identity'])
+    if not ref['variants']:
+      path.unlink(missing_ok=True)
+      return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.{uuid.uuid4().hex}.tmp')
+    tmp_path.write_text(json.dumps(ref, indent=1))
+    os.replace(tmp_path, path)
+
+  def _object_path(self, name: str) -> Path:
+    return self.objects_dir / name[:2] / name
+
+  def _record_link(self, identity: str, variant: str, object_name: str, link: Path):
+    with self._lock:
+      ref = self._read_ref(identity)
+      entry = ref['variants'].get(variant)
+      if entry is None or entry['object'] != object_name:
+        entry = ref['variants'][variant] = {'object': object_name, 'links': []}
+      if str(link) not in entry['links']:
+        entry['links'].append(str(link))
+      self._write_ref(ref)
+
+  # ---- objects ---------------------------------------------------------------------------------
+
+  def lookup(self, identity: str, variant: str) -> Optional[Path]:
+    """Returns the stored file of `identity` / `variant`, if any."""
+    with self._lock:
+      entry = self._read_ref(identity)['variants'].get(variant)
+    if entry is None:
+      return None
+    path = self._object_path(entry['object'])
+    return path if path.is_file() else None
+
+  @staticmethod
+  def _link(target: Path, dest: Path):
+    """Atomically makes `dest` a hardlink to `target` (a symlink across file systems)."""
+    tmp_path = dest.with_name(f'{dest.name}.{uuid.uuid4().hex}.link')
+    try:
+      os.link(target, tmp_path)
+    except OSError:
+      os.symlink(target, tmp_path)
+    os.replace(tmp_path, dest)
+
+  def link(self, identity: str, variant: str, dest: Path) -> bool:
+    """Makes `dest` a link to the stored file of `identity` / `variant`. Returns False if not stored."""
+    target = self.lookup(identity, variant)
+    if target is None:
+      return False
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    self._link(target, dest)
+    self._record_link(identity, variant, target.name, dest)
+    return True
+
+  def add(self, identity: str, variant: str, path: Path) -> str:
+    """
+    Moves the file at `path` into the store (unless it is already there) and replaces it with a link.
+    Files with the same content are stored once, even under different identities.
+
+    Returns:
+      The SHA-256 checksum of the file.
+    """
+    path = Path(path)
+    stored = self.lookup(identity, variant)
+    if stored is not None and _points_to(path, stored):
+      self._record_link(identity, variant, stored.name, path)
+      return stored.name[:-len(stored.suffix)] if stored.suffix else stored.name
+
+    checksum = hash_file(path)
+    object_name = checksum + path.suffix
+    object_path = self._object_path(object_name)
+    object_path.parent.mkdir(parents=True, exist_ok=True)
+    with self._lock:
+      # An object with a different size was modified in place through one of its links: replace it
+      if not object_path.exists() or object_path.stat().st_size != path.stat().st_size:
+        tmp_path = object_path.with_name(f'{object_name}.{uuid.uuid4().hex}.tmp')
+        try:
+          # Same file system: the matrix file simply becomes the object
+          os.link(path, tmp_path)
+        except OSError:
+          shutil.copyfile(path, tmp_path)
+        # Objects are shared: nothing must modify them in place
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp_path, object_path)
+      if not _points_to(path, object_path):
+        self._link(object_path, path)
+      self._record_link(identity, variant, object_name, path)
+    return checksum
+
+  def discard(self, object_name: str, link: Path):
+    """Removes the object `object_name` if `link` points to it (i.e., its content got corrupted through `link`)."""
+    object_path = self._object_path(object_name)
+    with self._lock:
+      if _points_to(link, object_path):
+        object_path.unlink(missing_ok=True)
+
+  # ---- garbage collection ----------------------------------------------------------------------
+
+  def collect_garbage(self, dry_run: bool = False) -> GcStats:
+    """Removes the objects that no matrix path links to anymore (and the references to them)."""
+    stats = GcStats()
+    live = set()
+    with self._lock:
+      for ref_path in sorted(self.refs_dir.glob('*/*.json')) if self.refs_dir.exists() else []:
+        try:
+          ref = json.loads(ref_path.read_text())
+        except (OSError, ValueError):
+          stats.refs += 1
+          if not dry_run:
+            ref_path.unlink(missing_ok=True)
+          continue
+        variants: Dict[str, dict] = ref.get('variants', {})
+        for variant, entry in list(variants.items()):
+          object_path = self._object_path(entry['object'])
+          links: List[str] = [link for link in entry['links'] if _points_to(Path(link), object_path)]
+          if links:
+            entry['links'] = links
+            live.add(entry['object'])
+          else:
+            del variants[variant]
+            stats.refs += 1
+        if not dry_run:
+          self._write_ref(ref)
+
+      for object_path in sorted(self.objects_dir.glob('*/*')) if self.objects_dir.exists() else []:
+        if object_path.name in live:
+          continue
+        stats.objects += 1
+        stats.bytes += object_path.stat().st_size
+        if not dry_run:
+          object_path.unlink()
+    return stats
@@ -0,0 +1,342 @@
+"""
+Local index of the SuiteSparse Matrix Collection.
+
+The index is built from the collection's `ssstats.csv` and stored in a SQLite database under the
+user cache folder (`$XDG_CACHE_HOME/mtxman`, default `~/.cache/mtxman`). It is refreshed when
+older than `INDEX_TTL` (or explicitly, with `mtxman index refresh`), so lookups never go to the network.
+"""
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+from rich.console import Console
+
+from mtxman.core.http import get_downloader
+from mtxman.exceptions import DownloadError, SuiteSparseIndexError
+
+console = Console()
+
+SUITE_SPARSE_URL = 'https://sparse.tamu.edu'
+SSSTATS_URL = f'{SUITE_SPARSE_URL}/files/ssstats.csv'
+# Bump when the database layout changes: older databases are rebuilt
+SCHEMA_VERSION = 1
+INDEX_TTL = 30 * 24 * 3600  # Seconds
+
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'mtxman'
+INDEX_PATH = CACHE_DIR / 'suite_sparse_index.sqlite'
+
+
+@dataclass
+class SuiteSparseMatrix:
+  """An entry of the SuiteSparse Matrix Collection (same fields as `ssstats.csv`)."""
+  id: int
+  group: str
+  name: str
+  rows: int
+  cols: int
+  nnz: int
+  dtype: str      # real | complex | binary
+  is2d3d: bool
+  isspd: bool
+  psym: float     # Pattern symmetry
+  nsym: float     # Numerical symmetry
+  kind: str
+
+  @property
+  def full_name(self) -> str:
+    return f'{self.group}/{self.name}'
+
+  @property
+  def symmetric(self) -> bool:
+    return self.psym == 1 and (self.dtype == 'binary' or self.nsym == 1)
+
+  def url(self, format: str = 'MM') -> str:
+    """URL of the archive of the matrix (`MM`: Matrix Market, `RB`: Rutherford-Boeing)."""
+    return f'{SUITE_SPARSE_URL}/{format}/{self.group}/{self.name}.tar.gz'
+
+  def info_url(self) -> str:
+    return f'{SUITE_SPARSE_URL}/{self.group}/{self.name}'
+
+  def image_url(self) -> str:
+    return f'{SUITE_SPARSE_URL}/files/{self.group}/{self.name}.png'
+
+
+_COLUMNS = 'id, matrix_group, name, rows, cols, nnz, dtype, is2d3d, isspd, psym, nsym, kind'
+# Columns that can sort a selection (`RangeQuery.sort_by`)
+SORT_KEYS = {'id': 'id', 'group': 'matrix_group', 'name': 'name', 'rows': 'rows', 'cols': 'cols', 'nnz': 'nnz', 'psym': 'psym', 'nsym': 'nsym'}
+# `RangeQuery.symmetry` values
+SYMMETRY_PREDICATES = {
+  'symmetric': "psym = 1 AND (dtype = 'binary' OR nsym = 1)",
+  'unsymmetric': "NOT (psym = 1 AND (dtype = 'binary' OR nsym = 1))",
+  'pattern-symmetric': 'psym = 1',
+  'spd': 'isspd = 1',
+}
+# `RangeQuery.fields` values, and the matching `dtype`
+FIELDS = {'real': 'real', 'complex': 'complex', 'pattern': 'binary'}
+
+_SCHEMA = f'''
+CREATE TABLE matrices (
+  id INTEGER PRIMARY KEY,
+  matrix_group TEXT NOT NULL,
+  name TEXT NOT NULL,
+  rows INTEGER NOT NULL,
+  cols INTEGER NOT NULL,
+  nnz INTEGER NOT NULL,
+  dtype TEXT NOT NULL,
+  is2d3d INTEGER NOT NULL,
+  isspd INTEGER NOT NULL,
+  psym REAL NOT NULL,
+  nsym REAL NOT NULL,
+  kind TEXT NOT NULL
+);
+CREATE UNIQUE INDEX matrices_group_name ON matrices (matrix_group, name);
+CREATE INDEX matrices_name ON matrices (name);
+CREATE INDEX matrices_nnz ON matrices (nnz);
+CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+'''
+
+
+def parse_ssstats(text: str) -> Iterator[tuple]:
+  """
+  Parses `ssstats.csv`: a line with the number of matrices, a line with the date of the last
+  update, then one line per matrix (ids are the line numbers, starting from 1).
+  """
+  lines = io.StringIO(text)
+  lines.readline()
+  lines.readline()
+  for matrix_id, row in enumerate(csv.reader(lines), start=1):
+    if not row:
+      continue
+    group, name, rows, cols, nnz, real, logical, is2d3d, isspd, psym, nsym, kind = row[:12]
+    dtype = 'binary' if int(logical) else ('real' if int(real) else 'complex')
+    yield (matrix_id, group, name, int(rows), int(cols), int(nnz), dtype, int(is2d3d), int(isspd), float(psym), float(nsym), kind)
+
+
+@dataclass
+class RangeQuery:
+  """
+  A selection of SuiteSparse matrices. Every filter is translated to SQL (`where`), so that SQLite
+  evaluates the whole selection, and `SuiteSparseIndex.select` streams the matches.
+  """
+  min_nnz: int = 0
+  max_nnz: Optional[int] = None
+  min_rows: Optional[int] = None
+  max_rows: Optional[int] = None
+  min_cols: Optional[int] = None
+  max_cols: Optional[int] = None
+  kinds: List[str] = field(default_factory=list)    # Substrings of the kind (any of them, case-insensitive)
+  symmetry: Optional[str] = None                    # A key of SYMMETRY_PREDICATES
+  fields: List[str] = field(default_factory=list)   # real | complex | pattern (any of them)
+  groups: List[str] = field(default_factory=list)   # Glob patterns of the group (any of them)
+  sort_by: str = 'id'                               # A key of SORT_KEYS, '-' prefix for descending order
+  limit: Optional[int] = None
+  sample: bool = False                              # Select `limit` random matches (reproducible with `seed`), not the first ones
+  seed: int = 0
+
+  def __post_init__(self):
+    if self.symmetry is not None and self.symmetry not in SYMMETRY_PREDICATES:
+      raise ValueError(f"Unknown symmetry '{self.symmetry}' (expected one of: {', '.join(SYMMETRY_PREDICATES)})")
+    unknown = [f for f in self.fields if f not in FIELDS]
+    if unknown:
+      raise ValueError(f"Unknown field(s) {', '.join(unknown)} (expected: {', '.join(FIELDS)})")
+    if self.sort_by.lstrip('-') not in SORT_KEYS:
+      raise ValueError(f"Unknown sort key '{self.sort_by}' (expected one of: {', '.join(SORT_KEYS)}, optionally prefixed by '-')")
+    if self.sample and self.limit is None:
+      raise ValueError("'sample' requires a 'limit'")
+
+  def where(self) -> Tuple[str, tuple]:
+    """The SQL condition selecting the matching matrices, and its parameters."""
+    clauses, params = [], []
+    for column, low, high in (
+      ('nnz', self.min_nnz, self.max_nnz),
+      ('rows', self.min_rows, self.max_rows),
+      ('cols', self.min_cols, self.max_cols),
+    ):
+      if low is not None:
+        clauses.append(f'{column} >= ?')
+        params.append(low)
+      if high is not None:
+        clauses.append(f'{column} <= ?')
+        params.append(high)
+    if self.kinds:
+      clauses.append('(' + ' OR '.join(['LOWER(kind) LIKE ?'] * len(self.kinds)) + ')')
+      params.extend(f'%{kind.lower()}%' for kind in self.kinds)
+    if self.symmetry is not None:
+      clauses.append(f'({SYMMETRY_PREDICATES[self.symmetry]})')
+    if self.fields:
+      clauses.append(f"dtype IN ({', '.join('?' * len(self.fields))})")
+      params.extend(FIELDS[f] for f in self.fields)
+    if self.groups:
+      clauses.append('(' + ' OR '.join(['matrix_group GLOB ?'] * len(self.groups)) + ')')
+      params.extend(self.groups)
+    return ' AND '.join(clauses) or '1', tuple(params)
+
+  def order_by(self) -> str:
+    column = SORT_KEYS[self.sort_by.lstrip('-')]
+    return f"{column} {'DESC' if self.sort_by.startswith('-') else 'ASC'}, id"
+
+
+def _sample_key(matrix_id: int, seed: int) -> int:
+  """Pseudo-random rank of a matrix, the same for a given seed (SQLite's random() cannot be seeded)."""
+  digest = hashlib.blake2b(f'{seed}:{matrix_id}'.encode(), digest_size=8).digest()
+  return int.from_bytes(digest, 'little') >> 1  # SQLite integers are signed
+
+
+class SuiteSparseIndex:
+  """Indexed lookups over the local SuiteSparse index (thread-safe)."""
+
+  def __init__(self, path: Path = INDEX_PATH):
+    self.path = path
+    self._conn: Optional[sqlite3.Connection] = None
+    self._lock = threading.Lock()
+
+  def _info(self, conn: sqlite3.Connection) -> dict:
+    try:
+      return dict(conn.execute('SELECT key, value FROM info').fetchall())
+    except sqlite3.DatabaseError:
+      return {}
+
+  def info(self) -> dict:
+    """Returns the index metadata (schema version, source date, update time, number of matrices), empty if missing."""
+    with self._lock:
+      if self._conn is None and not self.path.exists():
+        return {}
+      return self._info(self._connect())
+
+  def _connect(self) -> sqlite3.Connection:
+    if self._conn is None:
+      self._conn = sqlite3.connect(self.path, check_same_thread=False)
+      self._conn.create_function('mtxman_sample_key', 2, _sample_key, deterministic=True)
+    return self._conn
+
+  def _close(self):
+    if self._conn is not None:
+      self._conn.close()
+      self._conn = None
+
+  def is_fresh(self, ttl: float = INDEX_TTL) -> bool:
+    info = self.info()
+    if info.get('schema_version') != str(SCHEMA_VERSION):
+      return False
+    return time.time() - float(info.get('updated_at', 0)) < ttl
+
+  def refresh(self):
+    """Downloads `ssstats.csv` and atomically replaces the index with a new one."""
+    console.print(f'[cyan]Refreshing the SuiteSparse index from {SSSTATS_URL}[/cyan]')
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    csv_path = self.path.with_name('ssstats.csv')
+    get_downloader().download(SSSTATS_URL, csv_path, name='ssstats.csv')
+    text = csv_path.read_text(encoding='utf-8', errors='replace')
+    source_date = text.splitlines()[1].strip() if text.count('\n') > 1 else ''
+
+    tmp_path = self.path.with_name(self.path.name + '.tmp')
+    tmp_path.unlink(missing_ok=True)
+    try:
+      conn = sqlite3.connect(tmp_path)
+      with conn:
+        conn.executescript(_SCHEMA)
+        # INSERT OR REPLACE: a group/name pair listed twice keeps its last entry
+        conn.executemany(f'INSERT OR REPLACE INTO matrices ({_COLUMNS}) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)', parse_ssstats(text))
+        count = conn.execute('SELECT COUNT(*) FROM matrices').fetchone()[0]
+        conn.executemany('INSERT INTO info VALUES (?, ?)', [
+          ('schema_version', str(SCHEMA_VERSION)),
+          ('source_date', source_date),
+          ('updated_at', str(time.time())),
+          ('count', str(count)),
+        ])
+      conn.close()
+      if count == 0:
+        raise SuiteSparseIndexError(f'{SSSTATS_URL} does not list any matrix')
+      with self._lock:
+        self._close()
+        os.replace(tmp_path, self.path)
+    except (ValueError, csv.Error) as e:
+      raise SuiteSparseIndexError(f'Cannot parse {SSSTATS_URL}: {e}')
+    finally:
+      tmp_path.unlink(missing_ok=True)
+      csv_path.unlink(missing_ok=True)
+    console.print(f'[green]SuiteSparse index updated: {count} matrices (collection updated on {source_date})[/green]')
+
+  def ensure_fresh(self, ttl: float = INDEX_TTL):
+    """Refreshes the index if it is missing or stale. A stale index is still used if the refresh fails."""
+    if self.is_fresh(ttl):
+      return
+    try:
+      self.refresh()
+    except (DownloadError, SuiteSparseIndexError) as e:
+      if self.info().get('schema_version') != str(SCHEMA_VERSION):
+        raise SuiteSparseIndexError(f'The SuiteSparse index is not available and cannot be built: {e}')
+      console.print(f'[yellow]Cannot refresh the SuiteSparse index ({e}), using the cached one[/yellow]')
+
+  @staticmethod
+  def _matrix(r: tuple) -> SuiteSparseMatrix:
+    return SuiteSparseMatrix(r[0], r[1], r[2], r[3], r[4], r[5], r[6], bool(r[7]), bool(r[8]), r[9], r[10], r[11])
+
+  def _query(self, where: str, params: tuple, suffix: str = '') -> List[SuiteSparseMatrix]:
+    with self._lock:
+      rows = self._connect().execute(f'SELECT {_COLUMNS} FROM matrices WHERE {where} {suffix}', params).fetchall()
+    return [self._matrix(r) for r in rows]
+
+  def lookup(self, group: str, name: str) -> Optional[SuiteSparseMatrix]:
+    """Returns the matrix `group/name` (exact match), None if it is not in the collection."""
+    matrices = self._query('matrix_group = ? AND name = ?', (group, name))
+    return matrices[0] if matrices else None
+
+  def find_by_name(self, name: str) -> List[SuiteSparseMatrix]:
+    """Returns the matrices called `name` in any group."""
+    return self._query('name = ?', (name,), 'ORDER BY id')
+
+  def nnz_range(self, min_nnz: int, max_nnz: int, limit: int) -> List[SuiteSparseMatrix]:
+    """Returns (by id) at most `limit` matrices with `min_nnz <= nnz <= max_nnz`."""
+    return list(self.select(RangeQuery(min_nnz=min_nnz, max_nnz=max_nnz, limit=limit)))
+
+  def select(self, query: RangeQuery, batch_size: int = 16) -> Iterator[SuiteSparseMatrix]:
+    """
+    Lazily yields the matrices selected by `query`, in its order. Rows are fetched from SQLite in
+    batches of `batch_size`, so the first matches are available before the query is consumed.
+    """
+    where, params = query.where()
+    if query.sample:
+      # Rank the matches pseudo-randomly, keep the first `limit`, then sort them
+      sql = (
+        f'SELECT {_COLUMNS} FROM (SELECT * FROM matrices WHERE {where} ORDER BY mtxman_sample_key(id, ?) LIMIT ?) '
+        f'ORDER BY {query.order_by()}'
+      )
+      params += (query.seed, query.limit)
+    else:
+      sql = f'SELECT {_COLUMNS} FROM matrices WHERE {where} ORDER BY {query.order_by()}'
+      if query.limit is not None:
+        sql += ' LIMIT ?'
+        params += (query.limit,)
+    with self._lock:
+      cursor = self._connect().execute(sql, params)
+    try:
+      while True:
+        with self._lock:
+          rows = cursor.fetchmany(batch_size)
+        if not rows:
+          return
+        for r in rows:
+          yield self._matrix(r)
+    finally:
+      cursor.close()
+
+
+_index: Optional[SuiteSparseIndex] = None
+_index_lock = threading.Lock()
+
+def get_index() -> SuiteSparseIndex:
+  """Returns the process-wide SuiteSparse index, refreshing it (once per process) if missing or stale."""
+  global _index
+  with _index_lock:
+    if _index is None:
+      index = SuiteSparseIndex()
+      index.ensure_fresh()
+      _index = index
+    return _index
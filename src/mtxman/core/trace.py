@@ -0,0 +1,172 @@
+"""
+Sync tracing: wall time, bytes read and written, peak memory and CPU time of every stage of
+every matrix (planning, download, extraction, generation, post-processing, conversion...).
+
+The scheduler opens a span around each step (`Tracer.span`), and the code running the step
+reports the bytes it moves with `add_io` (a no-op outside of a span). `Tracer.write` saves the
+spans as JSON lines (`.jsonl` files) or as a Chrome trace (any other suffix: open it in
+chrome://tracing or https://ui.perfetto.dev, one row per worker thread).
+
+Peak RSS is the high-water mark of the MtxMan process, or of its largest child process, when
+the span ends. Child CPU time is the CPU time of the child processes (external generators and
+converters) that exited during the span: with concurrent jobs, it can include children waited
+for by other workers.
+"""
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List
+from rich import box
+from rich.table import Table
+
+from mtxman.io.atomic import atomic_write
+
+# ru_maxrss is in KiB on Linux, in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+_local = threading.local()
+
+
+@dataclass
+class Span:
+  matrix: str
+  stage: str             # e.g., 'download', 'convert' ('plan' for the planning of the matrix)
+  kind: str              # Worker pool of the stage (see `scheduler.JobKind`)
+  thread: str
+  start: float           # Seconds since the tracer was created
+  wall: float = 0.0      # Seconds
+  cpu: float = 0.0       # CPU time of the thread running the stage (seconds)
+  child_cpu: float = 0.0 # CPU time of the child processes that exited during the stage (seconds)
+  bytes_in: int = 0
+  bytes_out: int = 0
+  peak_rss: int = 0      # Bytes
+  ok: bool = True
+
+  @property
+  def throughput(self) -> float:
+    """Bytes per second (of the larger of the bytes read and written)."""
+    return max(self.bytes_in, self.bytes_out) / self.wall if self.wall > 0 else 0.0
+
+
+def _children_cpu() -> float:
+  usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+  return usage.ru_utime + usage.ru_stime
+
+
+def _peak_rss() -> int:
+  return max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)) * _RSS_UNIT
+
+
+def add_io(bytes_in: int = 0, bytes_out: int = 0):
+  """Adds bytes read / written to the span open in this thread, if any."""
+  span = getattr(_local, 'span', None)
+  if span is not None:
+    span.bytes_in += bytes_in
+    span.bytes_out += bytes_out
+
+
+def file_size(path: Path) -> int:
+  """Size of the file (0 if missing), or total size of the files of a folder."""
+  path = Path(path)
+  try:
+    if path.is_dir():
+      return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+    return path.stat().st_size
+  except OSError:
+    return 0
+
+
+class Tracer:
+  """Collects the spans of a sync (thread-safe)."""
+
+  def __init__(self):
+    self.spans: List[Span] = []
+    self._origin = time.perf_counter()
+    self._lock = threading.Lock()
+
+  @contextmanager
+  def span(self, matrix: str, stage: str, kind: str) -> Iterator[Span]:
+    """Measures the block as a stage of `matrix`. Set `ok` on the yielded span if the stage fails without raising."""
+    span = Span(matrix, stage, kind, threading.current_thread().name, time.perf_counter() - self._origin)
+    parent = getattr(_local, 'span', None)
+    _local.span = span
+    cpu = time.thread_time()
+    child_cpu = _children_cpu()
+    try:
+      yield span
+    except BaseException:
+      span.ok = False
+      raise
+    finally:
+      span.wall = time.perf_counter() - self._origin - span.start
+      span.cpu = time.thread_time() - cpu
+      span.child_cpu = _children_cpu() - child_cpu
+      span.peak_rss = _peak_rss()
+      _local.span = parent
+      with self._lock:
+        self.spans.append(span)
+
+  def write(self, path: Path):
+    """Writes the spans as JSON lines (`.jsonl` suffix) or as a Chrome trace (any other suffix)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    spans = sorted(self.spans, key=lambda s: s.start)
+    with atomic_write(path, 'w') as f:
+      if path.suffix == '.jsonl':
+        for span in spans:
+          f.write(json.dumps(asdict(span)) + '\n')
+      else:
+        json.dump(self._chrome_trace(spans), f)
+
+  @staticmethod
+  def _chrome_trace(spans: List[Span]) -> Dict:
+    pid = os.getpid()
+    threads: Dict[str, int] = {}
+    events = []
+    for span in spans:
+      tid = threads.setdefault(span.thread, len(threads))
+      args = {k: v for k, v in asdict(span).items() if k not in ('start', 'wall', 'thread')}
+      events.append({
+        'name': f'{span.stage} {span.matrix}'.strip(),
+        'cat': span.kind,
+        'ph': 'X',
+        'ts': round(span.start * 1e6),
+        'dur': round(span.wall * 1e6),
+        'pid': pid,
+        'tid': tid,
+        'args': args,
+      })
+    events += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}} for name, tid in threads.items()]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+  def summary_table(self, top: int = 5) -> Table:
+    """
+    The `top` longest stages (failed ones in red; 'RSS MB' is the peak RSS), with the total time
+    of each stage in the caption. CPU times are only written to trace files.
+    """
+    totals: Dict[str, float] = defaultdict(float)
+    for span in self.spans:
+      totals[span.stage] += span.wall
+    table = Table(title=f'Top {top} time sinks', title_justify='left', caption_justify='left', box=box.SIMPLE_HEAD, pad_edge=False)
+    table.caption = 'Total per stage: ' + ', '.join(f'{stage} {wall:.2f}s' for stage, wall in sorted(totals.items(), key=lambda t: -t[1]))
+    table.add_column('Matrix', max_width=20, no_wrap=True, overflow='ellipsis')
+    table.add_column('Stage', no_wrap=True)
+    for column in ('Wall s', 'In MB', 'Out MB', 'MB/s', 'RSS MB'):
+      table.add_column(column, justify='right')
+    for span in sorted(self.spans, key=lambda s: -s.wall)[:top]:
+      table.add_row(
+        span.matrix or '-',
+        span.stage if span.ok else f'[red]{span.stage}[/red]',
+        f'{span.wall:.2f}',
+        f'{span.bytes_in / 1e6:.1f}',
+        f'{span.bytes_out / 1e6:.1f}',
+        f'{span.throughput / 1e6:.1f}',
+        f'{span.peak_rss / 1e6:.0f}',
+      )
+    return table
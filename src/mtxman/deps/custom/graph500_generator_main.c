@@ -1,25 +1,76 @@
 // main.c
+//
+// Generates a Graph500 Kronecker graph as a Matrix Market (.mtx) or binary (.bmtx) file.
+//
+// Edges are generated in partitions of PARTITION_EDGES edges (in parallel with OpenMP): every edge
+// only depends on the seeds and on its index, so the output is the same for any number of threads,
+// and memory usage is bounded by the partitions in flight instead of the whole edge list.
+// BMTX partitions are written straight to their offset (pwrite), MTX partitions are formatted in
+// parallel and written in order.
+#define _FILE_OFFSET_BITS 64
+#include <fcntl.h>
+#include <inttypes.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <stdint.h>
+#include <string.h>
+#include <unistd.h>
 
 #include "make_graph.h"
 #include "graph_generator.h"
+#include "utils.h"          // make_mrg_seed
 #include "user_settings.h"  // Needed to override initiator parameters
 
+#define PARTITION_EDGES (1 << 18)
+// Longest MTX line: two 20-digit integers, a space and a newline
+#define MAX_LINE_BYTES 42
+
+static int write_all(int fd, const char* buf, size_t size, int64_t offset) {
+    while (size > 0) {
+        ssize_t written = offset >= 0 ? pwrite(fd, buf, size, (off_t)offset) : write(fd, buf, size);
+        if (written < 0) return -1;
+        buf += written;
+        size -= (size_t)written;
+        if (offset >= 0) offset += written;
+    }
+    return 0;
+}
+
+static char* format_uint(char* p, uint64_t v) {
+    char digits[20];
+    int n = 0;
+    do {
+        digits[n++] = (char)('0' + v % 10);
+        v /= 10;
+    } while (v);
+    while (n) *p++ = digits[--n];
+    return p;
+}
+
+static void store_index(char* section, int64_t i, uint64_t v, int index_bytes) {
+    // Little-endian, as in distributed_mmio
+    for (int b = 0; b < index_bytes; ++b) section[i * index_bytes + b] = (char)(v >> (8 * b));
+}
+
 int main(int argc, char** argv) {
     if (argc < 4) {
-        fprintf(stderr, "Usage: %s <scale> <edge_factor> <output_file.mtx>\n", argv[0]);
+        fprintf(stderr, "Usage: %s <scale> <edge_factor> <output_file> [seed1 seed2] [mtx|bmtx]\n", argv[0]);
         return EXIT_FAILURE;
     }
 
     int scale = atoi(argv[1]);
     int edge_factor = atoi(argv[2]);
     const char* output_file = argv[3];
-    int64_t desired_nedges = (int64_t)edge_factor << scale;
-    int64_t nedges;
-    packed_edge* edges;
     uint64_t seed1 = 12345, seed2 = 67890;
+    if (argc >= 6) {
+        seed1 = strtoull(argv[4], NULL, 10);
+        seed2 = strtoull(argv[5], NULL, 10);
+    }
+    int bmtx = argc >= 7 && strcmp(argv[6], "bmtx") == 0;
+
+    int64_t nedges = (int64_t)edge_factor << scale;
+    uint64_t num_vertices = (uint64_t)1 << scale;
+    int64_t npartitions = (nedges + PARTITION_EDGES - 1) / PARTITION_EDGES;
 
     /*/ Set custom initiator probabilities (Graph500 standard)
     initiator[0] = 0.57;
@@ -27,38 +78,103 @@ int main(int argc, char** argv) {
     initiator[2] = 0.19;
     initiator[3] = 0.05;*/
 
-    // Generate the graph
-    make_graph(scale, desired_nedges, seed1, seed2, &nedges, &edges);
+    // Spread the two seeds into the five values of the generator state (as make_graph does)
+    uint_fast32_t seed[5];
+    make_mrg_seed(seed1, seed2, seed);
 
-    // Determine the number of vertices
-    int64_t max_vertex = 0;
-    for (int64_t i = 0; i < nedges; ++i) {
-        int64_t src = get_v0_from_edge(&edges[i]);
-        int64_t dst = get_v1_from_edge(&edges[i]);
-        if (src > max_vertex) max_vertex = src;
-        if (dst > max_vertex) max_vertex = dst;
+    int fd = open(output_file, O_WRONLY | O_CREAT | O_TRUNC, 0644);
+    if (fd < 0) {
+        perror("open");
+        return EXIT_FAILURE;
     }
-    int64_t num_vertices = max_vertex + 1;
 
-    // Write Matrix Market format
-    FILE* f = fopen(output_file, "w");
-    if (!f) {
-        perror("fopen");
+    // Header (same layout as distributed_mmio)
+    char header[512];
+    int index_bytes = num_vertices <= ((uint64_t)1 << 32) ? 4 : 8;
+    int header_size;
+    if (bmtx) {
+        header_size = snprintf(header, sizeof(header),
+            "%%%%MatrixMarket matrix coordinate pattern general\n%" PRIu64 " %" PRIu64 " %" PRId64 " %d 0\n",
+            num_vertices, num_vertices, nedges, index_bytes);
+    } else {
+        header_size = snprintf(header, sizeof(header),
+            "%%%%MatrixMarket matrix coordinate pattern general\n"
+            "%% File generated with MtxMan.\n"
+            "%% Scale: %d\n"
+            "%% Edge factor: %d\n"
+            "%% Seeds: %" PRIu64 " %" PRIu64 "\n"
+            "%" PRIu64 " %" PRIu64 " %" PRId64 "\n",
+            scale, edge_factor, seed1, seed2, num_vertices, num_vertices, nedges);
+    }
+    int failed = write_all(fd, header, (size_t)header_size, -1) != 0;
+    if (!failed && bmtx && ftruncate(fd, (off_t)(header_size + 2 * nedges * index_bytes)) != 0) failed = 1;
+
+    #pragma omp parallel
+    {
+        packed_edge* edges = (packed_edge*)malloc(PARTITION_EDGES * sizeof(packed_edge));
+        char* buffer = (char*)malloc(bmtx ? 2 * (size_t)PARTITION_EDGES * index_bytes : (size_t)PARTITION_EDGES * MAX_LINE_BYTES);
+        if (!edges || !buffer) {
+            #pragma omp atomic write
+            failed = 1;
+        }
+
+        #pragma omp for ordered schedule(static, 1)
+        for (int64_t p = 0; p < npartitions; ++p) {
+            int64_t start = p * PARTITION_EDGES;
+            int64_t end = start + PARTITION_EDGES < nedges ? start + PARTITION_EDGES : nedges;
+            int64_t n = end - start;
+            int partition_failed = 0;
+            size_t text_size = 0;
+            int stop;
+            #pragma omp atomic read
+            stop = failed;
+
+            if (edges && buffer && !stop) {
+                generate_kronecker_range(seed, scale, start, end, edges);
+                if (bmtx) {
+                    // Rows then cols (0-based), each at its own offset in the file
+                    char* rows = buffer;
+                    char* cols = buffer + n * index_bytes;
+                    for (int64_t i = 0; i < n; ++i) {
+                        store_index(rows, i, (uint64_t)get_v0_from_edge(&edges[i]), index_bytes);
+                        store_index(cols, i, (uint64_t)get_v1_from_edge(&edges[i]), index_bytes);
+                    }
+                    partition_failed =
+                        write_all(fd, rows, n * index_bytes, header_size + start * index_bytes) != 0 ||
+                        write_all(fd, cols, n * index_bytes, header_size + (nedges + start) * index_bytes) != 0;
+                } else {
+                    char* q = buffer;
+                    for (int64_t i = 0; i < n; ++i) {
+                        q = format_uint(q, (uint64_t)get_v0_from_edge(&edges[i]) + 1);  // 1-based indexing
+                        *q++ = ' ';
+                        q = format_uint(q, (uint64_t)get_v1_from_edge(&edges[i]) + 1);
+                        *q++ = '\n';
+                    }
+                    text_size = (size_t)(q - buffer);
+                }
+            }
+
+            // MTX partitions are appended in order
+            #pragma omp ordered
+            {
+                #pragma omp atomic read
+                stop = failed;
+                if (!bmtx && !partition_failed && edges && buffer && !stop)
+                    partition_failed = write_all(fd, buffer, text_size, -1) != 0;
+            }
+            if (partition_failed) {
+                #pragma omp atomic write
+                failed = 1;
+            }
+        }
         free(edges);
-        return EXIT_FAILURE;
+        free(buffer);
     }
 
-    fprintf(f, "%%%%MatrixMarket matrix coordinate pattern general\n");
-    fprintf(f, "%% File generated with MtxMan.\n");
-    fprintf(f, "%% Scale: %d\n", scale);
-    fprintf(f, "%% Edge factor: %d\n", edge_factor);
-    fprintf(f, "%ld %ld %ld\n", num_vertices, num_vertices, nedges);
-    for (int64_t i = 0; i < nedges; ++i) {
-        int64_t src = get_v0_from_edge(&edges[i]) + 1;  // 1-based indexing
-        int64_t dst = get_v1_from_edge(&edges[i]) + 1;
-        fprintf(f, "%ld %ld\n", src, dst);
+    // A failed write (e.g., a full disk) must not look like a complete matrix
+    if (close(fd) != 0 || failed) {
+        fprintf(stderr, "Failed to write '%s'\n", output_file);
+        return EXIT_FAILURE;
     }
-    fclose(f);
-    free(edges);
     return EXIT_SUCCESS;
 }
@@ -1,32 +1,110 @@
-import os
-from pathlib import Path
-from typing import Optional
+import tarfile
+import zipfile
+from functools import partial
+from pathlib import Path, PurePosixPath
+from typing import List, Optional
 from rich.console import Console
-from mtxman.core.core import ConfigCategory, DatasetManager, Flags
-import shutil
+from mtxman.core.archive import MemberSelector, extract_tar_stream, extract_zip, member_relative_path
+from mtxman.core.core import ConfigCategory, DatasetManager, Flags, postprocessed_identity
+from mtxman.core.http import get_downloader
+from mtxman.core.scheduler import JobKind, MatrixTask
+from mtxman.core.scratch import ScratchDownload
+from mtxman.exceptions import DownloadError
 import urllib.parse
 
 console = Console()    
 
-def download_url_list(
+def _member_selector(filename: str, mtx_path: Path, flags: Flags) -> MemberSelector:
+  def select(member_name: str) -> Optional[Path]:
+    if PurePosixPath(member_name).name == filename:
+      return mtx_path
+    if flags.keep_all_files:
+      # The content of the archive top folder goes next to the matrix
+      relative_path = member_relative_path(member_name, strip_components=1)
+      return mtx_path.parent / relative_path if relative_path else None
+    return None
+  return select
+
+
+def _check_extracted(written: List[Path], filename: str, rename: Optional[str], mtx_path: Path) -> bool:
+  if mtx_path not in written:
+    console.print(f"[yellow]Warning: Downloaded file '{filename}' not found in the archive.[/yellow]")
+    return False
+  if rename:
+    console.print(f"[green]Renamed '{filename}' to '{rename}'.[/green]")
+  return True
+
+
+def _download_tar(url: str, filename: str, rename: Optional[str], mtx_path: Path, flags: Flags) -> bool:
+  """Streams a tar archive, writing only the matrix file (and, if requested, the other members)."""
+  mtx_path.parent.mkdir(parents=True, exist_ok=True)
+  try:
+    written = get_downloader().stream(url, partial(extract_tar_stream, select=_member_selector(filename, mtx_path, flags)), name=mtx_path.stem)
+  except (DownloadError, tarfile.TarError) as e:
+    console.print(f"[red]Failed to download {url}: {e}[/red]")
+    return False
+  return _check_extracted(written, filename, rename, mtx_path)
+
+
+def _download_file(url: str, mtx_path: Path, flags: Flags) -> bool:
+  mtx_path.parent.mkdir(parents=True, exist_ok=True)
+  try:
+    get_downloader().download(url, mtx_path, connections=flags.download_connections, name=mtx_path.stem)
+  except DownloadError as e:
+    console.print(f"[red]{e}[/red]")
+    return False
+  return True
+
+
+def _download_zip(url: str, flags: Flags, download: ScratchDownload) -> bool:
+  # ZIP archives need random access: they go through the scratch folder
+  parsed_url = urllib.parse.urlparse(url)
+  try:
+    download_filepath = download.start(url, Path(parsed_url.path).parts[-1])
+    get_downloader().download(url, download_filepath, connections=flags.download_connections, name=download.name)
+  except DownloadError as e:
+    console.print(f"[red]{e}[/red]")
+    download.cleanup(keep_files=True)
+    return False
+  except BaseException:
+    # Any other error (e.g., no space left for the '.part' file) must release the reservation too
+    download.cleanup(keep_files=True)
+    raise
+  return True
+
+
+def _extract_zip(filename: str, rename: Optional[str], mtx_path: Path, flags: Flags, download: ScratchDownload) -> bool:
+  try:
+    written = extract_zip(download.file, _member_selector(filename, mtx_path, flags))
+  except zipfile.BadZipFile as e:
+    console.print(f"[red]Failed to extract '{download.file.name}': {e}[/red]")
+    return False
+  finally:
+    download.cleanup()
+  return _check_extracted(written, filename, rename, mtx_path)
+
+
+def plan(
   config: ConfigCategory,
   flags: Flags,
   dataset_manager: DatasetManager,
-):
+) -> List[MatrixTask]:
   """
-  Download a list of matrices from the provided URLs.
+  Plan the download of a list of matrices from the provided URLs.
   """
   urls = config.direct_urls
   if not urls:
-    return
-  
+    return []
+
   allowed_extensions = ('.mtx', '.bmtx', '.zip', '.tar', '.tar.gz', '.tgz')
 
+  tasks = []
   for url_dict in urls:
     url = url_dict['url']
     filename = url_dict['filename']
     rename = url_dict.get('rename')
-    
+    postprocess = url_dict.get('postprocess', [])
+
     parsed_url = urllib.parse.urlparse(url)
     if not (parsed_url.scheme and parsed_url.netloc):
         console.print(f"[red]Invalid URL:[/red] {url}")
@@ -36,64 +114,30 @@ def download_url_list(
         continue
 
     mtx_path = dataset_manager.get_direct_url_matrix_path(filename, rename)
-    download, convert = dataset_manager.check_matrix_status(mtx_path, flags, True, mtx_path.stem)
+    identity = postprocessed_identity(f'url:{url}#{filename}', postprocess)
+    download, convert = dataset_manager.check_matrix_status(mtx_path, flags, True, mtx_path.stem, identity)
+    task = MatrixTask(mtx_path.stem, mtx_path, dataset_manager, flags.binary_mtx)
 
     if download:
-      scratch_path = Path(config.scratch_path)
-      download_filename = Path(Path(parsed_url.path).parts[-1])
-      download_filepath = scratch_path / download_filename
-
-      os.system(f"wget -O '{download_filepath}' '{url}'")
-      # Uncompress if needed
-      if download_filename.suffix in ['.zip', '.gz', '.tgz', '.tar']:
-        if download_filename.name.endswith('.zip'):
-          os.system(f"unzip -o '{download_filepath}' -d '{scratch_path}'")
-        elif download_filename.name.endswith('.tar.gz') or download_filename.name.endswith('.tgz'):
-          os.system(f"tar -xzf '{download_filepath}' -C '{scratch_path}'")
-        elif download_filename.name.endswith('.tar'):
-          os.system(f"tar -xf '{download_filepath}' -C '{scratch_path}'")
-          
-        if download_filepath.exists():
-          download_filepath.unlink()
-          
-        # Remove all suffixes from download_filename
-        base_name = download_filename.name.split('.')[0]
-        downloaded_file = scratch_path / base_name / filename
+      if parsed_url.path.endswith('.zip'):
+        scratch_download = ScratchDownload(config.scratch_path, flags.scratch_min_free, mtx_path.stem)
+        task.add_step(JobKind.NET, partial(_download_zip, url, flags, scratch_download))
+        task.add_step(JobKind.EXTRACT, partial(_extract_zip, filename, rename, mtx_path, flags, scratch_download))
+        # If the task stops before the extraction, the download is kept for the next run
+        task.add_failure_hook(partial(scratch_download.cleanup, keep_files=True))
+      elif parsed_url.path.endswith(('.tar', '.tar.gz', '.tgz')):
+        task.add_step(JobKind.NET, partial(_download_tar, url, filename, rename, mtx_path, flags))
       else:
-        downloaded_file = scratch_path / filename
-        
-      if (not downloaded_file.with_suffix('.mtx').exists()) and (not downloaded_file.with_suffix('.bmtx').exists()):
-        console.print(f"[yellow]Warning: Downloaded file '{filename}.{{mtx|bmtx}}' not found in '{downloaded_file.parent}'.[/yellow]")
-        continue
-      else:
-        if rename:
-          new_path = downloaded_file.parent / rename
-          downloaded_file.rename(new_path)
-          console.print(f"[green]Renamed '{filename}' to '{rename}'.[/green]")
-
-      if not flags.keep_all_files:
-        for file in downloaded_file.parent.glob("*.{mtx,bmtx}"):
-          if file.name != f"{downloaded_file.name}.mtx" and file.name != f"{downloaded_file.name}.bmtx":
-            file.unlink()
-    
-      # Move the downloaded file (or its folder) to match mtx_path
-      target_path = mtx_path.parent
-      target_path.mkdir(parents=True, exist_ok=True)
-      
-      if downloaded_file.parent.name == scratch_path.name:
-        downloaded_file.replace(mtx_path)
-      else:
-        # Move all contents from the downloaded folder to target_path
-        for item in downloaded_file.parent.iterdir():
-          dest = target_path / item.name
-          if item.is_file():
-            item.replace(dest)
-          elif item.is_dir():
-            shutil.move(str(item), str(dest))
-        # Remove the now-empty downloaded folder
-        downloaded_file.parent.rmdir()
+        task.add_step(JobKind.NET, partial(_download_file, url, mtx_path, flags))
+      task.add_postprocess_step(postprocess, flags, mtx_path.suffix == '.bmtx')
 
     if convert and flags.binary_mtx:
-      dataset_manager.convert_to_bmtx(mtx_path, flags, mtx_path.stem)
-      
-    dataset_manager.register_matrix_path(mtx_path, flags.binary_mtx)
\ No newline at end of file
+      task.add_convert_step(flags)
+
+    task.add_compress_step(flags)
+    task.add_csr_step(flags)
+    task.add_shard_step(flags)
+    task.add_record_step(identity, flags)
+    tasks.append(task)
+
+  return tasks
@@ -1,11 +1,16 @@
-import os
-from pathlib import Path
+import tarfile
+from functools import partial
+from pathlib import Path, PurePosixPath
+from typing import Iterator, List, Optional
 
-import ssgetpy
 from rich.console import Console
 
-from mtxman.core.core import ConfigCategory, DatasetManager, Flags
-from mtxman.core.dependencies import MTX_TO_BMTX_CONVERTER
+from mtxman.core.archive import extract_tar_stream, member_relative_path
+from mtxman.core.core import ConfigCategory, DatasetManager, Flags, PostProcess, postprocessed_identity
+from mtxman.core.http import get_downloader
+from mtxman.core.scheduler import JobKind, MatrixTask
+from mtxman.core.suite_sparse_index import SuiteSparseMatrix, get_index
+from mtxman.exceptions import DownloadError
 
 console = Console()
 
@@ -15,6 +20,7 @@ class SuiteSparseMatrixHandler:
     base_path: Path,
     dataset_manager: DatasetManager,
     flags: Flags,
+    postprocess: Optional[List[PostProcess]] = None,
   ):
     """
     Handles downloading and converting SuiteSparse matrices.
@@ -23,8 +29,10 @@ class SuiteSparseMatrixHandler:
         
         dataset_manager (DatasetManager): Manages dataset file paths.
         category (str): Dataset category for configuration and path structure.
+        postprocess: operations applied to the downloaded matrices.
     """
     self.flags = flags
+    self.postprocess = postprocess or []
     self.dm = dataset_manager
     self.base_path = base_path
 
@@ -39,101 +47,133 @@ class SuiteSparseMatrixHandler:
 
       return full_name, group_dir, matrix_dir, mtx_path
 
-  def sync_matrix(self, matrix):
+  def _remove_extra_files(self, matrix, matrix_dir: Path):
+    if not self.flags.keep_all_files:
+      for file in matrix_dir.glob("*.mtx"):
+        if file.name != f"{matrix.name}.mtx":
+          file.unlink()
+
+  def _download(self, matrix, full_name: str, matrix_dir: Path, mtx_path: Path) -> bool:
+    """Streams the SuiteSparse archive, writing only the matrix file (and, if requested, the other members)."""
+    matrix_url = matrix.url('MM')
+
+    def select(member_name: str) -> Optional[Path]:
+      if PurePosixPath(member_name).name == f"{matrix.name}.mtx":
+        return mtx_path
+      if self.flags.keep_all_files:
+        # Archives contain a single "<matrix name>/" folder
+        relative_path = member_relative_path(member_name, strip_components=1)
+        return matrix_dir / relative_path if relative_path else None
+      return None
+
+    try:
+      written = get_downloader().stream(matrix_url, partial(extract_tar_stream, select=select), name=full_name)
+    except (DownloadError, tarfile.TarError) as e:
+      console.print(f"[red]Failed to download '{full_name}': {e}[/red]")
+      return False
+
+    if mtx_path not in written:
+      console.print(f"[red]'{matrix.name}.mtx' not found in the archive of '{full_name}'[/red]")
+      return False
+    return True
+
+  def plan_matrix(self, matrix: SuiteSparseMatrix) -> MatrixTask:
     """
-    Download and convert a SuiteSparse matrix if necessary.
+    Plan the download and conversion of a SuiteSparse matrix, if necessary.
 
     Args:
-      matrix: A SuiteSparse matrix object returned from ssgetpy.
+      matrix: An entry of the local SuiteSparse index.
 
     Returns:
-      bool: True if the matrix was downloaded or converted, False otherwise.
+      MatrixTask: the steps required to bring the matrix up to date (may be empty).
     """
     full_name, group_dir, matrix_dir, mtx_path = self._get_matrix_paths(matrix)
 
-    download, convert = self.dm.check_matrix_status(mtx_path, self.flags, True, full_name)
+    identity = postprocessed_identity(f'suitesparse:{full_name}', self.postprocess)
+    download, convert = self.dm.check_matrix_status(mtx_path, self.flags, True, full_name, identity)
+    task = MatrixTask(full_name, mtx_path, self.dm, self.flags.binary_mtx)
 
     if download:
-      matrix_url = matrix.url('MM')
-      tar_file_path = group_dir / f"{matrix.name}.tar.gz"
-
-      os.system(f"wget -O {tar_file_path} {matrix_url}")
-      os.system(f"tar -xzf {tar_file_path} -C {group_dir}")
-
-      extracted_mtx = group_dir / f"{matrix.name}.mtx"
-      if extracted_mtx.exists():
-        extracted_mtx.rename(mtx_path)
-
-      tar_file_path.unlink()
-
-    if not self.flags.keep_all_files:
-      for file in matrix_dir.glob("*.mtx"):
-        if file.name != f"{matrix.name}.mtx":
-          file.unlink()
+      task.add_step(JobKind.NET, partial(self._download, matrix, full_name, matrix_dir, mtx_path))
+      task.add_postprocess_step(self.postprocess, self.flags)
+    else:
+      self._remove_extra_files(matrix, matrix_dir)
 
     if convert and self.flags.binary_mtx:
-      self.dm.convert_to_bmtx(mtx_path, self.flags, full_name)
-      
-    self.dm.register_matrix_path(mtx_path, self.flags.binary_mtx)
+      task.add_convert_step(self.flags)
 
-def download_list(
+    task.add_compress_step(self.flags)
+    task.add_csr_step(self.flags)
+    task.add_shard_step(self.flags)
+    task.add_record_step(identity, self.flags)
+    return task
+
+def plan_list(
   config: ConfigCategory,
   flags: Flags,
   dataset_manager: DatasetManager,
-):
+) -> List[MatrixTask]:
   """
-  Download a configured list of SuiteSparse matrices.
+  Plan the download of a configured list of SuiteSparse matrices.
 
   Returns:
-      dict: Mapping of matrix full names to file paths.
+      List[MatrixTask]: one task per matrix found in SuiteSparse.
   """
   matrix_list = config.suite_sparse_matrix_list
+  if not matrix_list:
+    return []
 
+  index = get_index()
   handler = SuiteSparseMatrixHandler(
     base_path=dataset_manager.get_suite_sparse_list_path(),
     dataset_manager=dataset_manager,
     flags=flags,
+    postprocess=config.postprocess,
   )
 
+  tasks = []
   for group, name in matrix_list:
     full_name = f'{group}/{name}'
     console.print(f"[cyan]🔎 Checking matrix: \"{full_name}\"[/cyan]")
-    matrices = ssgetpy.search(name=name, limit=1)
+    matrix = index.lookup(group, name)
 
-    if not matrices:
-      console.print(f"[red]{full_name} not found in SuiteSparse, skipped[/red]")
+    if matrix is None:
+      others = [m.full_name for m in index.find_by_name(name)]
+      hint = f" (available as: {', '.join(others)})" if others else ""
+      console.print(f"[red]{full_name} not found in SuiteSparse{hint}, skipped[/red]")
       continue
 
-    matrix = matrices[0]
-    if matrix.name == name:
-      handler.sync_matrix(matrix)
-    else:
-      console.print(f"[red]{name} matched but was not an exact match, skipped[/red]")
+    tasks.append(handler.plan_matrix(matrix))
 
+  return tasks
 
-def download_range(
+
+def plan_range(
   config: ConfigCategory,
   flags: Flags,
   dataset_manager: DatasetManager,
-):
+) -> Iterator[MatrixTask]:
   """
-  Download a range of SuiteSparse matrices based on NNZ constraints.
+  Plan the download of a range of SuiteSparse matrices selected by their metadata (see `RangeQuery`).
+
+  The selection runs on the local index and is consumed lazily: the scheduler plans and starts
+  each matching matrix as soon as the index yields it.
 
   Returns:
-      dict: Mapping of matrix full names to file paths.
+      Iterator[MatrixTask]: one task per matching matrix.
   """
   if not config.suite_sparse_matrix_range:
-    return
+    return iter([])
   
   range = config.suite_sparse_matrix_range
 
-  matrices = ssgetpy.fetch(nzbounds=(range.min_nnzs, range.max_nnzs), limit=range.limit, dry_run=True)
+  matrices = get_index().select(range.query())
   handler = SuiteSparseMatrixHandler(
-    base_path=dataset_manager.get_suite_sparse_range_path(range.min_nnzs, range.max_nnzs, range.limit),
+    base_path=dataset_manager.get_suite_sparse_range_path(range.min_nnzs, range.max_nnzs, range.limit, range.selector_id()),
     dataset_manager=dataset_manager,
     flags=flags,
+    postprocess=config.postprocess,
   )
 
-  for matrix in matrices:
-    handler.sync_matrix(matrix)
+  return (handler.plan_matrix(matrix) for matrix in matrices)
 
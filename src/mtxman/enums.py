@@ -0,0 +1,26 @@
+"""
+Choices of the command line options, in a module without heavy imports: the CLI imports it to
+declare its options, and imports the modules using them only when a command runs.
+"""
+from enum import Enum
+
+
+class DEPS(Enum):
+  DISTRIBUTED_MMIO = 'distributed_mmio'
+  GRAPH500 = 'graph500'
+  PARMAT = 'parmat'
+
+
+class BmtxConverter(str, Enum):
+  NATIVE = 'native'  # Built-in NumPy converter (mtxman.io.bmtx)
+  DMMIO = 'dmmio'    # distributed_mmio's mtx_to_bmtx tool
+
+
+class Codec(str, Enum):
+  ZSTD = 'zstd'
+  LZ4 = 'lz4'
+
+
+class Partition(str, Enum):
+  ROWS = 'rows'
+  NNZ_BALANCED = 'nnz-balanced'
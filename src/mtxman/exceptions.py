@@ -18,4 +18,22 @@ class DependencyError(MtxManError):
   """Raised when a dependency fails to download or build."""
   def __init__(self, message):
     self.message = message
-    super().__init__(self.message)
\ No newline at end of file
+    super().__init__(self.message)
+
+class DownloadError(MtxManError):
+  """Raised when a file cannot be downloaded."""
+  def __init__(self, message):
+    self.message = message
+    super().__init__(self.message)
+
+class MatrixFormatError(MtxManError):
+  """Raised when a matrix file cannot be parsed."""
+  def __init__(self, message):
+    self.message = message
+    super().__init__(self.message)
+
+class SuiteSparseIndexError(MtxManError):
+  """Raised when the local SuiteSparse index is unavailable and cannot be built."""
+  def __init__(self, message):
+    self.message = message
+    super().__init__(self.message)
@@ -1,11 +1,24 @@
+import os
 import subprocess
+from functools import partial
+from pathlib import Path
+from typing import List, Optional
 from rich.console import Console
 
 from mtxman.core import dependencies
-from mtxman.core.core import ConfigCategory, DatasetManager, Flags
+from mtxman.core.core import ConfigCategory, DatasetManager, Flags, GeneratorEngine, Graph500Matrix, postprocessed_identity
+from mtxman.core.store import resolve_matrix_path
+from mtxman.core.scheduler import JobKind, MatrixTask
+from mtxman.core.trace import add_io, file_size
+from mtxman.generators import native
+from mtxman.io.atomic import commit, tmp_path_for
 
 console = Console()
 
+# Version of the generated files, part of their identity: files of an older version are generated
+# again (version 1 headers held max_vertex+1, not 2^scale, as the matrix size)
+FORMAT_VERSION = 2
+
 # def set_env(file_name):
 #   os.environ["REUSEFILE"] = "1"
 #   os.environ["TMPFILE"] = file_name
@@ -18,38 +31,97 @@ console = Console()
 #   del os.environ["SKIP_BFS"]
 
 
-def generate(
+def _generate_matrix(matrix: Graph500Matrix, mtx_path: Path, bmtx: bool, threads: Optional[int]) -> bool:
+  """
+  Runs the generator (OpenMP-parallel, `threads` threads). With `bmtx`, the matrix is written
+  straight to the `.bmtx` file, without the `.mtx` intermediate.
+  """
+  # set_env(file_name)  # This is probably not needed anymore
+  # The generator writes to a temporary file, which becomes the matrix only once complete
+  output_path = resolve_matrix_path(mtx_path).with_suffix('.bmtx' if bmtx else '.mtx')
+  tmp_path = tmp_path_for(output_path)
+  env = {**os.environ, 'OMP_NUM_THREADS': str(threads)} if threads else None
+  dependencies.require(dependencies.DEPS.GRAPH500)
+  try:
+    console.print(f"==> ⚙️ Generating Graph500 graph with (scale, edge factor) = ({matrix.scale}, {matrix.edge_factor})")
+    subprocess.run(
+      [f'./{dependencies.GRAPH500_GENERATOR.stem}', str(matrix.scale), str(matrix.edge_factor), str(tmp_path),
+       str(matrix.seed1), str(matrix.seed2), 'bmtx' if bmtx else 'mtx'],
+      cwd=dependencies.GRAPH500_GENERATOR.parent, env=env, check=True,
+    )
+    commit(tmp_path, output_path)
+    add_io(bytes_out=file_size(output_path))
+  except subprocess.CalledProcessError as e:
+    console.print(f"[red]Graph generation failed:[/red] {e}")
+    # unset_env()
+    return False
+  finally:
+    tmp_path.unlink(missing_ok=True)
+  # unset_env()
+  console.print('==> Generated!')
+  return True
+
+
+def _generate_native(matrix: Graph500Matrix, mtx_path: Path, bmtx: bool, workers: Optional[int]) -> bool:
+  """Runs the built-in generator (`workers` processes), straight to the `.bmtx` file with `bmtx`."""
+  output_path = resolve_matrix_path(mtx_path).with_suffix('.bmtx' if bmtx else '.mtx')
+  console.print(f"==> ⚙️ Generating Graph500 graph with (scale, edge factor) = ({matrix.scale}, {matrix.edge_factor}) (native engine)")
+  try:
+    native.generate_kronecker(matrix, output_path, workers)
+  except OSError as e:
+    console.print(f"[red]Graph generation failed:[/red] {e}")
+    return False
+  add_io(bytes_out=file_size(output_path))
+  console.print('==> Generated!')
+  return True
+
+
+def plan(
   config: ConfigCategory,
   flags: Flags,
   dataset_manager: DatasetManager,
-):
+) -> List[MatrixTask]:
   if not config.generators or not config.generators.graph500:
-    return
-  
+    return []
+
   matrices = config.generators.graph500.get_matrices()
-  
-  if len(matrices) > 0:
-    dependencies.download_and_build_graph500_generator()
+  engine = config.generators.graph500.engine
+  postprocess = config.generators.graph500.postprocess
+  use_native = engine == GeneratorEngine.NATIVE
 
+  if len(matrices) > 0 and not use_native:
+    # Built in the background: generator steps wait for it
+    dependencies.prepare(dependencies.DEPS.GRAPH500)
+
+  tasks = []
   for matrix in matrices:
-    mtx_path = dataset_manager.get_graph500_path(matrix)
+    mtx_path = dataset_manager.get_graph500_path(matrix, engine)
+
+    identity = f'graph500:scale={matrix.scale},edge_factor={matrix.edge_factor}'
+    if not matrix.default_seeds:
+      identity += f',seed1={matrix.seed1},seed2={matrix.seed2}'
+    if use_native:
+      identity += ',engine=native'
+    identity += f',v={FORMAT_VERSION}'
+    identity = postprocessed_identity(identity, postprocess)
+    generate, convert = dataset_manager.check_matrix_status(mtx_path, flags, False, mtx_path.stem, identity)
+    task = MatrixTask(mtx_path.stem, mtx_path, dataset_manager, flags.binary_mtx)
 
-    generate, convert = dataset_manager.check_matrix_status(mtx_path, flags, False, mtx_path.stem)
-    
+    # Unless the .mtx file is kept, binary matrices are generated straight to BMTX (Graph500
+    # matrices are pattern matrices, so the BMTX value size does not matter)
+    direct_bmtx = flags.binary_mtx and not flags.keep_mtx
     if generate:
-      # set_env(file_name)  # This is probably not needed anymore
-      try:
-        console.print(f"==> ⚙️ Generating Graph500 graph with (scale, edge factor) = ({matrix.scale}, {matrix.edge_factor})")
-        subprocess.run([f'./{dependencies.GRAPH500_GENERATOR.stem}', str(matrix.scale), str(matrix.edge_factor), str(mtx_path.resolve().absolute())], cwd=dependencies.GRAPH500_GENERATOR.parent, check=True)
-      except subprocess.CalledProcessError as e:
-        console.print(f"[red]Graph generation failed:[/red] {e}")
-        # unset_env()
-        continue
-      # unset_env()
-      console.print('==> Generated!')
-
-    if convert and flags.binary_mtx:
-      dataset_manager.convert_to_bmtx(mtx_path, flags, mtx_path.stem)
-
-    dataset_manager.register_matrix_path(mtx_path, flags.binary_mtx)
-      
\ No newline at end of file
+      generate_matrix = _generate_native if use_native else _generate_matrix
+      task.add_step(JobKind.CPU, partial(generate_matrix, matrix, mtx_path, direct_bmtx, flags.generator_threads))
+      task.add_postprocess_step(postprocess, flags, direct_bmtx)
+
+    if convert and flags.binary_mtx and not (generate and direct_bmtx):
+      task.add_convert_step(flags)
+
+    task.add_compress_step(flags)
+    task.add_csr_step(flags)
+    task.add_shard_step(flags)
+    task.add_record_step(identity, flags)
+    tasks.append(task)
+
+  return tasks
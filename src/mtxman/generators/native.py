@@ -0,0 +1,323 @@
+"""
+Built-in RMAT / Kronecker generator (`engine: native`), which needs no external dependency.
+
+Edges are sampled with vectorised NumPy code: at each of the log2(N) levels of the recursion,
+one uniform draw per edge picks a quadrant (a, b, c or d), that is one bit of the row and one
+bit of the column. Graphs are generated in chunks of at most CHUNK_EDGES edges by worker
+processes, and streamed in order to a `.mtx` or `.bmtx` file, so memory usage does not depend
+on the graph size. Every chunk has its own random stream (derived from the seed and the chunk
+index): the output does not depend on the number of workers.
+
+RMAT (PaRMAT options): chunks are stripes of consecutive rows, planned by splitting the number of
+edges (binomially) on the row bits until every stripe holds at most CHUNK_EDGES edges. Edges of
+different stripes cannot collide, so the options are applied stripe by stripe:
+  - noEdgeToSelf: self loops are resampled
+  - noDuplicateEdges: duplicated edges are resampled (edges beyond the capacity of a stripe are moved
+    to the other stripes, and M is capped to the number of possible edges). A stripe whose missing
+    edges are too unlikely to be drawn (MAX_STALLED_BATCHES batches without a new one) is written
+    with fewer edges
+  - undirected: edges are sampled in the lower triangle, and the matrix is stored as `symmetric`
+  - sorted: entries are sorted by row, then by column
+Rows and columns beyond N (when N is not a power of two) are resampled as well.
+
+Graph500: Kronecker graphs with the Graph500 initiator, 2^scale vertices and edge_factor * 2^scale
+edges (self loops and duplicates included), whose vertex labels are scrambled by a seeded bijection.
+The distribution is the one of the reference generator, but not the same graphs.
+"""
+import os
+from collections import deque
+from dataclasses import replace
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+from mtxman.core.core import Graph500Matrix, PaRMATMatrix
+from mtxman.io import bmtx, mtx
+from mtxman.io.atomic import commit, tmp_path_for
+
+# Edges generated by a single job (bounds the memory of each worker)
+CHUNK_EDGES = 1 << 20
+# Largest batch sampled at once when many edges are rejected
+MAX_BATCH = 4 * CHUNK_EDGES
+# A stripe stops after this many batches in a row without a new edge (its remaining edges are too unlikely)
+MAX_STALLED_BATCHES = 8
+GRAPH500_INITIATOR = (0.57, 0.19, 0.19)  # d = 0.05
+# Random streams that are not chunk streams
+_PLAN_STREAM = 1 << 40
+_SCRAMBLE_STREAM = (1 << 40) + 1
+
+# A job returns the (0-based) rows and cols of a chunk of entries
+Job = Tuple[Callable[..., Tuple[np.ndarray, np.ndarray]], tuple, int]  # (function, args, number of entries)
+
+
+def _levels(n: int) -> int:
+  return max(1, (n - 1).bit_length())
+
+
+def _sample_edges(
+  rng: np.random.Generator, count: int, levels: int, probs: Tuple[float, float, float], prefix: int = 0, prefix_levels: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  Samples `count` edges of a 2^levels x 2^levels RMAT matrix, whose first `prefix_levels` row bits are `prefix`
+  (the column bits of those levels are drawn from the quadrant probabilities given the row bit).
+  """
+  a, b, c = probs
+  ab = a + b
+  rows = np.full(count, prefix << (levels - prefix_levels), dtype=np.int64)
+  cols = np.zeros(count, dtype=np.int64)
+  for level in range(levels):
+    shift = levels - 1 - level
+    u = rng.random(count)
+    if level < prefix_levels:
+      if (prefix >> (prefix_levels - 1 - level)) & 1:
+        col_one = (1 - ab - c) / (1 - ab) if ab < 1 else 0.0
+      else:
+        col_one = b / ab if ab > 0 else 0.0
+      cols |= (u < col_one).astype(np.int64) << shift
+    else:
+      rows |= (u >= ab).astype(np.int64) << shift
+      cols |= (((u >= a) & (u < ab)) | (u >= ab + c)).astype(np.int64) << shift
+  return rows, cols
+
+
+def _first_unique(rows: np.ndarray, cols: np.ndarray, n: int) -> np.ndarray:
+  """Indices of the first occurrence of each distinct entry, in order."""
+  if n <= 2 ** 31:
+    _, first = np.unique(rows * n + cols, return_index=True)
+  else:
+    _, first = np.unique(np.stack((rows, cols), axis=1), axis=0, return_index=True)
+  first.sort()
+  return first
+
+
+# RMAT ------------------------------------------------------------------------------------------
+
+def _rmat_capacity(matrix: PaRMATMatrix, first_row: int, stop_row: int) -> int:
+  """Number of distinct valid entries in rows [first_row, stop_row)."""
+  n_rows = stop_row - first_row
+  if matrix.undirected:
+    capacity = (stop_row * (stop_row + 1) - first_row * (first_row + 1)) // 2
+  else:
+    capacity = n_rows * matrix.N
+  return capacity - (n_rows if matrix.noEdgeToSelf else 0)
+
+
+def _plan_rmat(matrix: PaRMATMatrix, seed: int) -> List[Tuple[int, int, int]]:
+  """Splits the M edges into row stripes. Returns: (prefix, prefix_levels, count) of each stripe, in row order."""
+  levels = _levels(matrix.N)
+  rng = np.random.default_rng([seed, _PLAN_STREAM])
+  stripes = []
+
+  def split(prefix: int, depth: int, count: int):
+    first_row = prefix << (levels - depth)
+    if count == 0 or first_row >= matrix.N:
+      return
+    if count <= CHUNK_EDGES or depth == levels:
+      stop_row = min(matrix.N, (prefix + 1) << (levels - depth))
+      capacity = _rmat_capacity(matrix, first_row, stop_row)
+      if capacity > 0:
+        stripes.append((prefix, depth, count, capacity))
+      return
+    # Edges are only resampled within their stripe: the upper half gets none if its rows are all beyond N
+    upper_first_row = (2 * prefix + 1) << (levels - depth - 1)
+    upper = int(rng.binomial(count, 1 - matrix.a - matrix.b)) if upper_first_row < matrix.N else 0
+    split(2 * prefix, depth + 1, count - upper)
+    split(2 * prefix + 1, depth + 1, upper)
+
+  split(0, 0, matrix.M)
+  if not stripes:
+    return []
+  prefixes, depths, counts, capacities = (np.array(values, dtype=np.int64) for values in zip(*stripes))
+  if matrix.noDuplicateEdges:
+    # Edges beyond the capacity of their stripe go to the other stripes (in proportion to their edges)
+    counts = np.minimum(counts, capacities)
+    excess = matrix.M - int(counts.sum())
+    while excess > 0 and np.any(counts < capacities):
+      weights = np.where(counts < capacities, counts + 1, 0).astype(np.float64)
+      extra = np.minimum(rng.multinomial(excess, weights / weights.sum()), capacities - counts)
+      counts += extra
+      excess -= int(extra.sum())
+  return [(int(p), int(d), int(c)) for p, d, c in zip(prefixes, depths, counts) if c > 0]
+
+
+def _rmat_stripe(matrix: PaRMATMatrix, seed: int, index: int, prefix: int, prefix_levels: int, count: int) -> Tuple[np.ndarray, np.ndarray]:
+  rng = np.random.default_rng([seed, index])
+  levels = _levels(matrix.N)
+  rows = cols = np.empty(0, dtype=np.int64)
+  acceptance = 1.0
+  stalled = 0
+  while len(rows) < count and stalled < MAX_STALLED_BATCHES:
+    batch = min(MAX_BATCH, int((count - len(rows)) / max(acceptance, 1e-3) * 1.05) + 64)
+    new_rows, new_cols = _sample_edges(rng, batch, levels, (matrix.a, matrix.b, matrix.c), prefix, prefix_levels)
+    keep = (new_rows < matrix.N) & (new_cols < matrix.N)
+    if matrix.undirected:
+      keep &= new_cols <= new_rows
+    if matrix.noEdgeToSelf:
+      keep &= new_rows != new_cols
+    previous = len(rows)
+    rows = np.concatenate((rows, new_rows[keep]))
+    cols = np.concatenate((cols, new_cols[keep]))
+    if matrix.noDuplicateEdges:
+      first = _first_unique(rows, cols, matrix.N)
+      rows, cols = rows[first], cols[first]
+    acceptance = max(len(rows) - previous, 1) / batch
+    stalled = stalled + 1 if len(rows) == previous else 0
+    rows, cols = rows[:count], cols[:count]
+
+  if matrix.sorted:
+    order = np.lexsort((cols, rows))
+    rows, cols = rows[order], cols[order]
+  return rows, cols
+
+
+def generate_rmat(matrix: PaRMATMatrix, output_path: Path, workers: Optional[int] = None, seed: int = 0) -> int:
+  """
+  Generates an RMAT matrix (PaRMAT parameters) to `output_path` (`.mtx` or `.bmtx`) with `workers` processes.
+
+  Returns:
+    int: number of entries written.
+  """
+  jobs = [
+    (_rmat_stripe, (matrix, seed, index, prefix, prefix_levels, count), count)
+    for index, (prefix, prefix_levels, count) in enumerate(_plan_rmat(matrix, seed))
+  ]
+  comments = [f'RMAT: N={matrix.N} M={matrix.M} a={matrix.a} b={matrix.b} c={matrix.c}', f'Seed: {seed}']
+  symmetry = 'symmetric' if matrix.undirected else 'general'
+  return _write_matrix(output_path, matrix.N, symmetry, jobs, workers, comments)
+
+
+# Graph500 --------------------------------------------------------------------------------------
+
+def _scramble(vertices: np.ndarray, bits: int, multipliers: Sequence[int]) -> np.ndarray:
+  """Applies a bijection of [0, 2^bits) (multiplications by odd numbers and xor-shifts) to `vertices`."""
+  mask = np.uint64((1 << bits) - 1)
+  shift = np.uint64((bits + 1) // 2)
+  v = vertices.astype(np.uint64)
+  for multiplier in multipliers:
+    v = (v * np.uint64(multiplier)) & mask
+    v ^= v >> shift
+  return v.astype(np.int64)
+
+
+def _kronecker_chunk(matrix: Graph500Matrix, index: int, count: int, multipliers: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+  rng = np.random.default_rng([matrix.seed1, matrix.seed2, index])
+  rows, cols = _sample_edges(rng, count, matrix.scale, GRAPH500_INITIATOR)
+  return _scramble(rows, matrix.scale, multipliers), _scramble(cols, matrix.scale, multipliers)
+
+
+def generate_kronecker(matrix: Graph500Matrix, output_path: Path, workers: Optional[int] = None) -> int:
+  """
+  Generates a Graph500 Kronecker graph to `output_path` (`.mtx` or `.bmtx`) with `workers` processes.
+
+  Returns:
+    int: number of entries written.
+  """
+  n_edges = matrix.edge_factor << matrix.scale
+  rng = np.random.default_rng([matrix.seed1, matrix.seed2, _SCRAMBLE_STREAM])
+  multipliers = tuple(int(m) | 1 for m in rng.integers(0, 2 ** 63, size=2))
+  jobs = [
+    (_kronecker_chunk, (matrix, index, min(CHUNK_EDGES, n_edges - start), multipliers), min(CHUNK_EDGES, n_edges - start))
+    for index, start in enumerate(range(0, n_edges, CHUNK_EDGES))
+  ]
+  comments = [f'Scale: {matrix.scale}', f'Edge factor: {matrix.edge_factor}', f'Seeds: {matrix.seed1} {matrix.seed2}']
+  return _write_matrix(output_path, 1 << matrix.scale, 'general', jobs, workers, comments)
+
+
+# Output ----------------------------------------------------------------------------------------
+
+def _run_job(function: Callable, args: tuple, targets: Optional[List[mtx.ArrayTarget]], offset: int) -> Tuple[Optional[bytes], int]:
+  """
+  Runs a job; returns its MTX lines, or writes its entries at `offset` of the BMTX `targets` (rows, cols).
+
+  Returns:
+    (lines, count): lines is None with `targets`, count is the number of entries of the job.
+  """
+  rows, cols = function(*args)
+  if targets is None:
+    return mtx.format_entries(rows, cols, None, b''), len(rows)
+  for target, values in zip(targets, (rows, cols)):
+    array, _ = target.attach()
+    array[offset:offset + len(values)] = values
+    array.flush()
+    del array
+  return None, len(rows)
+
+
+def _run_ordered(calls: List[tuple], workers: int) -> Iterator:
+  """Runs `calls` (arguments of _run_job) on the shared process pool, yielding the results in order."""
+  if workers <= 1 or len(calls) <= 1:
+    for call in calls:
+      yield _run_job(*call)
+    return
+
+  pool = mtx.get_process_pool(workers)
+  pending = deque()
+  try:
+    for call in calls:
+      pending.append(pool.submit(_run_job, *call))
+      # Bounds the finished results waiting to be written
+      if len(pending) >= 2 * workers:
+        yield pending.popleft().result()
+    while pending:
+      yield pending.popleft().result()
+  finally:
+    for future in pending:
+      future.cancel()
+
+
+def _write_matrix(output_path: Path, n: int, symmetry: str, jobs: List[Job], workers: Optional[int], comments: List[str]) -> int:
+  nnz = sum(count for _, _, count in jobs)
+  header = mtx.MtxHeader('coordinate', 'pattern', symmetry, n, n, nnz, 0)
+  workers = workers or mtx.default_workers()
+
+  tmp_path = tmp_path_for(output_path)
+  try:
+    if output_path.suffix == '.bmtx':
+      bmtx_header = bmtx.header_for(header)
+      targets = bmtx.allocate(tmp_path, bmtx_header)[:2]
+      offsets = np.cumsum([0] + [count for _, _, count in jobs]).tolist()
+      counts = [count for _, count in _run_ordered([(function, args, targets, offset) for (function, args, _), offset in zip(jobs, offsets)], workers)]
+      written = sum(counts)
+      if written < nnz:
+        _compact_bmtx(tmp_path, bmtx_header, offsets, counts)
+    else:
+      with open(tmp_path, 'wb') as f:
+        f.write(f'{header.banner}\n'.encode())
+        f.write(''.join(f'% {line}\n' for line in ['File generated with MtxMan (native engine).'] + comments).encode())
+        size_offset = f.tell()
+        size_line = f'{n} {n} {nnz}'
+        f.write(f'{size_line}\n'.encode())
+        written = 0
+        for lines, count in _run_ordered([(function, args, None, 0) for function, args, _ in jobs], workers):
+          f.write(lines)
+          written += count
+        if written < nnz:
+          # Fewer entries than planned: the size line is padded to keep its length
+          f.seek(size_offset)
+          f.write(f'{n} {n} {written}'.ljust(len(size_line)).encode())
+    commit(tmp_path, output_path)
+  finally:
+    tmp_path.unlink(missing_ok=True)
+  return written
+
+
+def _compact_bmtx(path: Path, header: bmtx.BmtxHeader, offsets: List[int], counts: List[int]):
+  """Rewrites `path` (a BMTX file whose job `i` wrote `counts[i]` entries at `offsets[i]`) with its entries packed."""
+  packed = replace(header, nnz=sum(counts))
+  packed_path = path.with_name(path.name + '.packed')
+  try:
+    targets = bmtx.allocate(packed_path, packed)[:2]
+    if packed.nnz > 0:
+      source = bmtx.read_bmtx(path)
+      for target, values in zip(targets, (source.rows, source.cols)):
+        array, _ = target.attach()
+        position = 0
+        for offset, count in zip(offsets, counts):
+          array[position:position + count] = values[offset:offset + count]
+          position += count
+        array.flush()
+        del array
+      del source
+    os.replace(packed_path, path)
+  finally:
+    packed_path.unlink(missing_ok=True)
@@ -1,58 +1,187 @@
 import os
-import re
 import subprocess
+from functools import partial
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
 from rich.console import Console
 
 from mtxman.core import dependencies
-from mtxman.core.core import ConfigCategory, DatasetManager, Flags
+from mtxman.core.core import ConfigCategory, DatasetManager, Flags, GeneratorEngine, PaRMATMatrix, postprocessed_identity
+from mtxman.core.store import resolve_matrix_path
+from mtxman.core.scheduler import JobKind, MatrixTask
+from mtxman.core.trace import add_io, file_size
+from mtxman.generators import native
+from mtxman.io.atomic import commit, tmp_path_for
+from mtxman.io.mtx import format_entries, parsed_all_lines
 
 console = Console()
 
-def generate(
+# Size of the blocks read from the PaRMAT output (bounds the converter memory usage)
+CHUNK_SIZE = 16 * 1024 * 1024
+MTX_HEADER = '%%MatrixMarket matrix coordinate pattern general\n'
+
+
+def _shift_chunk(chunk: bytes) -> Tuple[bytes, int]:
+  """
+  Converts a block of complete PaRMAT lines ("<src>\\t<dst>") into 1-based MTX entries.
+  The block is parsed in a single `np.fromstring` call; `format_entries` then formats all its entries
+  with one `%` operation.
+
+  Returns:
+    (mtx_lines, n_edges)
+
+  Raises:
+    ValueError: if the block is not a list of vertex index pairs.
+  """
+  if not chunk.strip():
+    return b'', 0
+  try:
+    values = np.fromstring(chunk, dtype=np.int64, sep=' ')
+  except ValueError as e:
+    raise ValueError(f'Malformed PaRMAT output: {e}')
+  if len(values) % 2 != 0:
+    raise ValueError('Malformed PaRMAT output: odd number of vertex indices')
+  if not parsed_all_lines(values, chunk, 2):
+    raise ValueError('Malformed PaRMAT output: lines that are not vertex index pairs')
+  # format_entries writes 1-based indices: PaRMAT's 0-based indices are shifted while formatting
+  return format_entries(values[0::2], values[1::2], None, b''), len(values) // 2
+
+
+def parmat_to_mtx(edge_list_path: Path, mtx_path: Path, N: int, M: int, chunk_size: int = CHUNK_SIZE) -> int:
+  """
+  Streams a PaRMAT edge list (0-based, tab separated) into a Matrix Market file.
+
+  The edge list is read in blocks of `chunk_size` bytes, so memory usage does not depend on M.
+  The output is written to a temporary file that atomically replaces `mtx_path` once complete.
+
+  Returns:
+    int: number of edges written.
+  """
+  tmp_path = tmp_path_for(mtx_path)
+  fixed_path = mtx_path.with_name(mtx_path.name + '.fix.tmp')
+  n_edges = 0
+  try:
+    with open(edge_list_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+      dst.write(MTX_HEADER.encode())
+      dst.write(f'{N} {N} {M}\n'.encode())
+      remainder = b''
+      while True:
+        block = src.read(chunk_size)
+        if not block:
+          break
+        block = remainder + block
+        cut = block.rfind(b'\n') + 1
+        remainder = block[cut:]
+        lines, n = _shift_chunk(block[:cut])
+        dst.write(lines)
+        n_edges += n
+      lines, n = _shift_chunk(remainder)
+      dst.write(lines)
+      n_edges += n
+
+    if n_edges != M:
+      # The size line was written before knowing the actual edge count, rewrite it (rare)
+      console.print(f"[yellow]PaRMAT produced {n_edges} edges instead of {M}, fixing the header[/yellow]")
+      with open(tmp_path, 'rb') as src, open(fixed_path, 'wb') as dst:
+        src.readline()
+        src.readline()
+        dst.write(MTX_HEADER.encode())
+        dst.write(f'{N} {N} {n_edges}\n'.encode())
+        while block := src.read(chunk_size):
+          dst.write(block)
+      commit(fixed_path, mtx_path)
+    else:
+      commit(tmp_path, mtx_path)
+  finally:
+    tmp_path.unlink(missing_ok=True)
+    fixed_path.unlink(missing_ok=True)
+  return n_edges
+
+
+def _generate_matrix(matrix: PaRMATMatrix, mtx_path: Path, cli_args: List) -> bool:
+  edge_list_path = mtx_path.with_suffix('.parmat.txt')
+  # The category file may be a link into the matrix store: replace the link, not the stored file
+  output_path = resolve_matrix_path(mtx_path)
+  dependencies.require(dependencies.DEPS.PARMAT)
+  try:
+    console.print(f"==> ⚙️ Generating PaRMAT matrix \"{mtx_path.stem}\"")
+    edge_list_arg = os.path.relpath(edge_list_path.resolve(), dependencies.PARMAT_GENERATOR.parent)
+    cli_args = [str(v) for v in ([f'./{dependencies.PARMAT_GENERATOR.stem}'] + cli_args + ['-output', edge_list_arg])]
+    subprocess.run(cli_args, cwd=dependencies.PARMAT_GENERATOR.parent, check=True)
+    parmat_to_mtx(edge_list_path, output_path, matrix.N, matrix.M)
+    add_io(bytes_out=file_size(output_path))
+  except subprocess.CalledProcessError as e:
+    console.print(f"[red]Matrix generation failed:[/red] {e}")
+    return False
+  except (OSError, ValueError) as e:
+    console.print(f"[red]Conversion of the PaRMAT output failed:[/red] {e}")
+    return False
+  finally:
+    edge_list_path.unlink(missing_ok=True)
+  console.print('==> Generated!')
+  return True
+
+
+def _generate_native(matrix: PaRMATMatrix, mtx_path: Path, bmtx: bool, workers: Optional[int]) -> bool:
+  """Runs the built-in RMAT generator (`workers` processes), straight to the `.bmtx` file with `bmtx`."""
+  output_path = resolve_matrix_path(mtx_path).with_suffix('.bmtx' if bmtx else '.mtx')
+  console.print(f"==> ⚙️ Generating RMAT matrix \"{mtx_path.stem}\" (native engine)")
+  try:
+    n_edges = native.generate_rmat(matrix, output_path, workers)
+  except OSError as e:
+    console.print(f"[red]Matrix generation failed:[/red] {e}")
+    return False
+  add_io(bytes_out=file_size(output_path))
+  if n_edges != matrix.M:
+    console.print(f"[yellow]\"{mtx_path.stem}\" has {n_edges} edges instead of {matrix.M} (not enough distinct edges could be sampled)[/yellow]")
+  console.print('==> Generated!')
+  return True
+
+
+def plan(
   config: ConfigCategory,
   flags: Flags,
   dataset_manager: DatasetManager,
-):
+) -> List[MatrixTask]:
   if not config.generators or not config.generators.parmat:
-    return
-  
+    return []
+
   matrices = config.generators.parmat.get_matrices()
+  engine = config.generators.parmat.engine
+  postprocess = config.generators.parmat.postprocess
+  use_native = engine == GeneratorEngine.NATIVE
 
-  if len(matrices) > 0:
-    dependencies.download_and_build_parmat_generator()
+  if len(matrices) > 0 and not use_native:
+    # Built in the background: generator steps wait for it
+    dependencies.prepare(dependencies.DEPS.PARMAT)
 
+  tasks = []
   for matrix in matrices:
-    mtx_path, cli_args = dataset_manager.get_parmat_path_and_cli_args(matrix)
-    generate, convert = dataset_manager.check_matrix_status(mtx_path, flags, False, mtx_path.stem)
-      
+    mtx_path, cli_args = dataset_manager.get_parmat_path_and_cli_args(matrix, engine)
+    identity = 'parmat:' + ' '.join(str(arg) for arg in cli_args)
+    if use_native:
+      identity += ' engine=native'
+    identity = postprocessed_identity(identity, postprocess)
+    generate, convert = dataset_manager.check_matrix_status(mtx_path, flags, False, mtx_path.stem, identity)
+    task = MatrixTask(mtx_path.stem, mtx_path, dataset_manager, flags.binary_mtx)
+
+    # The native engine writes binary matrices straight to BMTX (unless the .mtx file is kept)
+    direct_bmtx = use_native and flags.binary_mtx and not flags.keep_mtx
     if generate:
-      try:
-        console.print(f"==> ⚙️ Generating PaRMAT matrix \"{mtx_path.stem}\"")
-        output_path = os.path.relpath(mtx_path.resolve(), dependencies.PARMAT_GENERATOR.parent)
-        cli_args = [str(v) for v in ([f'./{dependencies.PARMAT_GENERATOR.stem}'] + cli_args + ['-output', output_path])]
-        print(' '.join(cli_args))
-        subprocess.run(cli_args, cwd=dependencies.PARMAT_GENERATOR.parent, check=True)
-        with open(mtx_path.resolve().absolute(), 'r+') as f:
-          content = f.read()
-          lines = content.split('\n')
-          coords = []
-          for line in lines:
-            line = re.sub(r'\s+', ' ', line)
-            rc = line.split(' ')
-            if len(rc) == 2:
-              r, c = rc
-              coords.append(f'{int(r)+1} {int(c)+1}')
-          f.seek(0, 0)
-          f.write('%%MatrixMarket matrix coordinate pattern general\n')
-          f.write(f'{matrix.N} {matrix.N} {matrix.M}\n')
-          f.write('\n'.join(coords))
-      except subprocess.CalledProcessError as e:
-        print(f"Matrix generation failed: {e}")
-        continue
-      print('==> Generated!')
-
-    if convert and flags.binary_mtx:
-      dataset_manager.convert_to_bmtx(mtx_path, flags, mtx_path.stem)
-
-    dataset_manager.register_matrix_path(mtx_path, flags.binary_mtx)
+      if use_native:
+        task.add_step(JobKind.CPU, partial(_generate_native, matrix, mtx_path, direct_bmtx, flags.generator_threads))
+      else:
+        task.add_step(JobKind.CPU, partial(_generate_matrix, matrix, mtx_path, cli_args))
+      task.add_postprocess_step(postprocess, flags, direct_bmtx)
+
+    if convert and flags.binary_mtx and not (generate and direct_bmtx):
+      task.add_convert_step(flags)
+
+    task.add_compress_step(flags)
+    task.add_csr_step(flags)
+    task.add_shard_step(flags)
+    task.add_record_step(identity, flags)
+    tasks.append(task)
 
+  return tasks
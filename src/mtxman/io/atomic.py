@@ -0,0 +1,66 @@
+"""
+Crash-safe file writes: every produced file is written to `<name>.tmp` next to its destination,
+flushed to disk, then renamed over the destination. An interrupted job leaves at most a stale
+temporary file (overwritten by the next attempt), never a half-written matrix.
+"""
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Iterator
+
+
+def tmp_path_for(dest: Path) -> Path:
+  return dest.with_name(dest.name + '.tmp')
+
+
+def _fsync_dir(path: Path):
+  try:
+    fd = os.open(path, os.O_RDONLY)
+  except OSError:
+    return  # Not supported (e.g., on Windows)
+  try:
+    os.fsync(fd)
+  except OSError:
+    pass
+  finally:
+    os.close(fd)
+
+
+def commit(tmp_path: Path, dest: Path):
+  """Flushes `tmp_path` to disk and atomically renames it to `dest` (the rename is flushed as well)."""
+  with open(tmp_path, 'rb') as f:
+    os.fsync(f.fileno())
+  os.replace(tmp_path, dest)
+  _fsync_dir(dest.parent)
+
+
+@contextmanager
+def atomic_write(dest: Path, mode: str = 'wb', **kwargs) -> Iterator[IO]:
+  """Opens a temporary file that replaces `dest` if the block completes (and is removed otherwise)."""
+  tmp_path = tmp_path_for(dest)
+  try:
+    with open(tmp_path, mode, **kwargs) as f:
+      yield f
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp_path, dest)
+    _fsync_dir(dest.parent)
+  finally:
+    tmp_path.unlink(missing_ok=True)
+
+
+def commit_dir(tmp_dir: Path, dest: Path):
+  """
+  Renames the folder `tmp_dir` (whose files are already flushed) to `dest`, replacing it. An
+  existing `dest` is first moved aside, so `dest` is always either the old or the new folder.
+  """
+  old_dir = dest.with_name(dest.name + '.old')
+  if old_dir.exists():
+    shutil.rmtree(old_dir)
+  if dest.exists():
+    os.replace(dest, old_dir)
+  os.replace(tmp_dir, dest)
+  _fsync_dir(dest.parent)
+  if old_dir.exists():
+    shutil.rmtree(old_dir)
@@ -0,0 +1,235 @@
+"""
+Binary Matrix Market (.bmtx) files, as read by distributed_mmio.
+
+Layout:
+
+  %%MatrixMarket matrix coordinate <real|pattern> <symmetry>\\n
+  <nrows> <ncols> <nnz> <index_bytes> <value_bytes>\\n
+  rows    nnz x little-endian unsigned integers of <index_bytes> bytes (0-based)
+  cols    nnz x little-endian unsigned integers of <index_bytes> bytes (0-based)
+  values  nnz x little-endian floats of <value_bytes> bytes (absent for pattern matrices)
+
+Entries keep the order (and, for symmetric matrices, the triangle) of the source `.mtx` file.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+
+from mtxman.io import mtx
+from mtxman.io.atomic import atomic_write, commit, tmp_path_for
+from mtxman.exceptions import MatrixFormatError
+
+
+@dataclass
+class BmtxHeader:
+  field: str      # real | pattern
+  symmetry: str
+  nrows: int
+  ncols: int
+  nnz: int
+  index_bytes: int
+  value_bytes: int  # 0 for pattern matrices
+
+  @property
+  def index_dtype(self) -> np.dtype:
+    return np.dtype(f'<u{self.index_bytes}')
+
+  @property
+  def value_dtype(self) -> np.dtype:
+    return np.dtype(f'<f{self.value_bytes}')
+
+  def encode(self) -> bytes:
+    return (
+      f'%%MatrixMarket matrix coordinate {self.field} {self.symmetry}\n'
+      f'{self.nrows} {self.ncols} {self.nnz} {self.index_bytes} {self.value_bytes}\n'
+    ).encode('ascii')
+
+  def data_size(self) -> int:
+    return self.nnz * (2 * self.index_bytes + self.value_bytes)
+
+
+def read_header(path: Path) -> Tuple[BmtxHeader, int]:
+  """
+  Reads the header of a BMTX file.
+
+  Returns:
+    (header, data_offset): data_offset is the byte offset of the rows section.
+  """
+  with open(path, 'rb') as f:
+    banner = f.readline().decode('ascii', errors='replace').split()
+    if len(banner) != 5 or banner[0].lower() != '%%matrixmarket' or banner[2].lower() != 'coordinate':
+      raise MatrixFormatError(f"'{path}' is not a BMTX file")
+    sizes = f.readline().split()
+    if len(sizes) != 5:
+      raise MatrixFormatError(f"Invalid size line in '{path}': {b' '.join(sizes)!r}")
+    nrows, ncols, nnz, index_bytes, value_bytes = (int(s) for s in sizes)
+    header = BmtxHeader(banner[3].lower(), banner[4].lower(), nrows, ncols, nnz, index_bytes, value_bytes)
+    return header, f.tell()
+
+
+@dataclass
+class BmtxMatrix:
+  """
+  Entries of a BMTX file, as stored: 0-based unsigned indices and float values (None for pattern
+  matrices). Memory-mapped arrays are read-only views of the file.
+  """
+  header: BmtxHeader
+  rows: np.ndarray
+  cols: np.ndarray
+  vals: Optional[np.ndarray]
+
+  @property
+  def shape(self) -> Tuple[int, int]:
+    return self.header.nrows, self.header.ncols
+
+
+def read_bmtx(path: Path, mmap: bool = True) -> BmtxMatrix:
+  """
+  Reads a BMTX file: with `mmap`, its sections are memory-mapped (nothing is copied or parsed),
+  otherwise they are read into memory.
+
+  Raises:
+    MatrixFormatError: if the file is not a BMTX file or its size does not match its header.
+  """
+  header, offset = read_header(path)
+  size = Path(path).stat().st_size
+  if size != offset + header.data_size():
+    raise MatrixFormatError(f"'{path}' has {size} bytes, its header requires {offset + header.data_size()}")
+  if header.nnz == 0:
+    # Empty sections cannot be memory-mapped
+    vals = np.empty(0, header.value_dtype) if header.value_bytes else None
+    return BmtxMatrix(header, np.empty(0, header.index_dtype), np.empty(0, header.index_dtype), vals)
+  if mmap:
+    arrays = [target.attach()[0] if target is not None else None for target in _section_targets(path, header, offset, mode='r')]
+  else:
+    arrays = [
+      np.fromfile(path, dtype=target.dtype, count=target.length, offset=target.offset) if target is not None else None
+      for target in _section_targets(path, header, offset)
+    ]
+  return BmtxMatrix(header, *arrays)
+
+
+def iter_coo_chunks(path: Path, chunk_entries: int = mtx.CHUNK_SIZE // 24) -> Iterator[mtx.COO]:
+  """
+  Reads the entries of a BMTX file in chunks of `chunk_entries` (memory-mapped, nothing is parsed).
+
+  Yields:
+    (rows, cols, vals): 0-based indices and values (None for pattern matrices), as stored in the file.
+  """
+  matrix = read_bmtx(path)
+  rows, cols, vals = matrix.rows, matrix.cols, matrix.vals
+  for start in range(0, matrix.header.nnz, chunk_entries):
+    stop = min(start + chunk_entries, matrix.header.nnz)
+    yield rows[start:stop], cols[start:stop], (vals[start:stop] if vals is not None else None)
+
+
+def header_for(mtx_header: mtx.MtxHeader, double_values: bool = False) -> BmtxHeader:
+  """Returns the BMTX header used to store the matrix described by `mtx_header`."""
+  index_bytes = 4 if max(mtx_header.nrows, mtx_header.ncols) <= 2 ** 32 else 8
+  value_bytes = 0 if mtx_header.is_pattern else (8 if double_values else 4)
+  return BmtxHeader(
+    field='pattern' if mtx_header.is_pattern else 'real',
+    symmetry=mtx_header.symmetry,
+    nrows=mtx_header.nrows,
+    ncols=mtx_header.ncols,
+    nnz=mtx_header.nnz,
+    index_bytes=index_bytes,
+    value_bytes=value_bytes,
+  )
+
+
+def _section_targets(path: Path, header: BmtxHeader, offset: Optional[int] = None, mode: str = 'r+') -> List[Optional[mtx.ArrayTarget]]:
+  """Rows, cols and vals sections of a BMTX file (vals is None for pattern matrices)."""
+  offset = len(header.encode()) if offset is None else offset
+  index_size = header.nnz * header.index_bytes
+  return [
+    mtx.ArrayTarget(header.index_dtype.str, header.nnz, file_path=path, offset=offset, mode=mode),
+    mtx.ArrayTarget(header.index_dtype.str, header.nnz, file_path=path, offset=offset + index_size, mode=mode),
+    mtx.ArrayTarget(header.value_dtype.str, header.nnz, file_path=path, offset=offset + 2 * index_size, mode=mode) if header.value_bytes else None,
+  ]
+
+
+def allocate(path: Path, header: BmtxHeader) -> List[Optional[mtx.ArrayTarget]]:
+  """Creates `path` with `header` and room for its entries; returns the (writable) sections of the file."""
+  encoded = header.encode()
+  with open(path, 'wb') as f:
+    f.write(encoded)
+    f.truncate(len(encoded) + header.data_size())
+  return _section_targets(path, header)
+
+
+def _fill_sequential(mtx_path: Path, mtx_header: mtx.MtxHeader, targets: List[Optional[mtx.ArrayTarget]], chunk_size: int):
+  nnz = mtx_header.nnz
+  arrays = [t.attach()[0] if t is not None and nnz > 0 else None for t in targets]
+  pos = 0
+  for chunk in mtx.iter_coo_chunks(mtx_path, mtx_header, chunk_size):
+    n = len(chunk[0])
+    if n == 0:
+      continue
+    if pos + n > nnz:
+      raise MatrixFormatError(f"'{mtx_path}' has more entries than declared ({nnz})")
+    for array, values in zip(arrays, chunk):
+      if array is not None:
+        array[pos:pos + n] = values
+    pos += n
+
+  for array in arrays:
+    if array is not None:
+      array.flush()
+  if pos != nnz:
+    raise MatrixFormatError(f"'{mtx_path}' has {pos} entries, {nnz} declared")
+
+
+def mtx_to_bmtx(
+  mtx_path: Path, bmtx_path: Path, double_values: bool = False, workers: Optional[int] = None, chunk_size: int = mtx.CHUNK_SIZE,
+) -> BmtxHeader:
+  """
+  Converts a coordinate Matrix Market file to BMTX.
+
+  The `.mtx` file is parsed in blocks of about `chunk_size` bytes, which are copied straight into
+  a memory-mapped output, so memory usage does not depend on the matrix size. Large files are
+  parsed by `workers` processes (default: all the usable CPUs), each writing its own shard of the
+  output. The output is written to a temporary file that atomically replaces `bmtx_path` once complete.
+
+  Args:
+    double_values: store values as float64 instead of float32 (same as `mtx_to_bmtx -d`).
+  """
+  mtx_header = mtx.read_header(mtx_path)
+  header = header_for(mtx_header, double_values)
+  workers = workers or mtx.default_workers()
+
+  tmp_path = tmp_path_for(bmtx_path)
+  try:
+    targets = allocate(tmp_path, header)
+    if mtx.use_parallel(mtx_path, mtx_header, workers):
+      mtx.parse_parallel(mtx_path, mtx_header, targets, workers, chunk_size)
+    else:
+      _fill_sequential(mtx_path, mtx_header, targets, chunk_size)
+
+    commit(tmp_path, bmtx_path)
+  finally:
+    tmp_path.unlink(missing_ok=True)
+
+  return header
+
+
+def bmtx_to_mtx(bmtx_path: Path, mtx_path: Path, chunk_entries: int = 1 << 20) -> BmtxHeader:
+  """
+  Converts a BMTX file back to a coordinate Matrix Market file (same entries, order and symmetry).
+
+  The input is memory-mapped and formatted in chunks of `chunk_entries`, so memory usage does not
+  depend on the matrix size. Values get enough digits to read back the same floats (9 for float32,
+  17 for float64). The output atomically replaces `mtx_path` once complete.
+  """
+  header, _ = read_header(bmtx_path)
+  value_format = b'%.17g' if header.value_bytes == 8 else b'%.9g'
+  with atomic_write(mtx_path) as f:
+    f.write(
+      f'%%MatrixMarket matrix coordinate {header.field} {header.symmetry}\n'
+      f'% File converted from BMTX with MtxMan.\n'
+      f'{header.nrows} {header.ncols} {header.nnz}\n'.encode('ascii')
+    )
+    for rows, cols, vals in iter_coo_chunks(bmtx_path, chunk_entries):
+      f.write(mtx.format_entries(rows, cols, vals, value_format))
+  return header
@@ -0,0 +1,375 @@
+"""
+Compressed matrix files (`<matrix>.mtx.cblk`, `<matrix>.bmtx.cblk`): the file is split into
+independently compressed blocks (zstd or lz4) listed in a block index, so readers can decode any
+block on its own, skip the blocks outside a row range, and decode blocks in parallel.
+
+Layout:
+
+  MAGIC, length of the JSON header (little-endian uint32)
+  JSON header  codec, source format and sizes (see `CompressedHeader`)
+  blocks       compressed blocks, back to back
+  index        one BLOCK_DTYPE record per block (offset, sizes, entries and row range)
+  trailer      offset of the index (little-endian uint64), MAGIC
+
+Blocks of `.mtx` files hold whole lines (the banner, comments and size line are kept in the JSON
+header); blocks of `.bmtx` files hold a range of entries: their rows, then cols, then values.
+Decompressing every block gives back the original file, byte for byte.
+
+Codecs need the optional `zstandard` / `lz4` packages.
+"""
+import base64
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Tuple, Union
+import numpy as np
+
+from mtxman.enums import Codec
+from mtxman.exceptions import DependencyError, MatrixFormatError
+from mtxman.io import bmtx, mtx
+from mtxman.io.atomic import atomic_write, commit, tmp_path_for
+
+COMPRESSED_SUFFIX = '.cblk'
+MAGIC = b'MTXMANCB'
+FORMAT_VERSION = 1
+# Uncompressed bytes per block
+BLOCK_SIZE = 4 * 1024 * 1024
+BLOCK_DTYPE = np.dtype([
+  ('offset', '<u8'), ('size', '<u8'), ('raw_size', '<u8'),
+  ('first_entry', '<u8'), ('entries', '<u8'),
+  ('min_row', '<u8'), ('max_row', '<u8'),  # 0-based; min_row > max_row for blocks without entries
+])
+_PREAMBLE = struct.Struct('<8sI')
+_TRAILER = struct.Struct('<Q8s')
+_EMPTY_ROWS = (np.iinfo(np.uint64).max, 0)
+
+
+_PACKAGES = {Codec.ZSTD: 'zstandard', Codec.LZ4: 'lz4'}
+# zstd (de)compressors cannot be shared by threads
+_local = threading.local()
+
+
+def check_codec(codec: Codec):
+  """Raises DependencyError if the package of `codec` is not installed."""
+  try:
+    if codec == Codec.ZSTD:
+      import zstandard  # noqa: F401
+    else:
+      import lz4.frame  # noqa: F401
+  except ImportError:
+    package = _PACKAGES[codec]
+    raise DependencyError(f"'{codec.value}' compression requires the '{package}' package (pip install {package})")
+
+
+def _compress(codec: Codec, data: bytes) -> bytes:
+  if codec == Codec.ZSTD:
+    if not hasattr(_local, 'zstd_compressor'):
+      import zstandard
+      _local.zstd_compressor = zstandard.ZstdCompressor(level=3)
+    return _local.zstd_compressor.compress(data)
+  import lz4.frame
+  return lz4.frame.compress(data)
+
+
+def _decompress(codec: Codec, data: bytes, raw_size: int) -> bytes:
+  if codec == Codec.ZSTD:
+    if not hasattr(_local, 'zstd_decompressor'):
+      import zstandard
+      _local.zstd_decompressor = zstandard.ZstdDecompressor()
+    raw = _local.zstd_decompressor.decompress(data, max_output_size=raw_size)
+  else:
+    import lz4.frame
+    raw = lz4.frame.decompress(data)
+  if len(raw) != raw_size:
+    raise MatrixFormatError(f"Corrupted block: {len(raw)} bytes decompressed, {raw_size} expected")
+  return raw
+
+
+def compressed_path_for(path: Union[Path, str]) -> Path:
+  path = Path(path)
+  return path.with_name(path.name + COMPRESSED_SUFFIX)
+
+
+def is_compressed(path: Union[Path, str]) -> bool:
+  return Path(path).suffix == COMPRESSED_SUFFIX
+
+
+def uncompressed_path(path: Union[Path, str]) -> Path:
+  """The `.mtx`/`.bmtx` path of a compressed file (other paths are returned as they are)."""
+  path = Path(path)
+  return path.with_name(path.name[:-len(COMPRESSED_SUFFIX)]) if is_compressed(path) else path
+
+
+@dataclass
+class CompressedHeader:
+  codec: Codec
+  source_format: str   # mtx | bmtx
+  source_header: str   # Bytes of the source file before its entries (base64)
+  field: str
+  symmetry: str
+  nrows: int
+  ncols: int
+  nnz: int
+  index_bytes: int     # BMTX only
+  value_bytes: int     # BMTX only
+  block_size: int
+  raw_size: int        # Size of the source file
+
+  def encode(self) -> bytes:
+    return json.dumps({'version': FORMAT_VERSION, **asdict(self), 'codec': self.codec.value}).encode()
+
+  @property
+  def prefix(self) -> bytes:
+    return base64.b64decode(self.source_header)
+
+  def mtx_header(self) -> mtx.MtxHeader:
+    return mtx.MtxHeader('coordinate', self.field, self.symmetry, self.nrows, self.ncols, self.nnz, len(self.prefix))
+
+  def bmtx_header(self) -> bmtx.BmtxHeader:
+    return bmtx.BmtxHeader(self.field, self.symmetry, self.nrows, self.ncols, self.nnz, self.index_bytes, self.value_bytes)
+
+
+class CompressedMatrix:
+  """
+  Random access to a compressed matrix file: header, block index and decoding of single blocks,
+  of row ranges and of the whole file. Blocks are read with `pread`: one instance can be shared by threads.
+  """
+
+  def __init__(self, path: Union[Path, str]):
+    self.path = Path(path)
+    self._fd = os.open(self.path, os.O_RDONLY)
+    try:
+      self._read_metadata()
+    except BaseException:
+      os.close(self._fd)
+      raise
+
+  def _read_metadata(self):
+    size = os.fstat(self._fd).st_size
+    preamble = os.pread(self._fd, _PREAMBLE.size, 0)
+    if size < _PREAMBLE.size + _TRAILER.size or _PREAMBLE.unpack(preamble)[0] != MAGIC:
+      raise MatrixFormatError(f"'{self.path}' is not a compressed matrix file")
+    header_size = _PREAMBLE.unpack(preamble)[1]
+    index_offset, magic = _TRAILER.unpack(os.pread(self._fd, _TRAILER.size, size - _TRAILER.size))
+    if magic != MAGIC:
+      raise MatrixFormatError(f"'{self.path}' is incomplete (no trailer)")
+    try:
+      fields = json.loads(os.pread(self._fd, header_size, _PREAMBLE.size))
+      if fields.pop('version') != FORMAT_VERSION:
+        raise ValueError('unsupported version')
+      fields['codec'] = Codec(fields['codec'])
+      self.header = CompressedHeader(**fields)
+    except (ValueError, KeyError, TypeError) as e:
+      raise MatrixFormatError(f"Invalid header in '{self.path}': {e}")
+    self.data_offset = _PREAMBLE.size + header_size
+    index_size = size - _TRAILER.size - index_offset
+    if index_offset < self.data_offset or index_size % BLOCK_DTYPE.itemsize:
+      raise MatrixFormatError(f"Invalid block index in '{self.path}'")
+    self.blocks = np.frombuffer(os.pread(self._fd, index_size, index_offset), dtype=BLOCK_DTYPE)
+    self.index_offset = index_offset
+
+  def close(self):
+    if self._fd >= 0:
+      os.close(self._fd)
+      self._fd = -1
+
+  def __enter__(self) -> 'CompressedMatrix':
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def check(self):
+    """Checks the block index against the header (constant time per block, nothing is decompressed)."""
+    blocks = self.blocks
+    end = blocks['offset'] + blocks['size']
+    if len(blocks) and (blocks['offset'][0] != self.data_offset or np.any(blocks['offset'][1:] != end[:-1]) or end[-1] != self.index_offset):
+      raise MatrixFormatError(f"The blocks of '{self.path}' do not match its index")
+    if int(blocks['entries'].sum()) != self.header.nnz:
+      raise MatrixFormatError(f"'{self.path}' has {int(blocks['entries'].sum())} entries, its header declares {self.header.nnz}")
+    if len(self.header.prefix) + int(blocks['raw_size'].sum()) != self.header.raw_size:
+      raise MatrixFormatError(f"The blocks of '{self.path}' do not add up to its size")
+
+  def read_block(self, i: int) -> bytes:
+    """Decompressed bytes of block `i`."""
+    block = self.blocks[i]
+    data = os.pread(self._fd, int(block['size']), int(block['offset']))
+    return _decompress(self.header.codec, data, int(block['raw_size']))
+
+  def decode_block(self, i: int) -> mtx.COO:
+    """Entries of block `i`: as `mtx.iter_coo_chunks` (`.mtx`) or `bmtx.iter_coo_chunks` (`.bmtx`) yields them."""
+    raw = self.read_block(i)
+    if self.header.source_format == 'mtx':
+      header = self.header.mtx_header()
+      return mtx.parse_block(raw, header, header.data_offset + int(self.blocks['raw_size'][:i].sum()))
+    return _split_sections(raw, self.header.bmtx_header(), int(self.blocks[i]['entries']))
+
+  def blocks_for_rows(self, start: int, stop: int) -> np.ndarray:
+    """Indices of the blocks that may hold entries of rows [start, stop)."""
+    blocks = self.blocks
+    return np.flatnonzero((blocks['entries'] > 0) & (blocks['min_row'] < stop) & (blocks['max_row'] >= start))
+
+  def iter_coo_chunks(self, rows: Optional[Tuple[int, int]] = None, workers: int = 1) -> Iterator[mtx.COO]:
+    """
+    Yields the entries of each block in file order, decoding up to `workers` blocks in parallel.
+    With `rows=(start, stop)`, only the blocks that may hold those rows are decoded, and only the
+    entries of those rows are yielded.
+    """
+    selected = range(len(self.blocks)) if rows is None else self.blocks_for_rows(*rows)
+    for rows_, cols, vals in _map_ordered(self.decode_block, selected, workers):
+      if rows is not None:
+        keep = (rows_ >= rows[0]) & (rows_ < rows[1])
+        rows_, cols, vals = rows_[keep], cols[keep], (vals[keep] if vals is not None else None)
+      yield rows_, cols, vals
+
+  def read_rows(self, start: int, stop: int, workers: int = 1) -> mtx.COO:
+    """The entries of rows [start, stop), in file order."""
+    chunks = list(self.iter_coo_chunks((start, stop), workers))
+    if not chunks:
+      index_dtype = np.int64 if self.header.source_format == 'mtx' else self.header.bmtx_header().index_dtype
+      vals = None if self.header.field == 'pattern' else np.empty(0, np.float64 if self.header.source_format == 'mtx' else self.header.bmtx_header().value_dtype)
+      return np.empty(0, index_dtype), np.empty(0, index_dtype), vals
+    vals = None if chunks[0][2] is None else np.concatenate([c[2] for c in chunks])
+    return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks]), vals
+
+  def decompress(self, dest: Path, workers: int = 1):
+    """Writes the original `.mtx`/`.bmtx` file to `dest` (atomically)."""
+    if self.header.source_format == 'mtx':
+      with atomic_write(dest) as f:
+        f.write(self.header.prefix)
+        for raw in _map_ordered(self.read_block, range(len(self.blocks)), workers):
+          f.write(raw)
+      return
+    header = self.header.bmtx_header()
+    tmp_path = tmp_path_for(dest)
+    try:
+      targets = bmtx.allocate(tmp_path, header)
+      arrays = [t.attach()[0] if t is not None and header.nnz > 0 else None for t in targets]
+      for i, entries in enumerate(_map_ordered(self.decode_block, range(len(self.blocks)), workers)):
+        first = int(self.blocks[i]['first_entry'])
+        for array, values in zip(arrays, entries):
+          if array is not None:
+            array[first:first + len(values)] = values
+      for array in arrays:
+        if array is not None:
+          array.flush()
+      del arrays
+      commit(tmp_path, dest)
+    finally:
+      tmp_path.unlink(missing_ok=True)
+
+
+def _split_sections(raw: bytes, header: bmtx.BmtxHeader, entries: int) -> mtx.COO:
+  index_size = entries * header.index_bytes
+  rows = np.frombuffer(raw, dtype=header.index_dtype, count=entries)
+  cols = np.frombuffer(raw, dtype=header.index_dtype, count=entries, offset=index_size)
+  vals = np.frombuffer(raw, dtype=header.value_dtype, count=entries, offset=2 * index_size) if header.value_bytes else None
+  return rows, cols, vals
+
+
+def _map_ordered(fn: Callable, items: Iterable, workers: int) -> Iterator:
+  """Yields fn(item) for each item in order, running up to `workers` calls in threads."""
+  if workers <= 1:
+    for item in items:
+      yield fn(item)
+    return
+  with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mtxman-blocks') as pool:
+    pending = deque()
+    try:
+      for item in items:
+        pending.append(pool.submit(fn, item))
+        # Bounds the finished blocks waiting to be consumed
+        if len(pending) >= 2 * workers:
+          yield pending.popleft().result()
+      while pending:
+        yield pending.popleft().result()
+    finally:
+      for future in pending:
+        future.cancel()
+
+
+def _row_range(rows: np.ndarray) -> Tuple[int, int]:
+  return (int(rows.min()), int(rows.max())) if len(rows) else _EMPTY_ROWS
+
+
+def compress_file(
+  path: Union[Path, str], dest: Optional[Path] = None, codec: Codec = Codec.ZSTD, block_size: int = BLOCK_SIZE, workers: int = 1,
+) -> CompressedHeader:
+  """
+  Compresses the `.mtx` or `.bmtx` file at `path` to `dest` (default: `compressed_path_for(path)`,
+  written atomically), with `workers` threads compressing blocks of about `block_size` bytes.
+  """
+  path = Path(path)
+  dest = Path(dest) if dest is not None else compressed_path_for(path)
+  check_codec(codec)
+  raw_size = path.stat().st_size
+
+  with open(path, 'rb') as f:
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if raw_size else b''
+    try:
+      if path.suffix == '.bmtx':
+        source, data_offset = bmtx.read_header(path)
+        source_format = 'bmtx'
+        index_bytes, value_bytes = source.index_bytes, source.value_bytes
+        if data_offset + source.data_size() != raw_size:
+          raise MatrixFormatError(f"'{path}' has {raw_size} bytes, its header requires {data_offset + source.data_size()}")
+        chunk_entries = max(1, block_size // (2 * index_bytes + value_bytes))
+        sections = bmtx.read_bmtx(path)
+        ranges = [(start, min(start + chunk_entries, source.nnz)) for start in range(0, source.nnz, chunk_entries)]
+
+        def encode(entry_range: Tuple[int, int]):
+          start, stop = entry_range
+          parts = [a[start:stop] for a in (sections.rows, sections.cols, sections.vals) if a is not None]
+          raw = b''.join(part.tobytes() for part in parts)
+          return _compress(codec, raw), len(raw), stop - start, _row_range(parts[0])
+      else:
+        source = mtx.read_header(path)
+        mtx.check_coordinate(path, source)
+        source_format = 'mtx'
+        data_offset = source.data_offset
+        index_bytes = value_bytes = 0
+        ranges = list(mtx.block_boundaries(mm, data_offset, raw_size, block_size))
+
+        def encode(byte_range: Tuple[int, int]):
+          raw = mm[byte_range[0]:byte_range[1]]
+          rows = mtx.parse_block(raw, source, byte_range[0])[0]
+          return _compress(codec, raw), len(raw), len(rows), _row_range(rows)
+
+      header = CompressedHeader(
+        codec=codec,
+        source_format=source_format,
+        source_header=base64.b64encode(mm[:data_offset]).decode('ascii'),
+        field=source.field,
+        symmetry=source.symmetry,
+        nrows=source.nrows,
+        ncols=source.ncols,
+        nnz=source.nnz,
+        index_bytes=index_bytes,
+        value_bytes=value_bytes,
+        block_size=block_size,
+        raw_size=raw_size,
+      )
+      encoded_header = header.encode()
+      blocks = np.zeros(len(ranges), dtype=BLOCK_DTYPE)
+      with atomic_write(dest) as out:
+        out.write(_PREAMBLE.pack(MAGIC, len(encoded_header)) + encoded_header)
+        first_entry = 0
+        for i, (data, size, entries, (min_row, max_row)) in enumerate(_map_ordered(encode, ranges, workers)):
+          blocks[i] = (out.tell(), len(data), size, first_entry, entries, min_row, max_row)
+          out.write(data)
+          first_entry += entries
+        if first_entry != source.nnz:
+          raise MatrixFormatError(f"'{path}' has {first_entry} entries, its header declares {source.nnz}")
+        index_offset = out.tell()
+        out.write(blocks.tobytes())
+        out.write(_TRAILER.pack(index_offset, MAGIC))
+    finally:
+      if raw_size:
+        mm.close()
+  return header
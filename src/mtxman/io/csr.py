@@ -0,0 +1,287 @@
+"""
+CSR export: a matrix stored as raw arrays that can be memory-mapped (no parsing) and used
+directly by NumPy or `scipy.sparse`.
+
+Layout of `<matrix>.csr/` (next to the `.mtx`/`.bmtx` file):
+
+  header.json  shape, nnz, dtypes and the source file (see `CsrHeader`)
+  indptr.bin   nrows + 1 little-endian signed integers
+  indices.bin  nnz little-endian signed integers (same dtype as indptr), sorted within each row
+  data.bin     nnz little-endian values (absent for pattern matrices)
+
+Symmetric matrices are expanded (both triangles are stored); duplicate entries are kept.
+Indices are int32 whenever the matrix allows it, so that `scipy.sparse` uses the arrays as they are.
+
+The export works out of core: a first pass counts the entries of each row, a second pass scatters
+the entries into the memory-mapped arrays, and a last pass sorts the columns of each block of rows.
+Only O(nrows) integers and one chunk of entries are kept in memory.
+"""
+import json
+import os
+import shutil
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional, Tuple, Union
+import numpy as np
+
+from mtxman.exceptions import MatrixFormatError
+from mtxman.io import compressed, stats
+from mtxman.io.atomic import commit_dir
+
+CSR_SUFFIX = '.csr'
+FORMAT_NAME = 'mtxman-csr'
+FORMAT_VERSION = 1
+HEADER_FILENAME = 'header.json'
+INDPTR_FILENAME = 'indptr.bin'
+INDICES_FILENAME = 'indices.bin'
+DATA_FILENAME = 'data.bin'
+# Smallest chunk of entries read / sorted at once
+MIN_BLOCK = 4096
+
+
+@dataclass
+class CsrHeader:
+  nrows: int
+  ncols: int
+  nnz: int                      # Stored entries (both triangles of symmetric matrices)
+  index_dtype: str              # NumPy dtype string of indptr and indices (e.g., '<i4')
+  value_dtype: Optional[str]    # NumPy dtype string of data (None for pattern matrices)
+  field: str                    # Field of the source matrix
+  source_symmetry: str          # Symmetry of the source matrix (the arrays always hold the full matrix)
+  source_name: str = ''
+  source_size: int = 0
+  source_mtime_ns: int = 0
+
+  @property
+  def shape(self) -> Tuple[int, int]:
+    return self.nrows, self.ncols
+
+  def encode(self) -> str:
+    return json.dumps({'format': FORMAT_NAME, 'version': FORMAT_VERSION, **asdict(self)}, indent=2) + '\n'
+
+  def file_sizes(self):
+    index_size = np.dtype(self.index_dtype).itemsize
+    sizes = {INDPTR_FILENAME: (self.nrows + 1) * index_size, INDICES_FILENAME: self.nnz * index_size}
+    if self.value_dtype is not None:
+      sizes[DATA_FILENAME] = self.nnz * np.dtype(self.value_dtype).itemsize
+    return sizes
+
+
+@dataclass
+class CsrMatrix:
+  """The arrays of a CSR export (memory-mapped, unless loaded with `mmap=False`)."""
+  header: CsrHeader
+  indptr: np.ndarray
+  indices: np.ndarray
+  data: Optional[np.ndarray]  # None for pattern matrices
+
+  @property
+  def shape(self) -> Tuple[int, int]:
+    return self.header.shape
+
+  @property
+  def nnz(self) -> int:
+    return self.header.nnz
+
+  def to_scipy(self):
+    """
+    Returns a `scipy.sparse.csr_matrix` that uses the arrays without copying them (pattern
+    matrices get a float32 array of ones). Requires scipy.
+    """
+    try:
+      import scipy.sparse
+    except ImportError as e:
+      raise ImportError("scipy is required to build sparse matrices (pip install scipy)") from e
+    data = self.data if self.data is not None else np.ones(self.nnz, dtype=np.float32)
+    return scipy.sparse.csr_matrix((data, self.indices, self.indptr), shape=self.shape, copy=False)
+
+
+def csr_path_for(matrix_path: Union[Path, str]) -> Path:
+  """Folder of the CSR export of a `.mtx`, `.bmtx` or compressed file."""
+  return compressed.uncompressed_path(matrix_path).with_suffix(CSR_SUFFIX)
+
+
+def read_header(path: Union[Path, str]) -> CsrHeader:
+  """Reads the header of the CSR export in the folder `path`."""
+  header_path = Path(path) / HEADER_FILENAME
+  try:
+    fields = json.loads(header_path.read_text())
+  except (OSError, ValueError) as e:
+    raise MatrixFormatError(f"'{path}' is not a CSR export: {e}")
+  if fields.pop('format', None) != FORMAT_NAME or fields.pop('version', None) != FORMAT_VERSION:
+    raise MatrixFormatError(f"'{header_path}' is not a supported CSR header")
+  try:
+    return CsrHeader(**fields)
+  except TypeError as e:
+    raise MatrixFormatError(f"Invalid CSR header '{header_path}': {e}")
+
+
+def is_complete(path: Union[Path, str], source: Optional[Path] = None) -> bool:
+  """
+  True if the folder `path` holds a complete CSR export (and, with `source`, if it was exported
+  from the current version of that file: same size and modification time).
+  """
+  path = Path(path)
+  try:
+    header = read_header(path)
+    if any((path / name).stat().st_size != size for name, size in header.file_sizes().items()):
+      return False
+    if source is not None:
+      st = Path(source).stat()
+      return header.source_size == st.st_size and header.source_mtime_ns == st.st_mtime_ns
+  except (OSError, MatrixFormatError):
+    return False
+  return True
+
+
+def _open_array(path: Path, dtype: np.dtype, count: int, mode: str) -> np.ndarray:
+  if count == 0:
+    return np.empty(0, dtype=dtype)  # Empty files cannot be memory-mapped
+  return np.memmap(path, dtype=dtype, mode=mode, shape=(count,))
+
+
+def load(path: Union[Path, str], mmap: bool = True, as_scipy: bool = False):
+  """
+  Loads a CSR export.
+
+  Args:
+    path: the `.csr` folder, or the `.mtx`/`.bmtx` (or compressed) file it was exported from.
+    mmap: memory-map the arrays (zero-copy, read-only) instead of reading them into memory.
+    as_scipy: return a `scipy.sparse.csr_matrix` view of the arrays (see `CsrMatrix.to_scipy`).
+
+  Returns:
+    CsrMatrix (or a `scipy.sparse.csr_matrix` with `as_scipy`).
+  """
+  path = Path(path)
+  if path.suffix != CSR_SUFFIX and not (path / HEADER_FILENAME).is_file():
+    path = csr_path_for(path)
+  if not is_complete(path):
+    raise MatrixFormatError(f"'{path}' is not a complete CSR export")
+  header = read_header(path)
+
+  def array(name: str, dtype: str, count: int) -> np.ndarray:
+    if mmap:
+      return _open_array(path / name, np.dtype(dtype), count, 'r')
+    return np.fromfile(path / name, dtype=np.dtype(dtype), count=count)
+
+  matrix = CsrMatrix(
+    header=header,
+    indptr=array(INDPTR_FILENAME, header.index_dtype, header.nrows + 1),
+    indices=array(INDICES_FILENAME, header.index_dtype, header.nnz),
+    data=array(DATA_FILENAME, header.value_dtype, header.nnz) if header.value_dtype is not None else None,
+  )
+  return matrix.to_scipy() if as_scipy else matrix
+
+
+def _sort_rows(indptr: np.ndarray, indices: np.ndarray, data: Optional[np.ndarray], block_entries: int):
+  """Sorts the columns of every row, in blocks of rows holding about `block_entries` entries."""
+  nrows = len(indptr) - 1
+  start_row = 0
+  while start_row < nrows:
+    start = int(indptr[start_row])
+    stop_row = int(np.searchsorted(indptr, start + block_entries, side='right')) - 1
+    stop_row = min(max(stop_row, start_row + 1), nrows)
+    stop = int(indptr[stop_row])
+    if stop - start > 1:
+      rows = np.repeat(np.arange(stop_row - start_row), np.diff(indptr[start_row:stop_row + 1]))
+      cols = np.asarray(indices[start:stop])
+      unsorted = (np.diff(cols) < 0) & (np.diff(rows) == 0)
+      if unsorted.any():
+        order = np.lexsort((cols, rows))
+        indices[start:stop] = cols[order]
+        if data is not None:
+          data[start:stop] = np.asarray(data[start:stop])[order]
+    start_row = stop_row
+
+
+def export_csr(path: Union[Path, str], dest: Optional[Path] = None, memory_limit: int = 1 << 30) -> CsrHeader:
+  """
+  Exports the `.mtx` or `.bmtx` file at `path` to a CSR folder (default: `csr_path_for(path)`),
+  using about `memory_limit` bytes of memory (plus O(nrows) integers). The folder is built
+  next to `dest` and renamed once complete.
+
+  Raises:
+    MatrixFormatError: if the matrix cannot be exported (e.g., a Hermitian matrix).
+  """
+  path = Path(path)
+  dest = Path(dest) if dest is not None else csr_path_for(path)
+  info = stats.read_info(path)
+  value_dtype = stats.stored_value_dtype(path)
+  chunk_size = max(MIN_BLOCK * 64, memory_limit // 8)
+
+  # Pass 1: entries of each row
+  counts = np.zeros(info.nrows, dtype=np.int64)
+  for rows, _, _ in stats.iter_full_entries(path, chunk_size):
+    counts += np.bincount(rows, minlength=info.nrows)
+  nnz = int(counts.sum())
+
+  fits_int32 = max(nnz, info.nrows, info.ncols) < 2 ** 31
+  index_dtype = np.dtype('<i4') if fits_int32 else np.dtype('<i8')
+  st = path.stat()
+  header = CsrHeader(
+    nrows=info.nrows,
+    ncols=info.ncols,
+    nnz=nnz,
+    index_dtype=index_dtype.str,
+    value_dtype=value_dtype.str if value_dtype is not None else None,
+    field=info.field,
+    source_symmetry=info.symmetry,
+    source_name=path.name,
+    source_size=st.st_size,
+    source_mtime_ns=st.st_mtime_ns,
+  )
+
+  tmp_dir = dest.with_name(dest.name + '.tmp')
+  if tmp_dir.exists():
+    shutil.rmtree(tmp_dir)
+  tmp_dir.mkdir(parents=True)
+  try:
+    indptr = np.zeros(info.nrows + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    indptr.astype(index_dtype).tofile(tmp_dir / INDPTR_FILENAME)
+    del counts
+
+    indices = _open_array(tmp_dir / INDICES_FILENAME, index_dtype, nnz, 'w+')
+    data = _open_array(tmp_dir / DATA_FILENAME, value_dtype, nnz, 'w+') if value_dtype is not None else None
+    if nnz == 0:
+      for name in header.file_sizes():
+        (tmp_dir / name).touch()
+
+    # Pass 2: scatter the entries of each chunk after the entries already placed in their rows
+    cursor = indptr[:-1].copy()
+    for rows, cols, vals in stats.iter_full_entries(path, chunk_size, value_dtype):
+      if len(rows) == 0:
+        continue
+      order = np.argsort(rows, kind='stable')
+      rows = rows[order]
+      first = np.concatenate(([0], np.flatnonzero(np.diff(rows)) + 1))
+      row_ids = rows[first]
+      row_counts = np.diff(np.append(first, len(rows)))
+      if np.any(cursor[row_ids] + row_counts > indptr[row_ids + 1]):
+        raise MatrixFormatError(f"The entries of '{path}' changed while it was being exported")
+      positions = cursor[rows] + (np.arange(len(rows)) - np.repeat(first, row_counts))
+      indices[positions] = cols[order]
+      if data is not None:
+        data[positions] = vals[order]
+      cursor[row_ids] += row_counts
+    del cursor
+
+    # Pass 3: sort the columns of each row
+    _sort_rows(indptr, indices, data, max(MIN_BLOCK, chunk_size // 32))
+
+    for array in (indices, data):
+      if isinstance(array, np.memmap):
+        array.flush()
+    del indices, data
+    for name in header.file_sizes():
+      with open(tmp_dir / name, 'rb') as f:
+        os.fsync(f.fileno())
+    with open(tmp_dir / HEADER_FILENAME, 'w') as f:
+      f.write(header.encode())
+      f.flush()
+      os.fsync(f.fileno())
+    commit_dir(tmp_dir, dest)
+  finally:
+    if tmp_dir.exists():
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+  return header
@@ -0,0 +1,360 @@
+import itertools
+import mmap
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+
+from mtxman.exceptions import MatrixFormatError
+
+# Size of the blocks parsed at once (bounds the memory used by the chunked readers)
+CHUNK_SIZE = 64 * 1024 * 1024
+# Files with less entry data than this are always parsed by a single process
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+# Number of shards per worker (more shards than workers balance uneven shards)
+SHARDS_PER_WORKER = 4
+
+COO = Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]
+
+
+@dataclass
+class MtxHeader:
+  """Matrix Market banner and size line."""
+  format: str     # coordinate | array
+  field: str      # real | integer | pattern | complex
+  symmetry: str   # general | symmetric | skew-symmetric | hermitian
+  nrows: int
+  ncols: int
+  nnz: int
+  data_offset: int  # Byte offset of the first entry
+
+  @property
+  def is_pattern(self) -> bool:
+    return self.field == 'pattern'
+
+  @property
+  def banner(self) -> str:
+    return f'%%MatrixMarket matrix {self.format} {self.field} {self.symmetry}'
+
+
+def read_header(path: Path) -> MtxHeader:
+  """Reads the banner and the size line of a Matrix Market file (entries are not read)."""
+  with open(path, 'rb') as f:
+    banner = f.readline().decode('ascii', errors='replace').split()
+    if len(banner) != 5 or banner[0].lower() != '%%matrixmarket' or banner[1].lower() != 'matrix':
+      raise MatrixFormatError(f"'{path}' is not a Matrix Market file")
+    mtx_format, field, symmetry = (b.lower() for b in banner[2:])
+
+    line = f.readline()
+    while line.startswith(b'%') or (line and not line.strip()):
+      line = f.readline()
+    sizes = line.split()
+    if mtx_format == 'coordinate' and len(sizes) == 3:
+      nrows, ncols, nnz = (int(s) for s in sizes)
+    elif mtx_format == 'array' and len(sizes) == 2:
+      nrows, ncols = (int(s) for s in sizes)
+      nnz = nrows * ncols
+    else:
+      raise MatrixFormatError(f"Invalid size line in '{path}': {line!r}")
+
+    return MtxHeader(mtx_format, field, symmetry, nrows, ncols, nnz, f.tell())
+
+
+def parsed_all_lines(values: np.ndarray, block: bytes, width: int) -> bool:
+  """
+  Whether `values`, parsed from `block` with `np.fromstring(..., sep=' ')`, hold `width` values for
+  each non-blank line of `block`. Older NumPy releases stop at the first malformed value (with a
+  DeprecationWarning) instead of raising, so a short count is the only sign of a truncated parse.
+  """
+  lines = block.count(b'\n') + (0 if block.endswith(b'\n') else 1)
+  if values.size == width * lines:
+    return True
+  # Blank lines (or a missing final newline) make the quick count inexact
+  return values.size == width * sum(1 for line in block.splitlines() if line.strip())
+
+
+def parse_block(block: bytes, header: MtxHeader, offset: int = 0) -> COO:
+  """
+  Parses whole entry lines of a coordinate Matrix Market file (0-based indices).
+
+  Args:
+    offset: byte offset of `block` in the file (for error messages).
+  """
+  width = 2 if header.is_pattern else 3
+  try:
+    entries = np.fromstring(block, dtype=np.int64 if header.is_pattern else np.float64, sep=' ')
+  except ValueError:
+    raise MatrixFormatError(
+      f"Malformed entries in bytes {offset}-{offset + len(block)} "
+      "(comment or non-numeric lines among the entries are not supported)"
+    ) from None
+  if entries.size % width != 0:
+    raise MatrixFormatError(f"Malformed entries in bytes {offset}-{offset + len(block)}: {entries.size} values are not a multiple of {width}")
+  if not parsed_all_lines(entries, block, width):
+    raise MatrixFormatError(
+      f"Malformed entries in bytes {offset}-{offset + len(block)} "
+      "(comment or non-numeric lines among the entries are not supported)"
+    )
+  entries = entries.reshape(-1, width)
+  rows = entries[:, 0].astype(np.int64) - 1
+  cols = entries[:, 1].astype(np.int64) - 1
+  vals = entries[:, 2].copy() if width == 3 else None
+  return rows, cols, vals
+
+
+def format_entries(rows: np.ndarray, cols: np.ndarray, vals: Optional[np.ndarray], value_format: bytes) -> bytes:
+  """Formats a chunk of entries as Matrix Market lines (1-based indices), `value_format` being a bytes %-format (e.g., `b'%.17g'`)."""
+  columns = [(rows.astype(np.uint64) + 1).tolist(), (cols.astype(np.uint64) + 1).tolist()]
+  line = b'%d %d\n'
+  if vals is not None:
+    columns.append(vals.tolist())
+    line = b'%d %d ' + value_format + b'\n'
+  return (line * len(rows)) % tuple(itertools.chain.from_iterable(zip(*columns)))
+
+
+def block_boundaries(mm, start: int, end: int, chunk_size: int) -> Iterator[Tuple[int, int]]:
+  """Splits the byte range [start, end) of `mm` into blocks of about `chunk_size` bytes ending on a newline."""
+  while start < end:
+    stop = min(start + chunk_size, end)
+    if stop < end:
+      newline = mm.find(b'\n', stop - 1, end)
+      stop = end if newline < 0 else newline + 1
+    yield start, stop
+    start = stop
+
+
+def data_range(mm, header: MtxHeader) -> Tuple[int, int]:
+  """Returns the byte range of the entries, without trailing whitespace."""
+  end = len(mm)
+  while end > header.data_offset and mm[end - 1:end] in (b'\n', b'\r', b' ', b'\t'):
+    end -= 1
+  return header.data_offset, end
+
+
+def check_coordinate(path: Path, header: MtxHeader):
+  if header.format != 'coordinate':
+    raise MatrixFormatError(f"Only coordinate Matrix Market files are supported ('{path}' is {header.format})")
+  if header.field == 'complex':
+    raise MatrixFormatError(f"Complex matrices are not supported ('{path}')")
+
+
+def iter_coo_chunks(path: Path, header: Optional[MtxHeader] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[COO]:
+  """
+  Parses the entries of a coordinate Matrix Market file in blocks of about `chunk_size` bytes.
+
+  Yields:
+    (rows, cols, vals): 0-based int64 indices and float64 values (None for pattern matrices).
+  """
+  header = header or read_header(path)
+  check_coordinate(path, header)
+
+  with open(path, 'rb') as f:
+    size = f.seek(0, 2)
+    if size <= header.data_offset:
+      return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      for start, stop in block_boundaries(mm, header.data_offset, size, chunk_size):
+        yield parse_block(mm[start:stop], header, start)
+
+
+# ----------------------------------------------------------------------------------------------
+# Parallel parsing
+#
+# The entries are split into newline-aligned shards. A first pass counts the lines of each shard
+# (cheap), which gives every shard its offset in the output arrays; a second pass parses the
+# shards in worker processes, which write their entries straight into the outputs: shared memory
+# segments (`read_coo`) or the memory-mapped output file (BMTX conversion). Nothing but offsets
+# and counts goes through the pool's pipes.
+# ----------------------------------------------------------------------------------------------
+
+@dataclass
+class ArrayTarget:
+  """A 1-D array that worker processes can attach to: a shared memory segment or a region of a file."""
+  dtype: str
+  length: int
+  shm_name: Optional[str] = None
+  file_path: Optional[Path] = None
+  offset: int = 0  # Byte offset of the array in the file / segment
+  mode: str = 'r+'  # Access mode of file arrays
+
+  def attach(self) -> Tuple[np.ndarray, Optional[shared_memory.SharedMemory]]:
+    if self.shm_name is not None:
+      shm = shared_memory.SharedMemory(name=self.shm_name)
+      return np.ndarray((self.length,), dtype=self.dtype, buffer=shm.buf, offset=self.offset), shm
+    return np.memmap(self.file_path, dtype=self.dtype, mode=self.mode, offset=self.offset, shape=(self.length,)), None
+
+
+def default_workers() -> int:
+  """Number of CPUs usable by this process."""
+  try:
+    return len(os.sched_getaffinity(0))
+  except AttributeError:
+    return os.cpu_count() or 1
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+# Pools replaced by a larger one: callers may still be submitting to them, so they are never shut
+# down (their idle processes exit with the interpreter)
+_retired_pools: List[ProcessPoolExecutor] = []
+_pool_lock = threading.Lock()
+
+def configure_process_pool(workers: int):
+  """
+  Sizes the shared process pool for `workers` processes before anything uses it. The sync sizes it
+  for the largest of its parse and generator jobs, so that the pool is never replaced while in use.
+  """
+  get_process_pool(workers)
+
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+  """
+  Returns the process pool shared by all parsers of this process (so that concurrent conversions
+  do not oversubscribe the CPUs). Processes are started on demand.
+
+  If more workers are requested than the pool has, a larger pool replaces it for the next callers;
+  the old one stays usable by the callers that already got it.
+  """
+  global _pool, _pool_workers
+  with _pool_lock:
+    if _pool is None or workers > _pool_workers:
+      if _pool is not None:
+        _retired_pools.append(_pool)
+      # Forking a multi-threaded process (the sync scheduler) is not safe: use a fork server
+      methods = multiprocessing.get_all_start_methods()
+      context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+      _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+      _pool_workers = workers
+    return _pool
+
+
+def _count_entries(path: Path, start: int, stop: int) -> int:
+  with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+    block = mm[start:stop]
+  return block.count(b'\n') + (0 if block.endswith(b'\n') else 1)
+
+
+def _parse_shard(path: Path, header: MtxHeader, start: int, stop: int, offset: int, count: int, targets: List[Optional[ArrayTarget]]):
+  with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+    entries = parse_block(mm[start:stop], header, start)
+  if len(entries[0]) != count:
+    raise MatrixFormatError(
+      f"Bytes {start}-{stop} of '{path}' hold {len(entries[0])} entries in {count} lines "
+      "(blank or comment lines among the entries are not supported by the parallel parser)"
+    )
+  for target, values in zip(targets, entries):
+    if target is None or values is None:
+      continue
+    array, shm = target.attach()
+    array[offset:offset + count] = values
+    if isinstance(array, np.memmap):
+      array.flush()
+    del array
+    if shm is not None:
+      shm.close()
+
+
+def parse_parallel(path: Path, header: MtxHeader, targets: List[Optional[ArrayTarget]], workers: int, chunk_size: int = CHUNK_SIZE):
+  """
+  Parses the entries of `path` with `workers` processes into `targets` (rows, cols, vals),
+  which must hold `header.nnz` elements each (vals is None for pattern matrices).
+
+  Raises:
+    MatrixFormatError: if the number of entries differs from the declared one.
+  """
+  check_coordinate(path, header)
+  with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+    start, end = data_range(mm, header)
+    shard_size = max(1024 * 1024, min(chunk_size, -(-(end - start) // (workers * SHARDS_PER_WORKER))))
+    shards = list(block_boundaries(mm, start, end, shard_size))
+
+  pool = get_process_pool(workers)
+  counts = list(pool.map(_count_entries, [path] * len(shards), *zip(*shards)) if shards else [])
+  if sum(counts) != header.nnz:
+    raise MatrixFormatError(f"'{path}' has {sum(counts)} entry lines, {header.nnz} declared")
+
+  futures = []
+  offset = 0
+  for (shard_start, shard_stop), count in zip(shards, counts):
+    futures.append(pool.submit(_parse_shard, path, header, shard_start, shard_stop, offset, count, targets))
+    offset += count
+  try:
+    for future in futures:
+      future.result()
+  finally:
+    for future in futures:
+      future.cancel()
+
+
+@dataclass
+class CooMatrix:
+  """
+  Entries of a coordinate Matrix Market file: 0-based int64 indices and float64 values (None for
+  pattern matrices). Arrays may live in shared memory: use as a context manager (or call `close`),
+  and do not keep references to them (or views of them) after closing.
+  """
+  header: MtxHeader
+  rows: np.ndarray
+  cols: np.ndarray
+  vals: Optional[np.ndarray]
+  _segments: List[shared_memory.SharedMemory] = field(default_factory=list, repr=False)
+
+  def close(self):
+    self.rows = self.cols = self.vals = None
+    for shm in self._segments:
+      shm.close()
+      shm.unlink()
+    self._segments = []
+
+  def __enter__(self) -> 'CooMatrix':
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+def use_parallel(path: Path, header: MtxHeader, workers: int) -> bool:
+  return workers > 1 and Path(path).stat().st_size - header.data_offset >= PARALLEL_MIN_SIZE
+
+
+def read_coo(path: Path, workers: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> CooMatrix:
+  """
+  Reads all the entries of a coordinate Matrix Market file.
+
+  Large files are parsed by `workers` processes (default: all the usable CPUs) into shared memory.
+
+  Raises:
+    MatrixFormatError: if the file is malformed or its number of entries differs from the declared one.
+  """
+  header = read_header(path)
+  check_coordinate(path, header)
+  workers = workers or default_workers()
+
+  if not use_parallel(path, header, workers):
+    chunks = list(iter_coo_chunks(path, header, chunk_size))
+    rows = np.concatenate([c[0] for c in chunks]) if chunks else np.empty(0, np.int64)
+    cols = np.concatenate([c[1] for c in chunks]) if chunks else np.empty(0, np.int64)
+    vals = None if header.is_pattern else (np.concatenate([c[2] for c in chunks]) if chunks else np.empty(0, np.float64))
+    if len(rows) != header.nnz:
+      raise MatrixFormatError(f"'{path}' has {len(rows)} entries, {header.nnz} declared")
+    return CooMatrix(header, rows, cols, vals)
+
+  dtypes = [np.dtype(np.int64), np.dtype(np.int64)] + ([] if header.is_pattern else [np.dtype(np.float64)])
+  coo = CooMatrix(header, None, None, None)
+  try:
+    for dtype in dtypes:
+      coo._segments.append(shared_memory.SharedMemory(create=True, size=max(1, header.nnz * dtype.itemsize)))
+    targets = [ArrayTarget(dtype.str, header.nnz, shm_name=shm.name) for dtype, shm in zip(dtypes, coo._segments)]
+    parse_parallel(path, header, targets + [None] * (3 - len(targets)), workers, chunk_size)
+  except BaseException:
+    coo.close()
+    raise
+  arrays = [np.ndarray((header.nnz,), dtype=dtype, buffer=shm.buf) for dtype, shm in zip(dtypes, coo._segments)]
+  coo.rows, coo.cols = arrays[0], arrays[1]
+  coo.vals = arrays[2] if len(arrays) == 3 else None
+  return coo
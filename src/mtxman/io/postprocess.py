@@ -0,0 +1,331 @@
+"""
+Out-of-core post-processing of `.mtx` and `.bmtx` files: drop self loops, symmetrize, sort and
+dedup matrices larger than the available memory.
+
+Entries are streamed in chunks; self loops are dropped and mirrored entries added on the fly.
+To sort (and dedup), entries are packed into uint64 keys (row << col_bits | col) and sorted in
+runs of at most `memory_limit` bytes, which are spilled to disk and then k-way merged (in several
+passes if there are more than MAX_FANIN runs). Duplicates are adjacent once sorted: only the first
+entry of each (row, col) is kept (entries of the file come before the mirrored ones).
+
+The result replaces the input file atomically, in the same format.
+"""
+import shutil
+import tempfile
+from contextlib import ExitStack
+from enum import Enum
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+
+from mtxman.exceptions import MatrixFormatError
+from mtxman.io import bmtx, mtx
+from mtxman.io.atomic import atomic_write
+
+# Maximum number of runs merged at once
+MAX_FANIN = 64
+# Smallest run / merge block (in entries)
+MIN_BLOCK = 4096
+
+Sink = Callable[[np.ndarray, Optional[np.ndarray]], None]
+
+
+class PostProcess(str, Enum):
+  """Post-processing operations, always applied in this order (whatever the configured order)."""
+  DROP_SELF_LOOPS = 'drop_self_loops'
+  SYMMETRIZE = 'symmetrize'  # Adds the mirrored entries: symmetric matrices are expanded to general ones
+  SORT = 'sort'              # By row, then by column
+  DEDUP = 'dedup'            # Keeps the first entry of each (row, col); the result is sorted
+
+
+def parse_postprocess(values: Optional[Iterable[str]]) -> List[PostProcess]:
+  """Parses a configured `postprocess:` list (raises ValueError on unknown operations)."""
+  if values is None:
+    return []
+  if isinstance(values, str):
+    values = [values]
+  ops = {PostProcess(value) for value in values}
+  return [op for op in PostProcess if op in ops]
+
+
+def describe(ops: Iterable[PostProcess]) -> str:
+  return ','.join(op.value for op in ops)
+
+
+class _Matrix:
+  """Header information of the input file, and the packing of its entries into keys."""
+
+  def __init__(self, path: Path):
+    self.path = path
+    self.is_bmtx = path.suffix == '.bmtx'
+    if self.is_bmtx:
+      self.bmtx_header, _ = bmtx.read_header(path)
+      header = self.bmtx_header
+      self.value_dtype = header.value_dtype if header.value_bytes else None
+      self.comments = []
+    else:
+      header = mtx.read_header(path)
+      self.value_dtype = None if header.is_pattern else np.dtype(np.float64)
+      with open(path, 'rb') as f:
+        f.readline()
+        self.comments = [line for line in f.read(header.data_offset - f.tell()).splitlines(keepends=True) if line.startswith(b'%')]
+    self.field = header.field
+    self.symmetry = header.symmetry
+    self.nrows, self.ncols = header.nrows, header.ncols
+    self.col_bits = max(1, (self.ncols - 1).bit_length())
+    if max(1, (self.nrows - 1).bit_length()) + self.col_bits > 64:
+      raise MatrixFormatError(f"'{path}' is too large to pack its entries into 64-bit keys")
+
+  @property
+  def entry_bytes(self) -> int:
+    return 8 + (self.value_dtype.itemsize if self.value_dtype is not None else 0)
+
+  def chunks(self, chunk_entries: int) -> Iterator[mtx.COO]:
+    if self.is_bmtx:
+      return bmtx.iter_coo_chunks(self.path, chunk_entries)
+    return mtx.iter_coo_chunks(self.path, chunk_size=chunk_entries * 24)
+
+  def pack(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    return (rows.astype(np.uint64) << np.uint64(self.col_bits)) | cols.astype(np.uint64)
+
+  def unpack(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return keys >> np.uint64(self.col_bits), keys & np.uint64((1 << self.col_bits) - 1)
+
+
+def _transform(matrix: _Matrix, ops: List[PostProcess], rows: np.ndarray, cols: np.ndarray, vals: Optional[np.ndarray]) -> List[mtx.COO]:
+  """Returns the entries of a chunk, followed (if symmetrizing) by their mirrored entries."""
+  if PostProcess.DROP_SELF_LOOPS in ops:
+    keep = rows != cols
+    rows, cols, vals = rows[keep], cols[keep], (vals[keep] if vals is not None else None)
+  parts = [(rows, cols, vals)]
+  if PostProcess.SYMMETRIZE in ops:
+    off_diagonal = rows != cols
+    mirrored_vals = None
+    if vals is not None:
+      mirrored_vals = -vals[off_diagonal] if matrix.symmetry == 'skew-symmetric' else vals[off_diagonal]
+    parts.append((cols[off_diagonal], rows[off_diagonal], mirrored_vals))
+  return parts
+
+
+def _concat(parts: List[Tuple[np.ndarray, Optional[np.ndarray]]]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+  keys = np.concatenate([p[0] for p in parts])
+  return keys, (np.concatenate([p[1] for p in parts]) if parts[0][1] is not None else None)
+
+
+# Runs ------------------------------------------------------------------------------------------
+
+class _Run:
+  """A sorted run spilled to disk: keys (and values) in two raw files."""
+
+  def __init__(self, directory: Path, index: int, value_dtype: Optional[np.dtype]):
+    self.keys_path = directory / f'run{index}.keys'
+    self.vals_path = directory / f'run{index}.vals' if value_dtype is not None else None
+    self.value_dtype = value_dtype
+
+  def write(self, keys: np.ndarray, vals: Optional[np.ndarray]):
+    with open(self.keys_path, 'ab') as f:
+      keys.tofile(f)
+    if self.vals_path is not None:
+      with open(self.vals_path, 'ab') as f:
+        vals.astype(self.value_dtype, copy=False).tofile(f)
+
+  def reader(self, stack: ExitStack, block_entries: int) -> Iterator[Tuple[np.ndarray, Optional[np.ndarray]]]:
+    keys_file = stack.enter_context(open(self.keys_path, 'rb'))
+    vals_file = stack.enter_context(open(self.vals_path, 'rb')) if self.vals_path is not None else None
+    while True:
+      keys = np.fromfile(keys_file, dtype=np.uint64, count=block_entries)
+      if keys.size == 0:
+        return
+      yield keys, (np.fromfile(vals_file, dtype=self.value_dtype, count=keys.size) if vals_file is not None else None)
+
+  def remove(self):
+    self.keys_path.unlink(missing_ok=True)
+    if self.vals_path is not None:
+      self.vals_path.unlink(missing_ok=True)
+
+
+def _sort_entries(keys: np.ndarray, vals: Optional[np.ndarray]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+  if vals is None:
+    return np.sort(keys, kind='stable'), None
+  order = np.argsort(keys, kind='stable')
+  return keys[order], vals[order]
+
+
+def _merge(runs: List[_Run], block_entries: int, sink: Sink):
+  """
+  Merges sorted runs into `sink`, in sorted batches. Each round outputs the buffered entries up to
+  the smallest (last key, run) of the runs' buffers: no unread entry can precede them. Equal keys
+  keep the order of the runs, so the merge is stable.
+  """
+  with ExitStack() as stack:
+    readers = [run.reader(stack, block_entries) for run in runs]
+    buffers: List[Optional[Tuple[np.ndarray, Optional[np.ndarray]]]] = [next(reader, None) for reader in readers]
+    while any(buffer is not None for buffer in buffers):
+      bound, bound_run = min((buffer[0][-1], i) for i, buffer in enumerate(buffers) if buffer is not None)
+      keys, vals = [], []
+      for i, buffer in enumerate(buffers):
+        if buffer is None:
+          continue
+        # Later runs may have more entries equal to the bound in their unread blocks
+        split = int(np.searchsorted(buffer[0], bound, side='right' if i <= bound_run else 'left'))
+        keys.append(buffer[0][:split])
+        vals.append(buffer[1][:split] if buffer[1] is not None else None)
+        if split == len(buffer[0]):
+          buffers[i] = next(readers[i], None)
+        else:
+          buffers[i] = (buffer[0][split:], buffer[1][split:] if buffer[1] is not None else None)
+      batch_vals = np.concatenate(vals) if vals[0] is not None else None
+      sink(*_sort_entries(np.concatenate(keys), batch_vals))
+
+
+def _external_sort(matrix: _Matrix, ops: List[PostProcess], memory_limit: int, directory: Path, sink: Sink):
+  # Sorting a run needs about twice its size (keys and values are gathered through a permutation)
+  run_entries = max(MIN_BLOCK, memory_limit // (3 * matrix.entry_bytes))
+  # Mirrored entries (symmetrize) have their own runs, merged after the others: dedup keeps the original entries
+  runs: List[List[_Run]] = [[], []]
+  pending: List[List[Tuple[np.ndarray, Optional[np.ndarray]]]] = [[], []]
+  next_index = 0
+
+  def spill(stream: int):
+    nonlocal next_index
+    keys, vals = _concat(pending[stream])
+    pending[stream] = []
+    keys, vals = _sort_entries(keys, vals)
+    run = _Run(directory, next_index, matrix.value_dtype)
+    next_index += 1
+    run.write(keys, vals)
+    runs[stream].append(run)
+
+  for chunk in matrix.chunks(max(MIN_BLOCK, run_entries // 4)):
+    for stream, (rows, cols, vals) in enumerate(_transform(matrix, ops, *chunk)):
+      pending[stream].append((matrix.pack(rows, cols), vals.astype(matrix.value_dtype, copy=False) if vals is not None else None))
+    if sum(len(part[0]) for parts in pending for part in parts) >= run_entries:
+      for stream in (0, 1):
+        if pending[stream]:
+          spill(stream)
+
+  if not runs[0] and not runs[1]:
+    # Everything fits in memory: no spill files
+    if pending[0]:
+      sink(*_sort_entries(*_concat(pending[0] + pending[1])))
+    return
+  for stream in (0, 1):
+    if pending[stream]:
+      spill(stream)
+
+  # Merge passes until at most MAX_FANIN runs are left (groups of consecutive runs keep the merge stable)
+  runs = runs[0] + runs[1]
+  while len(runs) > MAX_FANIN:
+    merged_runs = []
+    for start in range(0, len(runs), MAX_FANIN):
+      group = runs[start:start + MAX_FANIN]
+      merged = _Run(directory, next_index, matrix.value_dtype)
+      next_index += 1
+      _merge(group, max(MIN_BLOCK, run_entries // (2 * len(group))), merged.write)
+      for run in group:
+        run.remove()
+      merged_runs.append(merged)
+    runs = merged_runs
+  _merge(runs, max(MIN_BLOCK, run_entries // (2 * len(runs))), sink)
+
+
+# Output ----------------------------------------------------------------------------------------
+
+class _Output:
+  """Writes the entries to body files, then assembles the header and the bodies into the destination."""
+
+  def __init__(self, matrix: _Matrix, ops: List[PostProcess], directory: Path):
+    self.matrix = matrix
+    self.ops = ops
+    self.symmetry = 'general' if PostProcess.SYMMETRIZE in ops else matrix.symmetry
+    self.nnz = 0
+    self._last_key: Optional[int] = None
+    self._dedup = PostProcess.DEDUP in ops
+    names = ['rows', 'cols', 'vals'] if matrix.is_bmtx else ['entries']
+    self._paths = [directory / f'output.{name}' for name in names]
+    self._files: List[BinaryIO] = [open(path, 'wb') for path in self._paths]
+    if matrix.is_bmtx:
+      source = matrix.bmtx_header
+      self.header = bmtx.BmtxHeader(source.field, self.symmetry, source.nrows, source.ncols, 0, source.index_bytes, source.value_bytes)
+
+  def write_keys(self, keys: np.ndarray, vals: Optional[np.ndarray]):
+    if self._dedup and keys.size:
+      first = np.empty(keys.size, dtype=bool)
+      first[0] = self._last_key is None or keys[0] != self._last_key
+      np.not_equal(keys[1:], keys[:-1], out=first[1:])
+      self._last_key = keys[-1]
+      keys, vals = keys[first], (vals[first] if vals is not None else None)
+    self.write(*self.matrix.unpack(keys), vals)
+
+  def write(self, rows: np.ndarray, cols: np.ndarray, vals: Optional[np.ndarray]):
+    self.nnz += len(rows)
+    if self.matrix.is_bmtx:
+      rows.astype(self.header.index_dtype).tofile(self._files[0])
+      cols.astype(self.header.index_dtype).tofile(self._files[1])
+      if vals is not None:
+        vals.astype(self.header.value_dtype).tofile(self._files[2])
+      return
+    rows, cols = (rows + 1).tolist(), (cols + 1).tolist()
+    if vals is None:
+      lines = [f'{r} {c}' for r, c in zip(rows, cols)]
+    elif self.matrix.field == 'integer':
+      lines = [f'{r} {c} {v}' for r, c, v in zip(rows, cols, vals.astype(np.int64).tolist())]
+    else:
+      lines = [f'{r} {c} {v!r}' for r, c, v in zip(rows, cols, vals.tolist())]
+    if lines:
+      self._files[0].write(('\n'.join(lines) + '\n').encode())
+
+  def commit(self):
+    for f in self._files:
+      f.close()
+    matrix = self.matrix
+    with atomic_write(matrix.path) as dst:
+      if matrix.is_bmtx:
+        self.header.nnz = self.nnz
+        dst.write(self.header.encode())
+      else:
+        dst.write(f'%%MatrixMarket matrix coordinate {matrix.field} {self.symmetry}\n'.encode())
+        dst.writelines(matrix.comments)
+        dst.write(f'% Post-processed with MtxMan: {describe(self.ops)}\n'.encode())
+        dst.write(f'{matrix.nrows} {matrix.ncols} {self.nnz}\n'.encode())
+      for path in self._paths:
+        with open(path, 'rb') as src:
+          shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+
+  def close(self):
+    for f in self._files:
+      f.close()
+
+
+def postprocess_matrix(path: Path, ops: Iterable[PostProcess], memory_limit: int, spill_dir: Optional[Path] = None) -> int:
+  """
+  Applies `ops` to the `.mtx` or `.bmtx` file at `path` (in place, atomically), using about
+  `memory_limit` bytes of memory. Spill files go to a temporary folder in `spill_dir` (default:
+  the folder of `path`).
+
+  Returns:
+    int: number of entries of the result.
+
+  Raises:
+    MatrixFormatError: if the matrix cannot be post-processed (e.g., symmetrizing a rectangular matrix).
+  """
+  ops = [op for op in PostProcess if op in set(ops)]
+  matrix = _Matrix(path)
+  if PostProcess.SYMMETRIZE in ops and matrix.nrows != matrix.ncols:
+    raise MatrixFormatError(f"'{path}' is not square ({matrix.nrows} x {matrix.ncols}), it cannot be symmetrized")
+  if matrix.symmetry == 'hermitian' and PostProcess.SYMMETRIZE in ops:
+    raise MatrixFormatError(f"Hermitian matrices are not supported ('{path}')")
+
+  with tempfile.TemporaryDirectory(prefix='.mtxman-postprocess-', dir=spill_dir or path.parent) as directory:
+    output = _Output(matrix, ops, Path(directory))
+    try:
+      if PostProcess.SORT in ops or PostProcess.DEDUP in ops:
+        _external_sort(matrix, ops, memory_limit, Path(directory), output.write_keys)
+      else:
+        for chunk in matrix.chunks(max(MIN_BLOCK, memory_limit // (4 * matrix.entry_bytes))):
+          for part in _transform(matrix, ops, *chunk):
+            output.write(*part)
+      output.commit()
+    finally:
+      output.close()
+  return output.nnz
@@ -0,0 +1,314 @@
+"""
+Row-partitioned shards: a matrix split into `parts` files of consecutive rows, one per rank of a
+distributed run, so that each rank only reads its own bytes.
+
+Layout of `<matrix>.shards/` (next to the `.mtx`/`.bmtx` file):
+
+  partition.json                 source file, partition and shards (see `PartitionManifest`)
+  part-00000-of-00004.<ext>      rows [row_start, row_stop) of the matrix, in the source format
+  ...
+
+Shards keep the global indices and dimensions of the matrix (a shard is a valid matrix file with
+the rows of the other ranks empty) and the order of the entries in the source file. Symmetric
+matrices are expanded to general ones: a rank gets every entry of its rows, from both triangles.
+
+Partitions:
+  rows          the same number of rows in every shard
+  nnz-balanced  rows split so that every shard holds about nnz / parts entries
+
+A first pass counts the entries of each row (only the row indices are read), then a single
+streaming pass appends every chunk of entries to the shards. Only O(nrows) integers and one chunk
+of entries are kept in memory.
+"""
+import json
+import os
+import shutil
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import List, Optional, Union
+import numpy as np
+
+from mtxman.enums import Partition
+from mtxman.exceptions import MatrixFormatError
+from mtxman.io import bmtx, compressed, mtx, stats
+from mtxman.io.atomic import commit_dir
+
+SHARDS_SUFFIX = '.shards'
+FORMAT_NAME = 'mtxman-partition'
+FORMAT_VERSION = 1
+MANIFEST_FILENAME = 'partition.json'
+
+
+@dataclass
+class ShardInfo:
+  file: str       # File name, relative to the shards folder
+  row_start: int  # First row (0-based)
+  row_stop: int   # Row after the last one
+  nnz: int
+  size: int       # Bytes
+
+
+@dataclass
+class PartitionManifest:
+  partition: str
+  parts: int
+  nrows: int
+  ncols: int
+  nnz: int                # Entries of all shards (both triangles of symmetric matrices)
+  field: str              # Field of the shards
+  source_symmetry: str    # Symmetry of the source matrix (shards are always general)
+  source_name: str = ''
+  source_size: int = 0
+  source_mtime_ns: int = 0
+  shards: List[ShardInfo] = field(default_factory=list)
+
+  def encode(self) -> str:
+    return json.dumps({'format': FORMAT_NAME, 'version': FORMAT_VERSION, **asdict(self)}, indent=2) + '\n'
+
+  def shard_for_row(self, row: int) -> int:
+    """Rank of the shard holding the (0-based) row."""
+    return int(np.searchsorted([s.row_stop for s in self.shards], row, side='right'))
+
+
+def shards_path_for(matrix_path: Union[Path, str]) -> Path:
+  """Folder of the shards of a `.mtx`, `.bmtx` or compressed file."""
+  return compressed.uncompressed_path(matrix_path).with_suffix(SHARDS_SUFFIX)
+
+
+def shard_filename(rank: int, parts: int, suffix: str) -> str:
+  return f'part-{rank:05d}-of-{parts:05d}{suffix}'
+
+
+def read_manifest(path: Union[Path, str]) -> PartitionManifest:
+  """Reads the manifest of the shards folder `path`."""
+  manifest_path = Path(path) / MANIFEST_FILENAME
+  try:
+    fields = json.loads(manifest_path.read_text())
+  except (OSError, ValueError) as e:
+    raise MatrixFormatError(f"'{path}' is not a shards folder: {e}")
+  if fields.pop('format', None) != FORMAT_NAME or fields.pop('version', None) != FORMAT_VERSION:
+    raise MatrixFormatError(f"'{manifest_path}' is not a supported partition manifest")
+  try:
+    fields['shards'] = [ShardInfo(**s) for s in fields.get('shards', [])]
+    return PartitionManifest(**fields)
+  except TypeError as e:
+    raise MatrixFormatError(f"Invalid partition manifest '{manifest_path}': {e}")
+
+
+def shard_path(path: Union[Path, str], rank: int) -> Path:
+  """
+  Shard file of `rank`, in the shards folder `path` (or the folder of the `.mtx`/`.bmtx` file
+  `path`). The shard is a regular `.mtx`/`.bmtx` file, readable with `mtxman.read_bmtx` & co.
+  """
+  path = Path(path)
+  if path.suffix != SHARDS_SUFFIX and not (path / MANIFEST_FILENAME).is_file():
+    path = shards_path_for(path)
+  manifest = read_manifest(path)
+  if not 0 <= rank < manifest.parts:
+    raise ValueError(f"Rank {rank} out of range: '{path}' has {manifest.parts} shards")
+  return path / manifest.shards[rank].file
+
+
+def is_complete(path: Union[Path, str], source: Optional[Path] = None, parts: Optional[int] = None, partition: Optional[Partition] = None) -> bool:
+  """
+  True if the folder `path` holds complete shards (and, with `source`, if they were written from
+  the current version of that file; with `parts` / `partition`, if they match them).
+  """
+  path = Path(path)
+  try:
+    manifest = read_manifest(path)
+    if len(manifest.shards) != manifest.parts or any((path / s.file).stat().st_size != s.size for s in manifest.shards):
+      return False
+    if parts is not None and manifest.parts != parts:
+      return False
+    if partition is not None and manifest.partition != Partition(partition).value:
+      return False
+    if source is not None:
+      st = Path(source).stat()
+      return manifest.source_size == st.st_size and manifest.source_mtime_ns == st.st_mtime_ns
+  except (OSError, MatrixFormatError):
+    return False
+  return True
+
+
+def row_boundaries(row_nnz: np.ndarray, parts: int, partition: Partition = Partition.NNZ_BALANCED) -> np.ndarray:
+  """
+  Splits the rows into `parts` ranges: returns `parts + 1` increasing row indices, shard k holding
+  rows [bounds[k], bounds[k + 1]). With `nnz-balanced`, each bound is the row closest to k * nnz / parts
+  entries (a single row with more entries than that makes some shards larger, others empty).
+  """
+  nrows = len(row_nnz)
+  if Partition(partition) == Partition.ROWS:
+    return np.arange(parts + 1, dtype=np.int64) * nrows // parts
+  before = np.zeros(nrows + 1, dtype=np.int64)  # Entries before each row
+  np.cumsum(row_nnz, out=before[1:])
+  targets = np.arange(1, parts, dtype=np.float64) * (before[-1] / parts)
+  bounds = np.searchsorted(before, targets, side='left')
+  # Take the previous row when it is closer to the target
+  previous = np.maximum(bounds - 1, 0)
+  bounds = np.where(targets - before[previous] < before[bounds] - targets, previous, bounds)
+  bounds = np.maximum.accumulate(np.concatenate(([0], bounds, [nrows])))
+  return bounds.astype(np.int64)
+
+
+class _BmtxShard:
+  """A preallocated BMTX shard, filled in order."""
+
+  def __init__(self, path: Path, header: bmtx.BmtxHeader):
+    encoded = header.encode()
+    self.header = header
+    self.offsets = [len(encoded), len(encoded) + header.nnz * header.index_bytes, len(encoded) + 2 * header.nnz * header.index_bytes]
+    self.f = open(path, 'wb')
+    self.f.write(encoded)
+    self.f.truncate(len(encoded) + header.data_size())
+    self.pos = 0
+
+  def write(self, rows: np.ndarray, cols: np.ndarray, vals: Optional[np.ndarray]):
+    h = self.header
+    sections = [(rows, h.index_dtype, h.index_bytes), (cols, h.index_dtype, h.index_bytes)]
+    if vals is not None:
+      sections.append((vals, h.value_dtype, h.value_bytes))
+    for offset, (array, dtype, size) in zip(self.offsets, sections):
+      self.f.seek(offset + self.pos * size)
+      self.f.write(array.astype(dtype, copy=False).tobytes())
+    self.pos += len(rows)
+
+  def close(self):
+    self.f.flush()
+    os.fsync(self.f.fileno())
+    self.f.close()
+
+
+class _MtxShard:
+  """A Matrix Market shard, written in order."""
+
+  def __init__(self, path: Path, banner: str, nrows: int, ncols: int, nnz: int, value_format: bytes):
+    self.f = open(path, 'wb')
+    self.f.write(f'{banner}\n% Shard written by MtxMan.\n{nrows} {ncols} {nnz}\n'.encode('ascii'))
+    self.value_format = value_format
+    self.pos = 0
+
+  def write(self, rows: np.ndarray, cols: np.ndarray, vals: Optional[np.ndarray]):
+    self.f.write(mtx.format_entries(rows, cols, vals, self.value_format))
+    self.pos += len(rows)
+
+  def close(self):
+    self.f.flush()
+    os.fsync(self.f.fileno())
+    self.f.close()
+
+
+def shard_matrix(
+  path: Union[Path, str],
+  parts: int,
+  partition: Partition = Partition.NNZ_BALANCED,
+  dest: Optional[Path] = None,
+  memory_limit: int = 1 << 30,
+) -> PartitionManifest:
+  """
+  Splits the `.mtx` or `.bmtx` (or compressed) file at `path` into `parts` row shards in the same
+  format, in a folder (default: `shards_path_for(path)`) built next to `dest` and renamed once
+  complete. Uses about `memory_limit` bytes of memory (plus O(nrows) integers).
+
+  Raises:
+    MatrixFormatError: if the matrix cannot be sharded (e.g., a Hermitian matrix).
+  """
+  path = Path(path)
+  if parts < 1:
+    raise ValueError(f'The number of shards must be positive (got {parts})')
+  partition = Partition(partition)
+  dest = Path(dest) if dest is not None else shards_path_for(path)
+  info = stats.read_info(path)
+  value_dtype = stats.stored_value_dtype(path)
+  chunk_size = max(1 << 22, memory_limit // 8)
+
+  # Pass 1: entries of each row
+  row_nnz = np.zeros(info.nrows, dtype=np.int64)
+  for rows, _, _ in stats.iter_full_entries(path, chunk_size):
+    row_nnz += np.bincount(rows, minlength=info.nrows)
+  bounds = row_boundaries(row_nnz, parts, partition)
+  before = np.concatenate(([0], np.cumsum(row_nnz)))
+  shard_nnz = np.diff(before[bounds])
+  del row_nnz, before
+
+  suffix = compressed.uncompressed_path(path).suffix
+  st = path.stat()
+  manifest = PartitionManifest(
+    partition=partition.value,
+    parts=parts,
+    nrows=info.nrows,
+    ncols=info.ncols,
+    nnz=int(shard_nnz.sum()),
+    field=info.field,
+    source_symmetry=info.symmetry,
+    source_name=path.name,
+    source_size=st.st_size,
+    source_mtime_ns=st.st_mtime_ns,
+  )
+
+  tmp_dir = dest.with_name(dest.name + '.tmp')
+  if tmp_dir.exists():
+    shutil.rmtree(tmp_dir)
+  tmp_dir.mkdir(parents=True)
+  shards = []
+  try:
+    for rank in range(parts):
+      shard_file = tmp_dir / shard_filename(rank, parts, suffix)
+      nnz = int(shard_nnz[rank])
+      if suffix == '.bmtx':
+        header = bmtx.BmtxHeader(
+          field='pattern' if value_dtype is None else 'real',
+          symmetry='general',
+          nrows=info.nrows,
+          ncols=info.ncols,
+          nnz=nnz,
+          index_bytes=4 if max(info.nrows, info.ncols) <= 2 ** 32 else 8,
+          value_bytes=value_dtype.itemsize if value_dtype is not None else 0,
+        )
+        shards.append(_BmtxShard(shard_file, header))
+      else:
+        value_format = b'%d' if info.field == 'integer' else b'%.17g'
+        banner = f'%%MatrixMarket matrix coordinate {info.field} general'
+        shards.append(_MtxShard(shard_file, banner, info.nrows, info.ncols, nnz, value_format))
+
+    # Pass 2: append the entries of each chunk to their shards
+    for rows, cols, vals in stats.iter_full_entries(path, chunk_size, value_dtype):
+      if len(rows) == 0:
+        continue
+      ranks = np.searchsorted(bounds[1:], rows, side='right')
+      order = np.argsort(ranks, kind='stable')
+      splits = np.cumsum(np.bincount(ranks, minlength=parts))
+      rows, cols = rows[order], cols[order]
+      vals = vals[order] if vals is not None else None
+      start = 0
+      for rank, stop in enumerate(splits.tolist()):
+        if stop > start:
+          if shards[rank].pos + stop - start > shard_nnz[rank]:
+            raise MatrixFormatError(f"The entries of '{path}' changed while it was being sharded")
+          shards[rank].write(rows[start:stop], cols[start:stop], vals[start:stop] if vals is not None else None)
+        start = stop
+
+    for rank, shard in enumerate(shards):
+      if shard.pos != shard_nnz[rank]:
+        raise MatrixFormatError(f"The entries of '{path}' changed while it was being sharded")
+      shard.close()
+      shard_file = tmp_dir / shard_filename(rank, parts, suffix)
+      manifest.shards.append(ShardInfo(
+        file=shard_file.name,
+        row_start=int(bounds[rank]),
+        row_stop=int(bounds[rank + 1]),
+        nnz=int(shard_nnz[rank]),
+        size=shard_file.stat().st_size,
+      ))
+    with open(tmp_dir / MANIFEST_FILENAME, 'w') as f:
+      f.write(manifest.encode())
+      f.flush()
+      os.fsync(f.fileno())
+    commit_dir(tmp_dir, dest)
+  finally:
+    for shard in shards:
+      if not shard.f.closed:
+        shard.f.close()
+    if tmp_dir.exists():
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+  return manifest
@@ -0,0 +1,199 @@
+"""
+Matrix properties for the metadata CSV: sizes from the file header (constant time), and optional
+structural statistics computed by streaming the entries once.
+"""
+import mmap
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+import numpy as np
+
+from mtxman.exceptions import MatrixFormatError
+from mtxman.io import bmtx, compressed, mtx
+
+
+@dataclass
+class MatrixInfo:
+  """Properties stored in the header of a `.mtx` or `.bmtx` file."""
+  nrows: int
+  ncols: int
+  nnz: int        # Stored entries (one triangle for symmetric matrices)
+  field: str
+  symmetry: str
+
+  @property
+  def symmetric(self) -> bool:
+    return self.symmetry != 'general'
+
+  @property
+  def sparsity(self) -> float:
+    return self.nnz / (self.nrows * self.ncols) if self.nrows and self.ncols else 0.0
+
+
+@dataclass
+class MatrixStats:
+  """Row statistics of the full matrix (symmetric matrices are expanded)."""
+  empty_rows: int
+  min_row_nnz: int
+  max_row_nnz: int
+  avg_row_nnz: float
+  std_row_nnz: float
+  bandwidth: int                    # max |i - j| over the entries
+  degree_histogram: Dict[int, int]  # Rows with nnz in [k, 2k) (k is a power of 2), or 0 for k = 0
+
+  def histogram_str(self) -> str:
+    return '|'.join(f'{k}:{v}' for k, v in self.degree_histogram.items())
+
+
+def is_bmtx(path: Path) -> bool:
+  return Path(path).suffix == '.bmtx'
+
+
+def read_info(path: Path) -> MatrixInfo:
+  """Reads the matrix sizes from the header of a `.mtx`, `.bmtx` or compressed file (the entries are not read)."""
+  if compressed.is_compressed(path):
+    with compressed.CompressedMatrix(path) as matrix:
+      header = matrix.header
+  elif is_bmtx(path):
+    header, _ = bmtx.read_header(path)
+  else:
+    header = mtx.read_header(path)
+  return MatrixInfo(header.nrows, header.ncols, header.nnz, header.field, header.symmetry)
+
+
+# Number of values on each entry line of a coordinate Matrix Market file
+_ENTRY_WIDTH = {'pattern': 2, 'real': 3, 'integer': 3, 'complex': 4}
+
+
+def check_file(path: Path, deep: bool = False):
+  """
+  Checks that a `.mtx`, `.bmtx` or compressed file is complete, raising `MatrixFormatError` otherwise.
+
+  The default check takes constant time: the size of BMTX files must match their header, the last
+  entry of Matrix Market files must be complete, and the block index of compressed files must match
+  their header. With `deep`, the entries of Matrix Market files are also counted (one pass over the
+  file), and every block of compressed files is decompressed.
+  """
+  if compressed.is_compressed(path):
+    with compressed.CompressedMatrix(path) as matrix:
+      matrix.check()
+      if deep:
+        for i in range(len(matrix.blocks)):
+          matrix.read_block(i)
+    return
+  if is_bmtx(path):
+    header, data_offset = bmtx.read_header(path)
+    size = Path(path).stat().st_size
+    if size != data_offset + header.data_size():
+      raise MatrixFormatError(f"'{path}' has {size} bytes, its header requires {data_offset + header.data_size()}")
+    return
+
+  header = mtx.read_header(path)
+  if header.nnz == 0:
+    return
+  with open(path, 'rb') as f:
+    if f.seek(0, 2) <= header.data_offset:
+      raise MatrixFormatError(f"'{path}' has no entries, its header declares {header.nnz}")
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      start, end = mtx.data_range(mm, header)
+      last_line = mm[max(mm.rfind(b'\n', start, end) + 1, start):end].split()
+      width = _ENTRY_WIDTH.get(header.field, 3) if header.format == 'coordinate' else len(last_line)
+      if len(last_line) != width:
+        raise MatrixFormatError(f"The last entry of '{path}' is incomplete: {b' '.join(last_line)!r}")
+      if deep:
+        entries = sum(
+          mm[block_start:block_stop].count(b'\n')
+          for block_start, block_stop in mtx.block_boundaries(mm, start, end, mtx.CHUNK_SIZE)
+        ) + 1
+        if entries != header.nnz:
+          raise MatrixFormatError(f"'{path}' has {entries} entries, its header declares {header.nnz}")
+
+
+def iter_entries(path: Path, chunk_size: int = mtx.CHUNK_SIZE) -> Iterator[mtx.COO]:
+  """Streams the entries of a `.mtx`, `.bmtx` or compressed file in blocks of about `chunk_size` bytes."""
+  if compressed.is_compressed(path):
+    return _iter_compressed(path)
+  if is_bmtx(path):
+    return bmtx.iter_coo_chunks(path, chunk_size // 24)
+  return mtx.iter_coo_chunks(path, chunk_size=chunk_size)
+
+
+def stored_value_dtype(path: Path) -> Optional[np.dtype]:
+  """
+  Dtype of the values as stored in (or parsed from) a `.mtx`, `.bmtx` or compressed file: float32
+  or float64 for BMTX files, int64 (integer field) or float64 for Matrix Market files, None for
+  pattern matrices.
+  """
+  info = read_info(path)
+  if info.field == 'pattern':
+    return None
+  if compressed.is_compressed(path):
+    with compressed.CompressedMatrix(path) as matrix:
+      if matrix.header.source_format == 'bmtx':
+        return matrix.header.bmtx_header().value_dtype
+  elif is_bmtx(path):
+    return bmtx.read_header(path)[0].value_dtype
+  return np.dtype('<i8') if info.field == 'integer' else np.dtype('<f8')
+
+
+def iter_full_entries(path: Path, chunk_size: int = mtx.CHUNK_SIZE, value_dtype: Optional[np.dtype] = None) -> Iterator[mtx.COO]:
+  """
+  Streams the entries of the full matrix: int64 indices, values cast to `value_dtype` (dropped if
+  None) and, for symmetric matrices, the mirrored entry (j, i) of each off-diagonal entry.
+
+  Raises:
+    MatrixFormatError: for Hermitian matrices.
+  """
+  info = read_info(path)
+  if info.symmetry == 'hermitian':
+    raise MatrixFormatError(f"Hermitian matrices are not supported ('{path}')")
+  for rows, cols, vals in iter_entries(path, chunk_size):
+    rows = rows.astype(np.int64, copy=False)
+    cols = cols.astype(np.int64, copy=False)
+    vals = vals.astype(value_dtype, copy=False) if value_dtype is not None else None
+    if info.symmetric:
+      off = rows != cols
+      if vals is not None:
+        vals = np.concatenate([vals, -vals[off] if info.symmetry == 'skew-symmetric' else vals[off]])
+      rows, cols = np.concatenate([rows, cols[off]]), np.concatenate([cols, rows[off]])
+    yield rows, cols, vals
+
+
+def _iter_compressed(path: Path) -> Iterator[mtx.COO]:
+  with compressed.CompressedMatrix(path) as matrix:
+    yield from matrix.iter_coo_chunks(workers=mtx.default_workers())
+
+
+def compute_stats(path: Path, chunk_size: int = mtx.CHUNK_SIZE) -> MatrixStats:
+  """Streams the entries of a `.mtx`, `.bmtx` or compressed file once, in blocks of about `chunk_size` bytes."""
+  info = read_info(path)
+  row_nnz = np.zeros(info.nrows, dtype=np.int64)
+  bandwidth = 0
+  for rows, cols, _ in iter_entries(path, chunk_size):
+    if len(rows) == 0:
+      continue
+    rows = rows.astype(np.int64, copy=False)
+    cols = cols.astype(np.int64, copy=False)
+    row_nnz += np.bincount(rows, minlength=info.nrows)
+    if info.symmetric:
+      # The mirrored entry (j, i) of each off-diagonal entry is not stored
+      row_nnz += np.bincount(cols[rows != cols], minlength=info.nrows)
+    bandwidth = max(bandwidth, int(np.abs(rows - cols).max()))
+
+  if info.nrows == 0:
+    return MatrixStats(0, 0, 0, 0.0, 0.0, 0, {})
+
+  nonempty = row_nnz[row_nnz > 0]
+  histogram = {0: int(info.nrows - len(nonempty))} if len(nonempty) < info.nrows else {}
+  if len(nonempty):
+    buckets = np.bincount(np.floor(np.log2(nonempty)).astype(np.int64))
+    histogram.update({2 ** int(k): int(v) for k, v in enumerate(buckets) if v})
+  return MatrixStats(
+    empty_rows=int(info.nrows - len(nonempty)),
+    min_row_nnz=int(row_nnz.min()),
+    max_row_nnz=int(row_nnz.max()),
+    avg_row_nnz=float(row_nnz.mean()),
+    std_row_nnz=float(row_nnz.std()),
+    bandwidth=bandwidth,
+    degree_histogram=histogram,
+  )
@@ -0,0 +1,34 @@
+from pathlib import Path
+
+import pytest
+
+# Small Matrix Market files of each kind: (field, symmetry, nrows, ncols, entries)
+MATRICES = {
+  'real': ('real', 'general', 5, 4, [(1, 1, 1.5), (3, 2, -2.25e-3), (5, 4, 1e10), (2, 4, 0.1), (4, 1, -7.0)]),
+  'integer': ('integer', 'general', 3, 6, [(1, 6, 3), (2, 2, -12), (3, 1, 1000000), (1, 1, 0)]),
+  'pattern': ('pattern', 'general', 6, 6, [(1, 2), (2, 3), (6, 1), (4, 4), (3, 6), (5, 2)]),
+  'symmetric': ('real', 'symmetric', 4, 4, [(1, 1, 2.0), (2, 1, -1.0), (3, 2, 0.5), (4, 4, 3.25), (4, 1, 1e-8)]),
+  'duplicates': ('real', 'general', 3, 3, [(2, 2, 1.0), (1, 3, 4.0), (2, 2, 2.5), (3, 1, -1.0), (1, 3, 0.25)]),
+}
+
+# Source matrices and the files distributed_mmio converts them to (see data/dmmio/README.md)
+DMMIO_DATA = Path(__file__).parent / 'data' / 'dmmio'
+DMMIO_MATRICES = sorted(path.stem for path in DMMIO_DATA.glob('*.mtx'))
+
+
+def dmmio_golden(name: str, double_values: bool) -> Path:
+  """`.bmtx` file written by distributed_mmio for `DMMIO_DATA/<name>.mtx` (with `-d` if `double_values`)."""
+  return DMMIO_DATA / f"{name}{'.d' if double_values else ''}.bmtx"
+
+
+def write_mtx(path: Path, field: str, symmetry: str, nrows: int, ncols: int, entries) -> Path:
+  lines = [f'%%MatrixMarket matrix coordinate {field} {symmetry}', '% Test matrix', f'{nrows} {ncols} {len(entries)}']
+  lines += [' '.join(str(x) for x in entry) for entry in entries]
+  path.write_text('\n'.join(lines) + '\n')
+  return path
+
+
+@pytest.fixture(params=sorted(MATRICES))
+def mtx_file(request, tmp_path) -> Path:
+  """A small `.mtx` file of each kind (see `MATRICES`)."""
+  return write_mtx(tmp_path / f'{request.param}.mtx', *MATRICES[request.param])
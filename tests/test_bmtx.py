@@ -0,0 +1,73 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from mtxman.core.core import DatasetManager, Flags
+from mtxman.core.dependencies import MTX_TO_BMTX_CONVERTER
+from mtxman.enums import BmtxConverter
+from mtxman.exceptions import MatrixFormatError
+from mtxman.io import mtx
+from mtxman.io.bmtx import mtx_to_bmtx, read_bmtx
+
+from conftest import DMMIO_DATA, DMMIO_MATRICES, dmmio_golden, write_mtx
+
+
+@pytest.mark.parametrize('double_values', [False, True])
+@pytest.mark.parametrize('name', DMMIO_MATRICES)
+def test_same_bytes_as_distributed_mmio_golden_files(name, tmp_path, double_values):
+  mtx_to_bmtx(DMMIO_DATA / f'{name}.mtx', tmp_path / 'native.bmtx', double_values)
+
+  assert (tmp_path / 'native.bmtx').read_bytes() == dmmio_golden(name, double_values).read_bytes()
+
+
+@pytest.mark.skipif(not MTX_TO_BMTX_CONVERTER.exists(), reason=f'distributed_mmio not built ({MTX_TO_BMTX_CONVERTER})')
+@pytest.mark.parametrize('double_values', [False, True])
+def test_same_bytes_as_distributed_mmio(mtx_file, tmp_path, double_values):
+  dmmio_input = tmp_path / 'dmmio' / mtx_file.name
+  dmmio_input.parent.mkdir()
+  shutil.copy(mtx_file, dmmio_input)
+  subprocess.run([MTX_TO_BMTX_CONVERTER, dmmio_input] + (['-d'] if double_values else []), check=True, stdout=subprocess.DEVNULL)
+
+  mtx_to_bmtx(mtx_file, tmp_path / 'native.bmtx', double_values)
+
+  assert (tmp_path / 'native.bmtx').read_bytes() == dmmio_input.with_suffix('.bmtx').read_bytes()
+
+
+def test_parallel_parser_writes_same_file(mtx_file, tmp_path, monkeypatch):
+  mtx_to_bmtx(mtx_file, tmp_path / 'sequential.bmtx', workers=1)
+  monkeypatch.setattr(mtx, 'PARALLEL_MIN_SIZE', 0)
+  mtx_to_bmtx(mtx_file, tmp_path / 'parallel.bmtx', workers=2)
+
+  assert (tmp_path / 'parallel.bmtx').read_bytes() == (tmp_path / 'sequential.bmtx').read_bytes()
+
+
+def test_entries_keep_source_order(tmp_path):
+  path = write_mtx(tmp_path / 'm.mtx', 'real', 'general', 3, 3, [(3, 1, 0.5), (1, 2, 2.0), (3, 1, 1.0)])
+  mtx_to_bmtx(path, tmp_path / 'm.bmtx')
+  matrix = read_bmtx(tmp_path / 'm.bmtx')
+
+  assert matrix.rows.tolist() == [2, 0, 2]
+  assert matrix.cols.tolist() == [0, 1, 0]
+  assert matrix.vals.dtype == np.float32 and matrix.vals.tolist() == [0.5, 2.0, 1.0]
+
+
+@pytest.mark.parametrize('line', ['% comment among the entries', '1 x 2.0'])
+def test_malformed_entries(tmp_path, line):
+  path = write_mtx(tmp_path / 'm.mtx', 'real', 'general', 2, 2, [(1, 1, 1.0), (2, 2, 2.0)])
+  path.write_text(path.read_text() + line + '\n')
+
+  with pytest.raises(MatrixFormatError, match='bytes'):
+    mtx_to_bmtx(path, tmp_path / 'm.bmtx')
+  assert not (tmp_path / 'm.bmtx').exists()
+
+
+def test_failed_conversion_keeps_mtx(tmp_path):
+  path = write_mtx(tmp_path / 'm.mtx', 'real', 'general', 2, 2, [(1, 1, 1.0), (2, 2, 2.0)])
+  path.write_text(path.read_text() + '1 x 2.0\n')
+  flags = Flags(binary_mtx=True, binary_mtx_double_vals=False, keep_mtx=False, keep_all_files=False, converter=BmtxConverter.NATIVE)
+
+  assert not DatasetManager(tmp_path, 'test').convert_to_bmtx(path, flags, 'm')
+  assert path.exists()
+  assert not path.with_suffix('.bmtx').exists()
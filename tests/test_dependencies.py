@@ -0,0 +1,55 @@
+import io
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mtxman.core import dependencies
+from mtxman.core.dependencies import DependencyManager
+
+URL = 'https://github.com/example/tool'
+
+
+@pytest.fixture
+def deps(tmp_path, monkeypatch):
+  """Dependency folders in `tmp_path`, with a mirror holding the sources of `URL`."""
+  mirror = tmp_path / 'mirror'
+  mirror.mkdir()
+  with tarfile.open(mirror / 'tool-main.tar.gz', 'w:gz') as tar:
+    content = b'int main() { return 0; }\n'
+    info = tarfile.TarInfo('tool-main/main.c')
+    info.size = len(content)
+    tar.addfile(info, io.BytesIO(content))
+  monkeypatch.setattr(dependencies, 'DEPS_DIR', tmp_path / 'deps')
+  monkeypatch.setattr(dependencies, 'DEPS_CACHE_DIR', tmp_path / 'cache')
+  monkeypatch.setattr(dependencies, 'DEPS_MIRROR_DIR', mirror)
+  return tmp_path
+
+
+def _build(root):
+  (root / 'tool').write_text('built\n')
+
+
+def test_install_reuses_cached_build(deps):
+  builds = []
+  commands = [lambda root: builds.append(root) or _build(root)]
+
+  target = DependencyManager.install('tool', URL, build_commands=commands)
+  DependencyManager.install('tool', URL, build_commands=commands, force=True)
+  assert len(builds) == 1
+  DependencyManager.install('tool', URL, build_commands=commands, rebuild=True)
+  assert len(builds) == 2
+  assert (target / 'tool').read_text() == 'built\n'
+
+
+def test_concurrent_installs(deps):
+  def install(i: int):
+    return DependencyManager.install('tool', URL, build_commands=[_build], force=True, rebuild=i % 2 == 0)
+
+  with ThreadPoolExecutor(max_workers=8) as pool:
+    targets = list(pool.map(install, range(16)))
+
+  assert all(target == deps / 'deps' / 'tool' for target in targets)
+  assert (deps / 'deps' / 'tool' / 'tool').read_text() == 'built\n'
+  # No temporary copies are left behind
+  assert sorted(p.name for p in (deps / 'deps').iterdir() if not p.name.startswith('.')) == ['tool']
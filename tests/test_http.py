@@ -0,0 +1,191 @@
+import io
+import os
+import re
+import tarfile
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from mtxman.core import http
+from mtxman.core.archive import extract_tar_stream
+from mtxman.core.http import Downloader
+from mtxman.exceptions import DownloadError
+
+RANGE = re.compile(r'bytes=(\d+)-(\d*)')
+
+
+class _Handler(BaseHTTPRequestHandler):
+  """
+  Serves `server.files` with Range support. `server.faults[path]` lists what goes wrong with the
+  next GET requests of `path`, one per request:
+    'error': 503 response
+    'truncate': full Content-Length, but the connection is closed after half of the body
+    'truncate-unsized': no Content-Length, the connection is closed after half of the body
+  """
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, *args):
+    pass
+
+  def do_HEAD(self):
+    self._respond(body=False)
+
+  def do_GET(self):
+    self._respond(body=True)
+
+  def _respond(self, body: bool):
+    server = self.server
+    data = server.files.get(self.path)
+    server.log.append((self.command, self.path, self.headers.get('Range')))
+    if data is None:
+      self.send_error(404)
+      return
+    faults = server.faults.get(self.path, [])
+    fault = faults.pop(0) if body and faults else None
+    if fault == 'error':
+      self.send_error(503)
+      return
+
+    start, end, status = 0, len(data) - 1, 200
+    match = RANGE.fullmatch(self.headers.get('Range', ''))
+    if match:
+      start = int(match.group(1))
+      end = int(match.group(2)) if match.group(2) else end
+      status = 206
+    payload = data[start:end + 1]
+
+    self.send_response(status)
+    self.send_header('Accept-Ranges', 'bytes')
+    if status == 206:
+      self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+    if fault == 'truncate-unsized':
+      self.send_header('Connection', 'close')
+    else:
+      self.send_header('Content-Length', str(len(payload)))
+    self.end_headers()
+    if not body:
+      return
+    if fault in ('truncate', 'truncate-unsized'):
+      self.wfile.write(payload[:len(payload) // 2])
+      self.wfile.flush()
+      self.close_connection = True
+      return
+    self.wfile.write(payload)
+
+
+@pytest.fixture
+def server():
+  httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+  httpd.files, httpd.faults, httpd.log = {}, {}, []
+  httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}'
+  thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+  thread.start()
+  yield httpd
+  httpd.shutdown()
+  httpd.server_close()
+
+
+@pytest.fixture
+def downloader():
+  return Downloader(retries=3, backoff=0.01, timeout=10)
+
+
+def _gets(server, path):
+  return [r for method, p, r in server.log if method == 'GET' and p == path]
+
+
+def test_download_resumes_interrupted_transfer(server, downloader, tmp_path):
+  data = os.urandom(300_000)
+  server.files['/m.mtx'] = data
+  server.faults['/m.mtx'] = ['truncate']
+
+  stats = downloader.download(f'{server.url}/m.mtx', tmp_path / 'm.mtx')
+
+  assert (tmp_path / 'm.mtx').read_bytes() == data
+  assert not (tmp_path / 'm.mtx.part').exists()
+  ranges = _gets(server, '/m.mtx')
+  assert ranges[0] is None
+  assert ranges[1] == f'bytes={len(data) // 2}-{len(data) - 1}'
+  assert stats.size == len(data)
+
+
+def test_download_resumes_existing_part_file(server, downloader, tmp_path):
+  data = os.urandom(100_000)
+  server.files['/m.mtx'] = data
+  (tmp_path / 'm.mtx.part').write_bytes(data[:40_000])
+
+  stats = downloader.download(f'{server.url}/m.mtx', tmp_path / 'm.mtx')
+
+  assert (tmp_path / 'm.mtx').read_bytes() == data
+  assert _gets(server, '/m.mtx') == [f'bytes=40000-{len(data) - 1}']
+  assert stats.transferred == len(data) - 40_000
+
+
+def test_download_retries_server_errors(server, downloader, tmp_path):
+  data = b'%%MatrixMarket matrix coordinate real general\n1 1 1\n1 1 1.0\n'
+  server.files['/m.mtx'] = data
+  server.faults['/m.mtx'] = ['error', 'error']
+
+  downloader.download(f'{server.url}/m.mtx', tmp_path / 'm.mtx')
+
+  assert (tmp_path / 'm.mtx').read_bytes() == data
+  assert len(_gets(server, '/m.mtx')) == 3
+
+
+def test_download_gives_up_after_retries(server, downloader, tmp_path):
+  server.files['/m.mtx'] = b'x' * 10
+  server.faults['/m.mtx'] = ['error'] * (downloader.retries + 1)
+
+  with pytest.raises(DownloadError):
+    downloader.download(f'{server.url}/m.mtx', tmp_path / 'm.mtx')
+  assert not (tmp_path / 'm.mtx').exists()
+
+
+def test_segmented_download(server, downloader, tmp_path, monkeypatch):
+  monkeypatch.setattr(http, 'SEGMENTED_MIN_SIZE', 1024)
+  data = os.urandom(1_000_003)
+  server.files['/m.mtx'] = data
+  # One of the segments is interrupted and resumed
+  server.faults['/m.mtx'] = ['truncate']
+
+  stats = downloader.download(f'{server.url}/m.mtx', tmp_path / 'm.mtx', connections=4)
+
+  assert (tmp_path / 'm.mtx').read_bytes() == data
+  assert stats.connections == 4
+  assert not (tmp_path / 'm.mtx.part.json').exists()
+  ranges = _gets(server, '/m.mtx')
+  assert len(ranges) == 5 and all(r is not None for r in ranges)
+
+
+def _tarball(members):
+  buffer = io.BytesIO()
+  with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+    for name, content in members.items():
+      info = tarfile.TarInfo(name)
+      info.size = len(content)
+      tar.addfile(info, io.BytesIO(content))
+  return buffer.getvalue()
+
+
+@pytest.mark.parametrize('fault', ['truncate', 'truncate-unsized'])
+def test_stream_retries_truncated_archive(server, downloader, tmp_path, fault):
+  content = os.urandom(200_000)
+  server.files['/m.tar.gz'] = _tarball({'m/README': b'readme', 'm/m.mtx': content})
+  server.faults['/m.tar.gz'] = [fault]
+  select = lambda name: tmp_path / 'm.mtx' if name.endswith('.mtx') else None
+
+  written = downloader.stream(f'{server.url}/m.tar.gz', partial(extract_tar_stream, select=select))
+
+  assert written == [tmp_path / 'm.mtx']
+  assert (tmp_path / 'm.mtx').read_bytes() == content
+  assert len(_gets(server, '/m.tar.gz')) == 2
+
+
+def test_stream_does_not_retry_corrupt_archive(server, downloader, tmp_path):
+  server.files['/m.tar.gz'] = b'not a tarball' * 100
+
+  with pytest.raises(tarfile.TarError):
+    downloader.stream(f'{server.url}/m.tar.gz', partial(extract_tar_stream, select=lambda name: tmp_path / name))
+  assert len(_gets(server, '/m.tar.gz')) == 1
@@ -0,0 +1,34 @@
+import csv
+
+from mtxman.core import metadata
+from mtxman.core.suite_sparse_index import SuiteSparseMatrix
+
+from conftest import MATRICES, write_mtx
+
+
+class _Index:
+  def __init__(self, *matrices: SuiteSparseMatrix):
+    self.matrices = {(m.group, m.name): m for m in matrices}
+
+  def lookup(self, group, name):
+    return self.matrices.get((group, name))
+
+
+def test_suite_sparse_nonzeros_count_both_triangles(tmp_path, monkeypatch):
+  # 5 stored entries, 2 of them on the diagonal: 8 nonzeros in the full matrix
+  for name in ('sym', 'ghost'):
+    (tmp_path / 'cat' / 'SuiteSparse' / 'HB' / name).mkdir(parents=True)
+  path = write_mtx(tmp_path / 'cat' / 'SuiteSparse' / 'HB' / 'sym' / 'sym.mtx', *MATRICES['symmetric'])
+  ghost = write_mtx(tmp_path / 'cat' / 'SuiteSparse' / 'HB' / 'ghost' / 'ghost.mtx', *MATRICES['symmetric'])
+  index = _Index(SuiteSparseMatrix(1, 'HB', 'sym', 4, 4, 8, 'real', False, False, 1.0, 1.0, 'graph'))
+  monkeypatch.setattr(metadata, 'get_index', lambda: index)
+  cache = metadata.MetadataCache
+  monkeypatch.setattr(metadata, 'MetadataCache', lambda: cache(tmp_path / 'cache.sqlite'))
+
+  metadata.export_metadata_csv(tmp_path, [path, ghost], tmp_path / 'metadata.csv')
+
+  with open(tmp_path / 'metadata.csv', newline='') as f:
+    rows = {row['Name']: row for row in csv.DictReader(f)}
+  assert rows['sym']['Nonzeros'] == '8' and rows['sym']['SparsityRatio'] == '0.5000000000'
+  # Missing from the index: the count of the file header
+  assert rows['ghost']['Nonzeros'] == '5' and rows['ghost']['Source'] == 'SuiteSparse'
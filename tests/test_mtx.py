@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from mtxman.exceptions import MatrixFormatError
+from mtxman.generators.parmat import _shift_chunk
+from mtxman.io import mtx
+
+
+def _truncating_fromstring(string, dtype=float, sep=''):
+  """`np.fromstring` of older NumPy releases: stops at the first malformed value instead of raising."""
+  values = []
+  for token in string.split():
+    try:
+      values.append(np.dtype(dtype).type(token))
+    except ValueError:
+      break
+  return np.array(values, dtype=dtype)
+
+
+@pytest.mark.parametrize('line', [b'% comment among the entries', b'1 x 2.0'])
+def test_parse_block_detects_truncated_parse(monkeypatch, line):
+  monkeypatch.setattr(np, 'fromstring', _truncating_fromstring)
+  header = mtx.MtxHeader('coordinate', 'real', 'general', 2, 2, 2, 0)
+
+  with pytest.raises(MatrixFormatError, match='bytes'):
+    mtx.parse_block(b'1 1 1.0\n' + line + b'\n2 2 2.0\n', header)
+  rows, cols, vals = mtx.parse_block(b'1 1 1.0\n\n2 2 2.0', header)
+  assert rows.tolist() == [0, 1] and vals.tolist() == [1.0, 2.0]
+
+
+def test_shift_chunk_detects_truncated_parse(monkeypatch):
+  monkeypatch.setattr(np, 'fromstring', _truncating_fromstring)
+
+  with pytest.raises(ValueError, match='Malformed PaRMAT output'):
+    _shift_chunk(b'0\t1\n# 2\t3\n4\t5\n')
+  assert _shift_chunk(b'0\t1\n4\t5\n') == (b'1 2\n5 6\n', 2)
+
+
+def test_growing_process_pool_keeps_old_pool_usable(monkeypatch):
+  monkeypatch.setattr(mtx, '_pool', None)
+  monkeypatch.setattr(mtx, '_pool_workers', 0)
+  monkeypatch.setattr(mtx, '_retired_pools', [])
+  pool = mtx.get_process_pool(1)
+  future = pool.submit(abs, -1)
+  larger = mtx.get_process_pool(2)
+
+  assert larger is not pool
+  assert future.result() == 1
+  # Callers that got the old pool can keep submitting to it
+  assert pool.submit(abs, -2).result() == 2
+  assert mtx.get_process_pool(2) is larger
+  for executor in (pool, larger):
+    executor.shutdown()
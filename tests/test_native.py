@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from mtxman.core.core import PaRMATMatrix
+from mtxman.generators import native
+from mtxman.io import mtx
+from mtxman.io.bmtx import read_bmtx
+
+
+def _rmat(**kwargs) -> PaRMATMatrix:
+  params = dict(N=64, M=500, a=0.45, b=0.22, c=0.22, noDuplicateEdges=False, undirected=False, noEdgeToSelf=False, sorted=False)
+  return PaRMATMatrix(**{**params, **kwargs})
+
+
+@pytest.mark.parametrize('suffix', ['.mtx', '.bmtx'])
+def test_rmat_options(tmp_path, suffix):
+  matrix = _rmat(noDuplicateEdges=True, undirected=True, noEdgeToSelf=True, sorted=True)
+  path = tmp_path / f'm{suffix}'
+
+  assert native.generate_rmat(matrix, path, workers=1) == matrix.M
+
+  if suffix == '.bmtx':
+    entries = read_bmtx(path)
+    rows, cols = entries.rows.astype(np.int64), entries.cols.astype(np.int64)
+    assert entries.header.symmetry == 'symmetric'
+  else:
+    with mtx.read_coo(path, workers=1) as entries:
+      rows, cols = entries.rows.copy(), entries.cols.copy()
+  assert len(rows) == matrix.M
+  assert np.all(cols < rows)
+  assert len(set(zip(rows.tolist(), cols.tolist()))) == matrix.M
+  assert np.all(np.diff(rows * matrix.N + cols) > 0)
+
+
+@pytest.mark.parametrize('suffix', ['.mtx', '.bmtx'])
+def test_rmat_stops_when_no_new_edge_can_be_drawn(tmp_path, suffix):
+  # Every edge falls in the top-left cell: a single distinct edge exists
+  matrix = _rmat(a=1.0, b=0.0, c=0.0, noDuplicateEdges=True)
+  path = tmp_path / f'm{suffix}'
+
+  assert native.generate_rmat(matrix, path, workers=1) == 1
+
+  if suffix == '.bmtx':
+    entries = read_bmtx(path)
+    assert entries.header.nnz == 1
+    assert (entries.rows.tolist(), entries.cols.tolist()) == ([0], [0])
+  else:
+    assert mtx.read_header(path).nnz == 1
+    with mtx.read_coo(path, workers=1) as entries:
+      assert (entries.rows.tolist(), entries.cols.tolist()) == ([0], [0])
+
+
+def test_output_does_not_depend_on_workers(tmp_path, monkeypatch):
+  # Several stripes (planned in this process)
+  monkeypatch.setattr(native, 'CHUNK_EDGES', 1 << 10)
+  matrix = _rmat(N=1 << 12, M=1 << 14)
+  native.generate_rmat(matrix, tmp_path / 'one.bmtx', workers=1)
+  native.generate_rmat(matrix, tmp_path / 'two.bmtx', workers=2)
+
+  assert (tmp_path / 'one.bmtx').read_bytes() == (tmp_path / 'two.bmtx').read_bytes()
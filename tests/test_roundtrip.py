@@ -0,0 +1,137 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from mtxman.core.core import DatasetManager, Flags
+from mtxman.core.dependencies import MTX_TO_BMTX_CONVERTER
+from mtxman.enums import BmtxConverter, Partition
+from mtxman.io import mtx
+from mtxman.io.bmtx import bmtx_to_mtx, mtx_to_bmtx, read_bmtx, read_header as read_bmtx_header
+from mtxman.io.csr import export_csr, load
+from mtxman.io.shard import read_manifest, shard_matrix, shard_path
+
+from conftest import DMMIO_DATA, DMMIO_MATRICES, dmmio_golden
+
+
+def _coo(path: Path):
+  """(rows, cols, vals) of a `.mtx` or `.bmtx` file, as stored (vals is None for pattern matrices)."""
+  if path.suffix == '.bmtx':
+    matrix = read_bmtx(path, mmap=False)
+    vals = matrix.vals.astype(np.float64) if matrix.vals is not None else None
+    return matrix.rows.astype(np.int64), matrix.cols.astype(np.int64), vals
+  with mtx.read_coo(path, workers=1) as matrix:
+    return matrix.rows.copy(), matrix.cols.copy(), matrix.vals.copy() if matrix.vals is not None else None
+
+
+def _full_entries(path: Path, symmetric: bool):
+  """Sorted (row, col, value) of every entry, both triangles of symmetric matrices included."""
+  rows, cols, vals = _coo(path)
+  vals = vals if vals is not None else np.ones(len(rows))
+  if symmetric:
+    mirror = rows != cols
+    rows, cols, vals = np.concatenate((rows, cols[mirror])), np.concatenate((cols, rows[mirror])), np.concatenate((vals, vals[mirror]))
+  return sorted(zip(rows.tolist(), cols.tolist(), vals.tolist()))
+
+
+@pytest.mark.parametrize('double_values', [False, True])
+def test_mtx_bmtx_mtx(mtx_file, tmp_path, double_values):
+  source = mtx.read_header(mtx_file)
+  bmtx_header = mtx_to_bmtx(mtx_file, tmp_path / 'a.bmtx', double_values)
+  bmtx_to_mtx(tmp_path / 'a.bmtx', tmp_path / 'b.mtx')
+
+  header = mtx.read_header(tmp_path / 'b.mtx')
+  assert (header.nrows, header.ncols, header.nnz, header.symmetry) == (source.nrows, source.ncols, source.nnz, source.symmetry)
+  assert header.field == ('pattern' if source.is_pattern else 'real')
+  rows, cols, vals = _coo(mtx_file)
+  back_rows, back_cols, back_vals = _coo(tmp_path / 'b.mtx')
+  assert back_rows.tolist() == rows.tolist() and back_cols.tolist() == cols.tolist()
+  if vals is None:
+    assert back_vals is None
+  else:
+    # Read back as the stored floats
+    assert back_vals.astype(bmtx_header.value_dtype).tolist() == vals.astype(bmtx_header.value_dtype).tolist()
+
+  # Values are written with enough digits: converting again gives the same file
+  mtx_to_bmtx(tmp_path / 'b.mtx', tmp_path / 'c.bmtx', double_values)
+  assert (tmp_path / 'c.bmtx').read_bytes() == (tmp_path / 'a.bmtx').read_bytes()
+
+
+def _dmmio_bmtx(name: str, tmp_path: Path, double_values: bool, live: bool) -> Path:
+  """distributed_mmio's conversion of `DMMIO_DATA/<name>.mtx`: the golden file, or (with `live`) a fresh conversion."""
+  if not live:
+    return dmmio_golden(name, double_values)
+  source = shutil.copy(DMMIO_DATA / f'{name}.mtx', tmp_path / f'{name}.mtx')
+  flags = Flags(binary_mtx=True, binary_mtx_double_vals=double_values, keep_mtx=True, keep_all_files=False, converter=BmtxConverter.DMMIO)
+  assert DatasetManager(tmp_path, 'test').convert_to_bmtx(source, flags, name)
+  return source.with_suffix('.bmtx')
+
+
+@pytest.mark.parametrize('live', [
+  False,
+  pytest.param(True, marks=pytest.mark.skipif(not MTX_TO_BMTX_CONVERTER.exists(), reason=f'distributed_mmio not built ({MTX_TO_BMTX_CONVERTER})')),
+], ids=['golden', 'live'])
+@pytest.mark.parametrize('double_values', [False, True])
+@pytest.mark.parametrize('name', DMMIO_MATRICES)
+def test_dmmio_bmtx_mtx(name, tmp_path, double_values, live):
+  """Files written by distributed_mmio read back as their source, and the native converter writes them again."""
+  source = DMMIO_DATA / f'{name}.mtx'
+  dmmio = _dmmio_bmtx(name, tmp_path, double_values, live)
+  bmtx_header, _ = read_bmtx_header(dmmio)
+  bmtx_to_mtx(dmmio, tmp_path / 'b.mtx')
+
+  symmetric = mtx.read_header(source).symmetry != 'general'
+  # Read back as the stored floats
+  value_dtype = bmtx_header.value_dtype if bmtx_header.value_bytes else np.float64
+  stored = lambda entries: [(r, c, float(np.array(v, dtype=value_dtype))) for r, c, v in entries]
+  assert stored(_full_entries(tmp_path / 'b.mtx', symmetric)) == stored(_full_entries(source, symmetric))
+
+  mtx_to_bmtx(tmp_path / 'b.mtx', tmp_path / 'c.bmtx', double_values)
+  assert (tmp_path / 'c.bmtx').read_bytes() == dmmio.read_bytes()
+
+
+@pytest.mark.parametrize('suffix', ['.mtx', '.bmtx'])
+def test_csr_export(mtx_file, tmp_path, suffix):
+  source = mtx_file
+  if suffix == '.bmtx':
+    source = tmp_path / 'm.bmtx'
+    mtx_to_bmtx(mtx_file, source, double_values=True)
+  symmetric = mtx.read_header(mtx_file).symmetry == 'symmetric'
+
+  header = export_csr(source)
+  matrix = load(source, mmap=False)
+
+  assert header.shape == matrix.shape
+  assert len(matrix.indptr) == header.nrows + 1 and matrix.indptr[-1] == header.nnz == len(matrix.indices)
+  rows = np.repeat(np.arange(header.nrows), np.diff(matrix.indptr))
+  for start, stop in zip(matrix.indptr[:-1], matrix.indptr[1:]):
+    assert np.all(np.diff(matrix.indices[start:stop]) >= 0)
+  data = matrix.data if matrix.data is not None else np.ones(header.nnz)
+  assert sorted(zip(rows.tolist(), matrix.indices.tolist(), data.tolist())) == _full_entries(source, symmetric)
+
+
+@pytest.mark.parametrize('suffix', ['.mtx', '.bmtx'])
+@pytest.mark.parametrize('partition', list(Partition))
+def test_shards_reassemble(mtx_file, tmp_path, suffix, partition):
+  source = mtx_file
+  if suffix == '.bmtx':
+    source = tmp_path / 'm.bmtx'
+    mtx_to_bmtx(mtx_file, source)
+  symmetric = mtx.read_header(mtx_file).symmetry == 'symmetric'
+
+  manifest = shard_matrix(source, parts=3, partition=partition)
+
+  assert read_manifest(source.with_suffix('.shards')) == manifest
+  assert [s.row_start for s in manifest.shards] == [0] + [s.row_stop for s in manifest.shards[:-1]]
+  assert manifest.shards[-1].row_stop == manifest.nrows
+  entries = []
+  for rank, info in enumerate(manifest.shards):
+    path = shard_path(source, rank)
+    assert path.suffix == suffix
+    shard_entries = _full_entries(path, symmetric=False)
+    assert len(shard_entries) == info.nnz
+    assert all(info.row_start <= row < info.row_stop for row, _, _ in shard_entries)
+    entries += shard_entries
+  assert sorted(entries) == _full_entries(source, symmetric)
+  assert manifest.nnz == len(entries)
@@ -0,0 +1,75 @@
+import errno
+import threading
+
+import pytest
+
+from mtxman.core import scratch
+from mtxman.core.core import DatasetManager, Flags
+from mtxman.core.scheduler import JobKind, MatrixTask, SyncScheduler
+from mtxman.core.scratch import ScratchDownload, ScratchSpace
+from mtxman.downloaders import direct_url
+
+# More than any scratch folder can hold: granted only when no other reservation is held
+HUGE = 1 << 60
+
+
+class _Downloader:
+  def __init__(self, error=None):
+    self.error = error
+
+  def remote_size(self, url):
+    return HUGE
+
+  def download(self, url, dest, connections=1, name=None):
+    if self.error is not None:
+      raise self.error
+    dest.write_bytes(b'PK')
+
+
+@pytest.fixture
+def fake_downloader(monkeypatch):
+  def install(error=None):
+    downloader = _Downloader(error)
+    monkeypatch.setattr(scratch, 'get_downloader', lambda: downloader)
+    monkeypatch.setattr(direct_url, 'get_downloader', lambda: downloader)
+  return install
+
+
+def _reserve_in_thread(space: ScratchSpace) -> bool:
+  """Whether a second (huge) reservation is granted, i.e., no reservation was leaked."""
+  granted = []
+  thread = threading.Thread(target=lambda: granted.append(space.reserve(HUGE, name='second')), daemon=True)
+  thread.start()
+  thread.join(timeout=10)
+  return bool(granted)
+
+
+def test_failed_zip_download_releases_scratch_space(tmp_path, fake_downloader):
+  fake_downloader(OSError(errno.ENOSPC, 'No space left on device'))
+  download = ScratchDownload(tmp_path / 'scratch', 0, 'm')
+  flags = Flags(False, False, False, False)
+
+  with pytest.raises(OSError):
+    direct_url._download_zip('https://example.org/m.zip', flags, download)
+
+  assert _reserve_in_thread(ScratchSpace.get(tmp_path / 'scratch'))
+
+
+def test_failure_hook_releases_scratch_space_of_skipped_steps(tmp_path, fake_downloader):
+  fake_downloader()
+  download = ScratchDownload(tmp_path / 'scratch', 0, 'm')
+  flags = Flags(False, False, False, False)
+  task = MatrixTask('m', tmp_path / 'm.mtx', DatasetManager(tmp_path, 'test'), False)
+  task.add_step(JobKind.NET, lambda: direct_url._download_zip('https://example.org/m.zip', flags, download))
+  # The task stops before the extraction step, which would release the reservation
+  task.add_step(JobKind.EXTRACT, lambda: False)
+  task.add_step(JobKind.EXTRACT, download.cleanup)
+  task.add_failure_hook(lambda: download.cleanup(keep_files=True))
+  scheduler = SyncScheduler()
+  scheduler.add([task])
+
+  scheduler.run()
+
+  assert not task.ok
+  assert _reserve_in_thread(ScratchSpace.get(tmp_path / 'scratch'))
+  assert (download.dir / 'm.zip').read_bytes() == b'PK'
@@ -0,0 +1,40 @@
+import re
+import subprocess
+import sys
+
+import pytest
+
+# Same budgets as `benchmarks/startup.py`, for the import time of each path (not the wall time,
+# which depends on the load of the machine)
+VERSION_BUDGET_MS = 300
+HELP_BUDGET_MS = 400
+# Commands import their backends lazily: importing the CLI must not import these
+HEAVY_MODULES = ('numpy', 'requests', 'yaml', 'bs4')
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)\s*$')
+
+
+def import_times(*args: str):
+  """(module, cumulative ms, depth) of every module imported by `python -X importtime <args>`."""
+  result = subprocess.run([sys.executable, '-X', 'importtime', *args], check=True, capture_output=True, text=True)
+  entries = []
+  for line in result.stderr.splitlines():
+    match = IMPORTTIME_LINE.match(line)
+    if match:
+      _, cumulative_us, indent, name = match.groups()
+      entries.append((name, int(cumulative_us) / 1e3, len(indent) // 2))
+  return entries
+
+
+def test_cli_import_is_light():
+  entries = import_times('-c', 'import mtxman.cli')
+  imported = {name.split('.')[0] for name, _, _ in entries}
+  assert sorted(imported & set(HEAVY_MODULES)) == []
+  assert {name: ms for name, ms, depth in entries if depth == 0}['mtxman.cli'] < VERSION_BUDGET_MS
+
+
+@pytest.mark.parametrize('flag, budget_ms', [('--version', VERSION_BUDGET_MS), ('--help', HELP_BUDGET_MS)])
+def test_command_imports_within_budget(flag, budget_ms):
+  # The CLI runs as __main__: its imports are top-level imports
+  entries = import_times('-m', 'mtxman.cli', flag)
+  assert sum(ms for _, ms, depth in entries if depth == 0) < budget_ms